@@ -0,0 +1,157 @@
+"""Bulk test plan generation over a JSONL file of requests.
+
+Each line is a JSON object with the same `texts` / `documents` / `feature_document`
+fields (and options) that `/test-plan` accepts, plus an optional `id`.
+
+    python batch.py requests.jsonl --output results.jsonl --concurrency 8 --retries 2
+
+Completed IDs are appended to a checkpoint file, so rerunning the same command after
+an interruption skips work that already finished.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(results, elapsed):
+    latencies = [result["latency"] for result in results]
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_minute": round(len(results) / elapsed * 60, 2) if elapsed > 0 else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+    }
+
+
+def parse_jsonl(lines):
+    """Parse JSONL lines into (id, request) pairs; blank lines are skipped, bad lines raise ValueError"""
+    items = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_number} is not valid JSON: {e}")
+        if not isinstance(request, dict):
+            raise ValueError(f"Line {line_number} must be a JSON object")
+        item_id = str(request.get("id", request.get("request_id", line_number)))
+        items.append((item_id, request))
+    return items
+
+
+async def run_batch(items, handler, concurrency=4, retries=2, backoff=1.0):
+    """Run `handler(request)` over (id, request) items and yield results in completion order.
+
+    `handler` returns a content dict; a dict with "error" is a permanent failure, while
+    exceptions are retried up to `retries` times with jittered exponential backoff.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_item(item_id, request):
+        async with semaphore:
+            started = time.perf_counter()
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    content = await handler(request)
+                except Exception as e:
+                    if attempts > retries:
+                        content = {"error": f"{type(e).__name__}: {e}"}
+                    else:
+                        await asyncio.sleep(backoff * 2 ** (attempts - 1) * (0.5 + random.random()))
+                        continue
+                break
+            result = {
+                "id": item_id,
+                "status": "error" if "error" in content else "ok",
+                "attempts": attempts,
+                "latency": round(time.perf_counter() - started, 3),
+            }
+            result.update(content)
+            return result
+
+    tasks = [asyncio.ensure_future(run_item(item_id, request)) for item_id, request in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+async def run_file(args):
+    # Imported here so `--help` works without AWS credentials or FastAPI installed
+    from main import run_test_plan
+
+    with open(args.input, encoding="utf-8") as f:
+        items = parse_jsonl(f)
+
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    completed = load_checkpoint(checkpoint_path)
+    pending = [(item_id, request) for item_id, request in items if item_id not in completed]
+    print(f"{len(items)} requests, {len(items) - len(pending)} already completed, {len(pending)} to run", file=sys.stderr)
+
+    async def handler(request):
+        content, _ = await run_test_plan(request, "batch", use_cache=not args.no_cache)
+        return content
+
+    results = []
+    started = time.perf_counter()
+    with open(args.output, "a", encoding="utf-8") as output, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        async for result in run_batch(pending, handler, args.concurrency, args.retries):
+            results.append(result)
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if result["status"] == "ok":
+                checkpoint.write(result["id"] + "\n")
+                checkpoint.flush()
+            print(f"[{len(results)}/{len(pending)}] {result['id']}: {result['status']} in {result['latency']}s", file=sys.stderr)
+
+    summary = summarize(results, time.perf_counter() - started)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate test plans for every request in a JSONL file")
+    parser.add_argument("input", help="JSONL file with one /test-plan request per line")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", help="File of completed IDs (default: <output>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests generated at once")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per request after a failure")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the plan cache lookup")
+    args = parser.parse_args(argv)
+    summary = asyncio.run(run_file(args))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
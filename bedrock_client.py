@@ -0,0 +1,302 @@
+import json
+import os
+import threading
+import time
+
+from chunking import estimate_tokens
+from metrics import observe_stage
+from storage import connect, shared_state_path
+
+DEFAULT_REGION = "us-east-1"
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call would have to wait longer than the limiter's `max_wait`"""
+
+    def __init__(self, model_id, wait):
+        super().__init__(f"Local rate limit for {model_id} needs a {wait:.1f}s wait")
+        self.model_id = model_id
+        self.wait = wait
+
+
+class TokenBucket:
+    """Refills `rate_per_minute` units per minute up to `capacity` (one minute's worth by default).
+
+    Callers reserve units up front and the level may go negative, so concurrent callers
+    queue in arrival order: each one is told how long to sleep before its turn.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.level = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount, now):
+        """Seconds until `amount` units would be available, without reserving them"""
+        self._refill(now)
+        # A single request above the per-minute budget waits for a full bucket, not forever
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Client-side requests-per-minute and tokens-per-minute limits, tracked per model.
+
+    Bedrock quotas are per model, so each model gets its own pair of buckets. A limit of
+    0 disables that bucket. Calls that would wait longer than `max_wait` seconds are
+    rejected with RateLimitExceeded instead, which the router treats like throttling.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_wait=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _model_buckets(self, model_id):
+        if model_id not in self._buckets:
+            self._buckets[model_id] = (
+                TokenBucket(self.requests_per_minute) if self.requests_per_minute else None,
+                TokenBucket(self.tokens_per_minute) if self.tokens_per_minute else None,
+            )
+        return self._buckets[model_id]
+
+    def reserve(self, model_id, tokens):
+        """Reserve one request and `tokens` for `model_id`; returns the seconds to wait first"""
+        with self._lock:
+            return self._reserve(self._model_buckets(model_id), model_id, tokens, time.monotonic())
+
+    def _reserve(self, buckets, model_id, tokens, now):
+        requests, token_bucket = buckets
+        wait = max(
+            requests.wait_for(1, now) if requests else 0.0,
+            token_bucket.wait_for(tokens, now) if token_bucket else 0.0,
+        )
+        if wait > self.max_wait:
+            self.rejected += 1
+            raise RateLimitExceeded(model_id, wait)
+        if requests:
+            requests.take(1)
+        if token_bucket:
+            token_bucket.take(tokens)
+        if wait > 0:
+            self.waits += 1
+        return wait
+
+    def refund(self, model_id, tokens):
+        """Return reserved tokens that the call turned out not to use"""
+        if tokens <= 0:
+            return
+        with self._lock:
+            _, token_bucket = self._model_buckets(model_id)
+            if token_bucket:
+                token_bucket.give_back(tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "waits": self.waits,
+                "rejected": self.rejected,
+            }
+
+
+class SharedRateLimiter(RateLimiter):
+    """A RateLimiter whose buckets live in a SQLite file, so worker processes share one budget.
+
+    Each reservation reads and updates the model's buckets in a single write transaction,
+    which queues concurrent reservations from every process in arrival order. Bucket times
+    are wall-clock, as monotonic clocks can't be compared across processes. `waits` and
+    `rejected` count this process's calls only.
+    """
+
+    def __init__(self, path, requests_per_minute=0, tokens_per_minute=0, max_wait=60.0):
+        super().__init__(requests_per_minute, tokens_per_minute, max_wait)
+        self.path = path
+        self._db = connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            "model TEXT NOT NULL, kind TEXT NOT NULL, level REAL NOT NULL, updated REAL NOT NULL, "
+            "PRIMARY KEY (model, kind))"
+        )
+        self._db.commit()
+
+    def _load(self, model_id, now):
+        """This model's (requests, tokens) buckets as last saved by any process"""
+        rows = {
+            kind: (level, updated) for kind, level, updated in self._db.execute(
+                "SELECT kind, level, updated FROM rate_limit_buckets WHERE model = ?", (model_id,)
+            )
+        }
+        buckets = []
+        for kind, rate in (("requests", self.requests_per_minute), ("tokens", self.tokens_per_minute)):
+            bucket = TokenBucket(rate) if rate else None
+            if bucket:
+                bucket.level, bucket.updated = rows.get(kind, (bucket.capacity, now))
+            buckets.append(bucket)
+        return tuple(buckets)
+
+    def _save(self, model_id, buckets):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO rate_limit_buckets (model, kind, level, updated) VALUES (?, ?, ?, ?)",
+            [
+                (model_id, kind, bucket.level, bucket.updated)
+                for kind, bucket in zip(("requests", "tokens"), buckets) if bucket
+            ]
+        )
+
+    def _update(self, model_id, change):
+        """Run `change(buckets, now)` on the stored buckets inside one write transaction"""
+        # The connection's context manager commits, or rolls back when `change` raises
+        with self._lock, self._db:
+            # IMMEDIATE takes the write lock up front, so no other process reads the same level
+            self._db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            buckets = self._load(model_id, now)
+            result = change(buckets, now)
+            self._save(model_id, buckets)
+            return result
+
+    def reserve(self, model_id, tokens):
+        """Reserve one request and `tokens` for `model_id`; returns the seconds to wait first"""
+        return self._update(model_id, lambda buckets, now: self._reserve(buckets, model_id, tokens, now))
+
+    def refund(self, model_id, tokens):
+        """Return reserved tokens that the call turned out not to use"""
+        if tokens <= 0:
+            return
+
+        def give_back(buckets, now):
+            _, token_bucket = buckets
+            if token_bucket:
+                token_bucket._refill(now)
+                token_bucket.give_back(tokens)
+
+        self._update(model_id, give_back)
+
+
+def _request_tokens(body):
+    """Tokens a request counts against the quota: its estimated input plus max_tokens"""
+    try:
+        max_tokens = json.loads(body).get("max_tokens", 0)
+    except ValueError:
+        max_tokens = 0
+    return estimate_tokens(body) + max_tokens
+
+
+class RateLimitedClient:
+    """Wraps a `bedrock-runtime` client so every invocation first waits its turn in a RateLimiter.
+
+    The wait happens in the calling thread, before the request is sent. Everything other
+    than the two invoke methods is passed through to the wrapped client.
+    """
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _wait_turn(self, model_id, tokens):
+        wait = self.limiter.reserve(model_id, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        observe_stage("rate_limit", wait)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        tokens = _request_tokens(body)
+        self._wait_turn(modelId, tokens)
+        response = self._client.invoke_model(modelId=modelId, body=body, **kwargs)
+        # Bedrock reports actual token counts in headers, so unused max_tokens can be returned
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        used_input = headers.get("x-amzn-bedrock-input-token-count")
+        used_output = headers.get("x-amzn-bedrock-output-token-count")
+        if used_input is not None and used_output is not None:
+            self.limiter.refund(modelId, tokens - int(used_input) - int(used_output))
+        return response
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        self._wait_turn(modelId, _request_tokens(body))
+        return self._client.invoke_model_with_response_stream(modelId=modelId, body=body, **kwargs)
+
+
+def client_config(**overrides):
+    """botocore Config for Bedrock, tuned by TESTBUDDY_BEDROCK_* environment variables.
+
+    Adaptive retries back off with jitter on ThrottlingException and slow the client down
+    while the service keeps throttling. The read timeout is sized for long generations
+    rather than botocore's 60 second default.
+    """
+    settings = {
+        "max_pool_connections": int(os.environ.get("TESTBUDDY_BEDROCK_POOL_SIZE", "50")),
+        "connect_timeout": float(os.environ.get("TESTBUDDY_BEDROCK_CONNECT_TIMEOUT", "10")),
+        "read_timeout": float(os.environ.get("TESTBUDDY_BEDROCK_READ_TIMEOUT", "300")),
+        "retries": {
+            "mode": "adaptive",
+            "max_attempts": int(os.environ.get("TESTBUDDY_BEDROCK_MAX_ATTEMPTS", "4")),
+        },
+        "tcp_keepalive": True,
+    }
+    settings.update(overrides)
+    # botocore and boto3 take a noticeable share of startup, so they load with the first client
+    from botocore.config import Config
+    return Config(**settings)
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def default_rate_limiter():
+    """The process-wide RateLimiter, configured by TESTBUDDY_BEDROCK_RPM / _TPM.
+
+    When the API runs as several worker processes it is a SharedRateLimiter, so the
+    budget holds for all of them together rather than for each one.
+    """
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            settings = {
+                "requests_per_minute": int(os.environ.get("TESTBUDDY_BEDROCK_RPM", "0")),
+                "tokens_per_minute": int(os.environ.get("TESTBUDDY_BEDROCK_TPM", "0")),
+                "max_wait": float(os.environ.get("TESTBUDDY_RATE_LIMIT_MAX_WAIT", "60")),
+            }
+            shared_path = shared_state_path()
+            if shared_path and (settings["requests_per_minute"] or settings["tokens_per_minute"]):
+                _default_limiter = SharedRateLimiter(shared_path, **settings)
+            else:
+                _default_limiter = RateLimiter(**settings)
+        return _default_limiter
+
+
+def create_client(service="bedrock-runtime", region_name=DEFAULT_REGION, limiter=None, config=None, **credentials):
+    """Create a Bedrock client with the shared config; `bedrock-runtime` clients are rate limited.
+
+    `credentials` are passed to boto3 (e.g. aws_access_key_id, aws_secret_access_key).
+    """
+    import boto3
+    client = boto3.client(service, region_name=region_name, config=config or client_config(), **credentials)
+    if service != "bedrock-runtime":
+        return client
+    limiter = limiter or default_rate_limiter()
+    return RateLimitedClient(client, limiter) if limiter.enabled else client
@@ -0,0 +1,196 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import observe_stage
+from prompts import encode_body
+
+_STREAM_END = object()
+
+
+class BedrockOverloadedError(Exception):
+    """Raised when a Bedrock call is rejected because the executor is saturated"""
+
+    def __init__(self, message, status_code=429, retry_after=1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _invoke_and_read(client, model_id, body):
+    """Invoke a model and read the full response body (both calls block)"""
+    response = client.invoke_model(modelId=model_id, body=encode_body(body, model_id))
+    return json.loads(response['body'].read())
+
+
+def decode_stream_event(event):
+    """Decode one `invoke_model_with_response_stream` event into its JSON message, or None"""
+    chunk = event.get('chunk')
+    if not chunk:
+        return None
+    return json.loads(chunk['bytes'])
+
+
+# Token counts of one call, as named in Bedrock's `usage`; stream_usage fills them in
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+
+def stream_usage(message, usage):
+    """Add the token counts a decoded stream message reports to `usage`.
+
+    message_start carries the input counts, prompt cache reads and writes included, and
+    message_delta the output tokens.
+    """
+    if message.get('type') == 'message_start':
+        reported = message.get('message', {}).get('usage', {})
+        for field in ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            usage[field] = reported.get(field, 0)
+    elif message.get('type') == 'message_delta':
+        usage["output_tokens"] += message.get('usage', {}).get('output_tokens', 0)
+
+
+def stream_text_delta(message):
+    """Return the generated text carried by a decoded stream message, if any"""
+    if message.get('type') == 'content_block_delta':
+        return message.get('delta', {}).get('text', '')
+    return ''
+
+
+class BedrockStream:
+    """Async iterator over the decoded messages of a Bedrock response stream.
+
+    The blocking event stream is drained on the executor's thread pool and handed to the
+    event loop through a queue. The executor slot is held until the draining thread exits,
+    which `aclose()` requests at the next stream event.
+    """
+
+    def __init__(self, executor, event_stream, loop):
+        self._event_stream = event_stream
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._stopped = threading.Event()
+        self._closed = False
+        self._pump = loop.run_in_executor(executor._pool, self._drain)
+        self._pump.add_done_callback(lambda _: executor._release())
+
+    def _drain(self):
+        try:
+            for event in self._event_stream:
+                if self._stopped.is_set():
+                    break
+                message = decode_stream_event(event)
+                if message is not None:
+                    self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+        except Exception as e:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, e)
+        finally:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, _STREAM_END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        item = await self._queue.get()
+        if item is _STREAM_END:
+            await self.aclose()
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            await self.aclose()
+            raise item
+        return item
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._stopped.set()
+
+
+class BedrockExecutor:
+    """Runs blocking Bedrock calls on a dedicated thread pool without blocking the event loop.
+
+    At most `max_in_flight` calls run at once. Up to `max_queue` further calls may wait
+    for a slot; beyond that new calls are rejected with 429, and calls that wait longer
+    than `queue_timeout` seconds are rejected with 503.
+    """
+
+    def __init__(self, max_in_flight=16, max_queue=64, queue_timeout=30.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="bedrock")
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def _acquire(self):
+        # Counters are updated before the first await so concurrent callers see them
+        if self.in_flight + self.waiting >= self.max_in_flight + self.max_queue:
+            raise BedrockOverloadedError("Too many queued Bedrock requests, retry later", status_code=429)
+
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            if self._semaphore.locked():
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            else:
+                await self._semaphore.acquire()
+        except asyncio.TimeoutError:
+            raise BedrockOverloadedError("Timed out waiting for a free Bedrock slot", status_code=503)
+        finally:
+            self.waiting -= 1
+            observe_stage("bedrock_queue", time.perf_counter() - started)
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on the Bedrock thread pool once a slot is free"""
+        await self._acquire()
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._release()
+            observe_stage("bedrock_call", time.perf_counter() - started)
+
+    async def invoke_model(self, client, model_id, body):
+        """Invoke a model and return the decoded JSON response"""
+        return await self.run(_invoke_and_read, client, model_id, body)
+
+    async def open_stream(self, client, model_id, body):
+        """Start a streaming invocation and return a `BedrockStream` of decoded messages.
+
+        The slot is acquired and the request sent before returning, so overload and
+        request errors surface to the caller before any response has been started.
+        """
+        await self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                self._pool,
+                functools.partial(client.invoke_model_with_response_stream, modelId=model_id, body=encode_body(body, model_id))
+            )
+        except BaseException:
+            self._release()
+            raise
+        return BedrockStream(self, response['body'], loop)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,147 @@
+"""Compare generated output tokens and wall time of the standard and compact plan formats.
+
+By default runs offline: plans of increasing size are generated in both formats through
+benchmarks/fake_bedrock.py, their output tokens are counted, generation time is modelled
+at `--tokens-per-second`, and the compact result is expanded locally and checked against
+the original plan.
+
+    python benchmarks/bench_compact_output.py --sizes 2 5 10 20 --tokens-per-second 60
+
+With `--live spec.txt` it instead calls Bedrock for real (AWS credentials required) with
+the API's prompts, reporting the output tokens Bedrock bills and the measured wall time.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chunking import estimate_tokens  # noqa: E402
+from compact_output import build_compact_body, compact_plan, compact_result_plan, expand_compact_plan  # noqa: E402
+from fake_bedrock import FakeBedrockRuntime, canned_plan  # noqa: E402
+from plan_parser import parse_plan_text  # noqa: E402
+from prompts import encode_body  # noqa: E402
+
+TEST_TYPE_NAMES = (
+    "Unit Tests", "Integration Tests", "UI Tests", "API Tests", "End-to-End Tests",
+    "Performance Tests", "Security Tests", "Database Tests", "Contract Tests", "Smoke Tests",
+)
+SAMPLE_SPEC = "Users can reset their password by email. The reset link expires after 30 minutes and can be used once."
+
+
+def invoke(client, model_id, body):
+    """One invoke_model call; returns (decoded result, wall seconds)"""
+    started = time.perf_counter()
+    response = client.invoke_model(modelId=model_id, body=encode_body(body, model_id))
+    result = json.loads(response["body"].read())
+    return result, time.perf_counter() - started
+
+
+def time_expand(data, repeats=20):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        expand_compact_plan(data)
+    return (time.perf_counter() - started) / repeats
+
+
+def run_offline(args):
+    print(f"{'cases':>6} {'std tok':>8} {'cmp tok':>8} {'saved':>6} {'std s':>7} {'cmp s':>7} {'expand ms':>10}  round-trip")
+    rows = []
+    for size in args.sizes:
+        plan = canned_plan(test_cases_per_type=size, test_types=TEST_TYPE_NAMES)
+        # The standard prompt yields indented JSON; tool input arrives compact
+        standard_text = json.dumps(plan, indent=2)
+        compact_data = compact_plan(plan)
+        max_tokens = estimate_tokens(standard_text) + 100
+
+        # The fake answers instantly; generation time is modelled from the token counts
+        fake = FakeBedrockRuntime(tokens_per_second=float("inf"), output_text=standard_text)
+        standard_result, _ = invoke(fake, "fake", {
+            "max_tokens": max_tokens, "messages": [{"role": "user", "content": SAMPLE_SPEC}],
+        })
+        compact_result, _ = invoke(fake, "fake", build_compact_body(SAMPLE_SPEC, max_tokens))
+        expanded, _ = compact_result_plan(compact_result)
+
+        standard_tokens = standard_result["usage"]["output_tokens"]
+        compact_tokens = compact_result["usage"]["output_tokens"]
+        standard_seconds = standard_tokens / args.tokens_per_second
+        compact_seconds = compact_tokens / args.tokens_per_second
+        row = {
+            "cases": size * len(TEST_TYPE_NAMES) + len(plan["uat_test_cases"]),
+            "standard_tokens": standard_tokens,
+            "compact_tokens": compact_tokens,
+            "saved": round(1 - compact_tokens / standard_tokens, 3),
+            "standard_seconds": round(standard_seconds, 3),
+            "compact_seconds": round(compact_seconds, 3),
+            "expand_ms": round(time_expand(compact_data) * 1000, 3),
+            "round_trip": expanded == parse_plan_text(standard_text),
+        }
+        rows.append(row)
+        print(
+            f"{row['cases']:>6} {standard_tokens:>8} {compact_tokens:>8} {row['saved']:>6.0%} "
+            f"{row['standard_seconds']:>7.2f} {row['compact_seconds']:>7.2f} {row['expand_ms']:>10.3f}  "
+            f"{'ok' if row['round_trip'] else 'MISMATCH'}"
+        )
+    return rows
+
+
+def run_live(args):
+    # Imported here so the offline run works without FastAPI or AWS credentials
+    from bedrock_client import create_client
+    from main import TEST_PLAN_MAX_TOKENS, build_test_plan_body
+
+    with open(args.live, encoding="utf-8") as f:
+        spec = f.read()
+    client = create_client("bedrock-runtime", region_name=args.region)
+    bodies = {
+        "standard": build_test_plan_body(spec),
+        "compact": build_compact_body(spec, TEST_PLAN_MAX_TOKENS),
+    }
+    print(f"{'format':<9} {'run':>4} {'out tok':>8} {'in tok':>7} {'wall s':>7} {'cases':>6}  stop")
+    rows = []
+    for run in range(1, args.repeats + 1):
+        for name, body in bodies.items():
+            result, seconds = invoke(client, args.model, body)
+            if name == "compact":
+                plan, _ = compact_result_plan(result)
+            else:
+                plan = parse_plan_text(result["content"][0]["text"])
+            cases = 0
+            if isinstance(plan, dict):
+                cases = sum(len(t.get("test_cases", [])) for t in plan.get("test_types", [])) + len(plan.get("uat_test_cases", []))
+            row = {
+                "format": name,
+                "run": run,
+                "output_tokens": result["usage"]["output_tokens"],
+                "input_tokens": result["usage"]["input_tokens"],
+                "seconds": round(seconds, 2),
+                "cases": cases,
+                "stop_reason": result.get("stop_reason"),
+            }
+            rows.append(row)
+            print(f"{name:<9} {run:>4} {row['output_tokens']:>8} {row['input_tokens']:>7} {row['seconds']:>7.2f} {cases:>6}  {row['stop_reason']}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 5, 10, 20], help="Test cases per test type")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="Generation speed the offline run models wall time with")
+    parser.add_argument("--live", metavar="SPEC", help="Call Bedrock with this spec instead of running offline")
+    parser.add_argument("--model", default="anthropic.claude-3-sonnet-20240229-v1:0")
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--repeats", type=int, default=3, help="Calls per format in a live run")
+    parser.add_argument("--json", help="Write the results to this file for comparing runs")
+    args = parser.parse_args(argv)
+
+    rows = run_live(args) if args.live else run_offline(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
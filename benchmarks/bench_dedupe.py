@@ -0,0 +1,102 @@
+"""Measure near-duplicate detection time and accuracy against plan size.
+
+Builds synthetic plans where a share of the test cases are reworded copies of cases in
+other test types, runs dedupe.dedupe_plan on them and reports the time taken and how many
+of the planted duplicates were found.
+
+    python benchmarks/bench_dedupe.py --sizes 500 2000 5000 --duplicate-rate 0.2
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dedupe import DEFAULT_THRESHOLD, dedupe_plan  # noqa: E402
+
+TEST_TYPE_NAMES = [
+    "Unit Tests", "Integration Tests", "UI Tests", "API Tests", "End-to-End Tests",
+    "Performance Tests", "Security Tests", "Database Tests", "Contract Tests", "Smoke Tests",
+]
+SUBJECTS = ["login", "checkout", "password reset", "invoice export", "search", "profile update", "cart", "refund",
+            "signup", "order history", "coupon", "shipping quote", "notification", "report", "upload", "admin audit"]
+CHECKS = ["rejects an empty", "accepts a valid", "rate limits a repeated", "logs an audited", "times out a slow",
+          "returns 404 for an unknown", "escapes a malicious", "paginates a large", "retries a failed", "caches a stable"]
+FIELDS = ["email", "token", "amount", "query", "currency", "address", "session", "payload", "locale", "file"]
+ACTIONS = ["Prepare", "Seed", "Mock", "Configure", "Record", "Replay", "Stub", "Generate"]
+TARGETS = ["database fixture", "API client", "browser session", "message queue", "feature flag", "clock", "cache", "tenant"]
+ASSERTS = ["status code", "error message", "audit entry", "metrics counter", "response time", "UI banner", "email", "schema"]
+
+
+def synthetic_case(rng, number):
+    subject, check, field = rng.choice(SUBJECTS), rng.choice(CHECKS), rng.choice(FIELDS)
+    return {
+        "name": f"{subject.title()} {check} {field} #{number}",
+        "objective": f"Verify the {subject} flow {check} {field}",
+        "prerequisites": ["Service deployed", f"Fixture {number} loaded"],
+        "implementation_steps": [
+            f"{rng.choice(ACTIONS)} the {rng.choice(TARGETS)} for {subject}",
+            f"{rng.choice(ACTIONS)} the {rng.choice(TARGETS)} with a {rng.choice(FIELDS)} value",
+            f"Send a {field} value the flow {check}",
+            f"Assert the {rng.choice(ASSERTS)} and the {rng.choice(ASSERTS)}",
+        ],
+        "expected_results": "The documented status code and message are returned",
+    }
+
+
+def reworded(rng, test_case):
+    """A near-duplicate: same check, one step reworded and a different name prefix"""
+    copy_case = copy.deepcopy(test_case)
+    copy_case["name"] = "Validate " + copy_case["name"][0].lower() + copy_case["name"][1:]
+    steps = copy_case["implementation_steps"]
+    steps[rng.randrange(len(steps))] += " and assert on it"
+    return copy_case
+
+
+def synthetic_plan(rng, total_cases, duplicate_rate):
+    per_type = max(1, total_cases // len(TEST_TYPE_NAMES))
+    plan = {"test_types": [{"type": name, "description": "", "test_cases": []} for name in TEST_TYPE_NAMES]}
+    originals = []
+    planted = 0
+    for number in range(per_type * len(TEST_TYPE_NAMES)):
+        target = plan["test_types"][number % len(TEST_TYPE_NAMES)]["test_cases"]
+        if originals and rng.random() < duplicate_rate:
+            target.append(reworded(rng, rng.choice(originals)))
+            planted += 1
+        else:
+            test_case = synthetic_case(rng, number)
+            originals.append(test_case)
+            target.append(test_case)
+    return plan, planted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 2000, 5000])
+    parser.add_argument("--duplicate-rate", type=float, default=0.2, help="Share of cases planted as near-duplicates")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{'cases':>6} {'planted':>8} {'found':>6} {'groups':>7} {'best ms':>8} {'mean ms':>8}")
+    for size in args.sizes:
+        plan, planted = synthetic_plan(random.Random(args.seed), size, args.duplicate_rate)
+        timings = []
+        for _ in range(args.repeats):
+            working = copy.deepcopy(plan)
+            started = time.perf_counter()
+            _, stats = dedupe_plan(working, "flag", args.threshold)
+            timings.append(time.perf_counter() - started)
+        print(
+            f"{stats['cases']:>6} {planted:>8} {stats['duplicates']:>6} {stats['groups']:>7} "
+            f"{min(timings) * 1000:>8.1f} {sum(timings) / len(timings) * 1000:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
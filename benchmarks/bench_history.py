@@ -0,0 +1,92 @@
+"""Measure plan history recording and search time against the number of stored plans.
+
+Fills a temporary history store with synthetic plans, timing how long each plan takes
+to record and index, then times full-text searches for a mix of common, rare and
+prefix queries at each store size.
+
+    python benchmarks/bench_history.py --plans 100 1000 5000 --cases-per-plan 40
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from history import PlanHistory, input_hash  # noqa: E402
+
+TEST_TYPE_NAMES = [
+    "Unit Tests", "Integration Tests", "UI Tests", "API Tests", "End-to-End Tests",
+    "Performance Tests", "Security Tests", "Database Tests", "Contract Tests", "Smoke Tests",
+]
+SUBJECTS = ["login", "checkout", "password reset", "invoice export", "search", "profile update", "cart", "refund",
+            "signup", "order history", "coupon", "shipping quote", "notification", "report", "upload", "admin audit"]
+CHECKS = ["rejects an empty", "accepts a valid", "rate limits a repeated", "logs an audited", "times out a slow",
+          "returns 404 for an unknown", "escapes a malicious", "paginates a large", "retries a failed", "caches a stable"]
+FIELDS = ["email", "token", "amount", "query", "currency", "address", "session", "payload", "locale", "file"]
+QUERIES = ["password reset", "checkout amount", "malicious payload", "rate limit token", "invoice exp", "admin audit entry"]
+
+
+def synthetic_plan(rng, cases):
+    per_type = max(1, cases // len(TEST_TYPE_NAMES))
+    test_types = []
+    for name in TEST_TYPE_NAMES:
+        test_cases = []
+        for _ in range(per_type):
+            subject, check, field = rng.choice(SUBJECTS), rng.choice(CHECKS), rng.choice(FIELDS)
+            test_cases.append({
+                "name": f"{subject.title()} {check} {field}",
+                "objective": f"Verify the {subject} flow {check} {field}",
+                "prerequisites": ["Service deployed"],
+                "implementation_steps": [f"Open the {subject} flow", f"Send a {field} value", "Assert the response"],
+                "expected_results": "The documented status code and message are returned",
+            })
+        test_types.append({"type": name, "description": "", "test_cases": test_cases})
+    return {"test_types": test_types, "uat_test_cases": []}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plans", type=int, nargs="+", default=[100, 1000, 5000], help="Store sizes to search at")
+    parser.add_argument("--cases-per-plan", type=int, default=40)
+    parser.add_argument("--limit", type=int, default=20, help="Results per search")
+    parser.add_argument("--repeats", type=int, default=20, help="Searches per query at each size")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        history = PlanHistory(os.path.join(directory, "history.sqlite3"))
+        print(f"{'plans':>6} {'cases':>8} {'record ms':>10} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'hits':>5}")
+        stored = 0
+        for size in sorted(args.plans):
+            record_times = []
+            while stored < size:
+                plan = synthetic_plan(rng, args.cases_per_plan)
+                started = time.perf_counter()
+                history.record(plan, input_hash(str(stored)), model="synthetic", source="benchmark")
+                record_times.append(time.perf_counter() - started)
+                stored += 1
+            search_times = []
+            hits = 0
+            for _ in range(args.repeats):
+                for query in QUERIES:
+                    started = time.perf_counter()
+                    hits += len(history.search(query, limit=args.limit))
+                    search_times.append(time.perf_counter() - started)
+            search_times.sort()
+            print(
+                f"{stored:>6} {history.stats()['test_cases']:>8} "
+                f"{statistics.mean(record_times) * 1000 if record_times else 0:>10.2f} "
+                f"{search_times[len(search_times) // 2] * 1000:>7.2f} "
+                f"{search_times[int(len(search_times) * 0.95)] * 1000:>7.2f} {search_times[-1] * 1000:>7.2f} "
+                f"{hits // len(search_times):>5}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Measure prompt cache reads, input cost and time to first token against the fake Bedrock runtime.
+
+Streams `--calls` requests with different documents for each prompt (API, Streamlit,
+compact and one focused fan-out prompt) to `--model`, once with cache markers stripped
+and once with them sent, and reports the cached prompt prefix size, cache reads and
+writes, the input cost relative to no caching (cache writes bill at 1.25x, reads at 0.1x)
+and the mean time to first token. The fake spends `--prefill-tokens-per-second` on every
+uncached input token and only caches prefixes of at least the model's minimum, as Bedrock
+does; `--min-prefix-tokens` overrides it. Today's prefixes are below every model's
+minimum, so pass `--min-prefix-tokens 0` to see what caching them would gain.
+
+    python benchmarks/bench_prompt_cache.py --calls 20 --document-tokens 2000 --prefill-tokens-per-second 4000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import prompts  # noqa: E402
+from bedrock_executor import USAGE_FIELDS, decode_stream_event, stream_text_delta, stream_usage  # noqa: E402
+from chunking import estimate_tokens  # noqa: E402
+from compact_output import build_compact_body  # noqa: E402
+from engine import TEST_PLAN_MAX_TOKENS, build_test_plan_body  # noqa: E402
+from fake_bedrock import FakeBedrockRuntime, LatencyModel  # noqa: E402
+from fan_out import build_focused_body  # noqa: E402
+from model_router import prompt_cache_min_tokens  # noqa: E402
+
+# Claude Sonnet 4 through its cross-region inference profile, as model discovery returns it
+MODEL_ID = "us.anthropic.claude-sonnet-4-20250514-v1:0"
+BODIES = {
+    "api": lambda document: build_test_plan_body(prompts.API_QA_PROMPT, document),
+    "ui": lambda document: build_test_plan_body(prompts.UI_QA_PROMPT, document),
+    "compact": lambda document: build_compact_body(document, TEST_PLAN_MAX_TOKENS),
+    "focused:security": lambda document: build_focused_body("security", document),
+}
+SENTENCES = [
+    "Users reset their password through a link that expires after {n} minutes.",
+    "Admins export invoices for up to {n} accounts as CSV.",
+    "The search endpoint returns at most {n} results per page.",
+    "Checkout rejects carts with more than {n} distinct items.",
+    "Sessions are revoked after {n} failed login attempts.",
+]
+
+
+def synthetic_document(rng, tokens):
+    sentences = []
+    while estimate_tokens(" ".join(sentences)) < tokens:
+        sentences.append(rng.choice(SENTENCES).format(n=rng.randint(2, 500)))
+    return " ".join(sentences)
+
+
+def prefix_tokens(body):
+    return estimate_tokens(json.dumps(body.get("tools", []) + body.get("system", [])))
+
+
+def stream_once(fake, model_id, body):
+    """Stream one response; returns (usage, seconds to first text)"""
+    started = time.perf_counter()
+    response = fake.invoke_model_with_response_stream(modelId=model_id, body=prompts.encode_body(body, model_id))
+    usage = dict.fromkeys(USAGE_FIELDS, 0)
+    first_token = None
+    for event in response["body"]:
+        message = decode_stream_event(event)
+        if message is None:
+            continue
+        stream_usage(message, usage)
+        if first_token is None and stream_text_delta(message):
+            first_token = time.perf_counter() - started
+    return usage, first_token
+
+
+def run(name, cache, args):
+    prompts.PROMPT_CACHE = cache
+    fake = FakeBedrockRuntime(
+        latency=LatencyModel("constant", mean=args.latency),
+        tokens_per_second=1e6,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        prompt_cache_min_tokens=args.min_prefix_tokens,
+    )
+    rng = random.Random(args.seed)
+    totals = dict.fromkeys(USAGE_FIELDS, 0)
+    first_tokens = []
+    for _ in range(args.calls):
+        usage, first_token = stream_once(fake, args.model, BODIES[name](synthetic_document(rng, args.document_tokens)))
+        for field in USAGE_FIELDS:
+            totals[field] += usage[field]
+        first_tokens.append(first_token)
+    cost = (
+        totals["input_tokens"] + 1.25 * totals["cache_creation_input_tokens"] + 0.1 * totals["cache_read_input_tokens"]
+    )
+    return {
+        "reads": fake.stats()["cache_reads"],
+        "read_tokens": totals["cache_read_input_tokens"],
+        "write_tokens": totals["cache_creation_input_tokens"],
+        "input_tokens": totals["input_tokens"],
+        "input_cost": cost,
+        "ttft_ms": statistics.mean(first_tokens) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", nargs="+", choices=list(BODIES), default=list(BODIES))
+    parser.add_argument("--calls", type=int, default=20, help="Requests per prompt and mode")
+    parser.add_argument("--document-tokens", type=int, default=1000)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=5000.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed seconds added to every first token")
+    parser.add_argument("--model", default=MODEL_ID, help="Model ID the requests are sent to")
+    parser.add_argument("--min-prefix-tokens", type=int, help="Cache minimum to simulate instead of the model's own")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write the results to this file for comparing runs")
+    args = parser.parse_args(argv)
+
+    min_tokens = args.min_prefix_tokens if args.min_prefix_tokens is not None else prompt_cache_min_tokens(args.model)
+    print(f"{args.model}: prefixes of at least {min_tokens} tokens are cached" if min_tokens is not None
+          else f"{args.model}: no prompt caching")
+    print(f"{'prompt':<17} {'prefix':>6} {'cache':>5} {'reads':>5} {'read tok':>9} {'write tok':>9} "
+          f"{'input tok':>9} {'cost x':>6} {'ttft ms':>8}")
+    rows = []
+    for name in args.prompts:
+        prefix = prefix_tokens(BODIES[name]("x"))
+        baseline = None
+        for cache in (False, True):
+            result = run(name, cache, args)
+            baseline = baseline or result["input_cost"]
+            row = {
+                "prompt": name,
+                "prefix_tokens": prefix,
+                "cache": cache,
+                **result,
+                "relative_cost": round(result["input_cost"] / baseline, 3),
+            }
+            rows.append(row)
+            print(
+                f"{name:<17} {prefix:>6} {'on' if cache else 'off':>5} {row['reads']:>5} {row['read_tokens']:>9} "
+                f"{row['write_tokens']:>9} {row['input_tokens']:>9} {row['relative_cost']:>6.2f} {row['ttft_ms']:>8.1f}"
+            )
+    prompts.PROMPT_CACHE = True
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
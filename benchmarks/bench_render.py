@@ -0,0 +1,107 @@
+"""Measure how results-view rendering scales with test plan size.
+
+Always times building the section HTML with plan_renderer. When Streamlit is installed it
+also runs streamlit_app.py headlessly with AppTest and times the initial render and the
+rerun triggered by ticking a test case checkbox, with every section expanded.
+
+    python benchmarks/bench_render.py --sizes 10 50 150 500
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from plan_renderer import CompletionIndex, page_count, render_section_page_html  # noqa: E402
+
+TEST_TYPE_NAMES = [
+    "Unit Tests", "Integration Tests", "UI Tests", "API Tests", "End-to-End Tests",
+    "Performance Tests", "Security Tests", "Database Tests", "Contract Tests", "Smoke Tests",
+]
+
+
+def synthetic_plan(total_cases):
+    per_type = max(1, total_cases // len(TEST_TYPE_NAMES))
+    return {
+        "test_types": [
+            {
+                "type": name,
+                "description": f"{name} for the checkout feature",
+                "test_cases": [
+                    {
+                        "name": f"{name} case {i}: validate <input> & edge cases",
+                        "objective": "Verify the component behaves correctly for valid and invalid input " * 2,
+                        "prerequisites": [f"Prerequisite {j}" for j in range(3)],
+                        "implementation_steps": [f"Step {j}: perform action and capture output" for j in range(6)],
+                        "expected_results": "The system responds with the documented status and payload",
+                    }
+                    for i in range(1, per_type + 1)
+                ],
+            }
+            for name in TEST_TYPE_NAMES
+        ]
+    }
+
+
+def time_html(plan, repeats=5):
+    completion = CompletionIndex()
+    completion.set(plan["test_types"][0]["type"], 1, True)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for test_type in plan["test_types"]:
+            for page in range(1, page_count(test_type) + 1):
+                render_section_page_html(test_type, page, completion)
+    return (time.perf_counter() - started) / repeats
+
+
+def time_app(plan):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, "streamlit_app.py"), default_timeout=120)
+    app.secrets["AWS_DEFAULT_REGION"] = "us-east-1"
+    app.secrets["AWS_ACCESS_KEY_ID"] = "benchmark"
+    app.secrets["AWS_SECRET_ACCESS_KEY"] = "benchmark"
+    app.session_state["test_plan"] = plan
+    app.session_state["expanded_sections"] = {test_type["type"] for test_type in plan["test_types"]}
+
+    started = time.perf_counter()
+    app.run()
+    initial = time.perf_counter() - started
+
+    first_key = f"{plan['test_types'][0]['type']}_1"
+    started = time.perf_counter()
+    app.checkbox(key=first_key).check().run()
+    rerun = time.perf_counter() - started
+    return initial, rerun
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 150, 500, 1000])
+    parser.add_argument("--html-only", action="store_true", help="Skip the AppTest rerun measurements")
+    args = parser.parse_args(argv)
+
+    try:
+        import streamlit.testing.v1  # noqa: F401
+        run_app = not args.html_only
+    except ImportError:
+        run_app = False
+        print("streamlit not installed, timing HTML rendering only", file=sys.stderr)
+
+    header = f"{'cases':>6} {'html ms':>9}"
+    if run_app:
+        header += f" {'initial ms':>11} {'rerun ms':>9}"
+    print(header)
+    for size in args.sizes:
+        plan = synthetic_plan(size)
+        row = f"{size:>6} {time_html(plan) * 1000:>9.2f}"
+        if run_app:
+            initial, rerun = time_app(plan)
+            row += f" {initial * 1000:>11.1f} {rerun * 1000:>9.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Measure cold import time of the app's modules and which heavy dependencies they load.
+
+Each module is imported in a fresh interpreter, `--repeats` times, reporting the median
+and best wall time and which of boto3, botocore, PyPDF2, docx and numpy were loaded along
+the way; those should only load on first use or from the background prewarm. Modules
+whose dependencies are not installed are reported as unavailable. Also compares rendering
+a precompiled prompt with str.format on the same template.
+
+    python benchmarks/bench_startup.py --modules engine main streamlit_app --repeats 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from prompts import API_QA_PROMPT  # noqa: E402
+
+HEAVY_MODULES = ["boto3", "botocore", "PyPDF2", "docx", "numpy"]
+DEFAULT_MODULES = [
+    "prompts", "engine", "document_extraction", "bedrock_client", "list_models", "dedupe", "fan_out",
+    "compact_output", "history", "main",
+]
+
+# Runs in the child interpreter: import one module, report the time and what got loaded
+PROBE = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+try:
+    __import__(sys.argv[2])
+except ImportError as e:
+    print(json.dumps({"error": str(e)}))
+else:
+    seconds = time.perf_counter() - started
+    print(json.dumps({"seconds": seconds, "loaded": [m for m in sys.argv[3:] if m in sys.modules]}))
+"""
+
+
+def probe(module):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, ROOT, module, *HEAVY_MODULES],
+        capture_output=True, text=True, cwd=ROOT, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def time_render(document, repeats):
+    template = API_QA_PROMPT.text
+    started = time.perf_counter()
+    for _ in range(repeats):
+        template.format(input_document=document)
+    formatted = (time.perf_counter() - started) / repeats
+    started = time.perf_counter()
+    for _ in range(repeats):
+        API_QA_PROMPT.render(input_document=document)
+    rendered = (time.perf_counter() - started) / repeats
+    return formatted, rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--document-chars", type=int, default=50_000, help="Input size for the prompt render comparison")
+    parser.add_argument("--json", help="Write the results to this file for comparing runs")
+    args = parser.parse_args(argv)
+
+    print(f"{'module':<22} {'median ms':>10} {'best ms':>8}  heavy modules loaded")
+    rows = []
+    for module in args.modules:
+        results = [probe(module) for _ in range(args.repeats)]
+        if "error" in results[0]:
+            rows.append({"module": module, "error": results[0]["error"]})
+            print(f"{module:<22} {'unavailable':>10}           {results[0]['error']}")
+            continue
+        seconds = [result["seconds"] for result in results]
+        row = {
+            "module": module,
+            "median_ms": round(statistics.median(seconds) * 1000, 2),
+            "best_ms": round(min(seconds) * 1000, 2),
+            "loaded": results[0]["loaded"],
+        }
+        rows.append(row)
+        print(f"{module:<22} {row['median_ms']:>10.2f} {row['best_ms']:>8.2f}  {', '.join(row['loaded']) or '-'}")
+
+    document = ("The user resets a password through the emailed link. " * (args.document_chars // 54 + 1))[:args.document_chars]
+    formatted, rendered = time_render(document, 2000)
+    print(f"\nprompt render ({args.document_chars} chars): str.format {formatted * 1e6:.1f} µs · precompiled {rendered * 1e6:.1f} µs")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": vars(args),
+                "imports": rows,
+                "render_us": {"format": round(formatted * 1e6, 2), "precompiled": round(rendered * 1e6, 2)},
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
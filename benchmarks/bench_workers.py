@@ -0,0 +1,137 @@
+"""Measure how much Bedrock budget N worker processes admit with per-process and shared rate limiters.
+
+Starts N processes that each reserve calls for one model as fast as they can for
+`--seconds`, with `max_wait=0` so a call is admitted only when the budget has room and
+rejected otherwise. With a RateLimiter per process the workers together admit about N
+times the quota, which Bedrock would then throttle; with the SQLite-backed
+SharedRateLimiter they admit the quota once. Also reports the reservation latency and
+the time to render /metrics aggregated over N published processes.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --rpm 600 --seconds 3
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bedrock_client import RateLimiter, RateLimitExceeded, SharedRateLimiter  # noqa: E402
+from metrics import HTTP_REQUESTS, REGISTRY, STAGE_SECONDS, SharedMetrics  # noqa: E402
+
+MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+
+
+def reserve_loop(mode, path, rpm, seconds, start, results):
+    if mode == "shared":
+        limiter = SharedRateLimiter(path, requests_per_minute=rpm, max_wait=0)
+    else:
+        limiter = RateLimiter(requests_per_minute=rpm, max_wait=0)
+    start.wait()
+    admitted = 0
+    latencies = []
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            limiter.reserve(MODEL_ID, 0)
+            admitted += 1
+        except RateLimitExceeded:
+            pass
+        latencies.append(time.perf_counter() - started)
+    results.put((admitted, statistics.median(latencies)))
+
+
+def run_limiters(mode, workers, rpm, seconds, directory):
+    path = os.path.join(directory, f"{mode}-{workers}.sqlite3")
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=reserve_loop, args=(mode, path, rpm, seconds, start, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # Let every process open its limiter before the clock starts
+    time.sleep(0.5)
+    start.set()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return sum(admitted for admitted, _ in outcomes), statistics.median(latency for _, latency in outcomes)
+
+
+def publish_snapshot(path, ready):
+    for stage in ("extraction", "prompt_build", "bedrock_call", "parse", "render"):
+        STAGE_SECONDS.observe(0.1, stage=stage)
+    HTTP_REQUESTS.inc(endpoint="POST /test-plan", status=200)
+    shared = SharedMetrics(path)
+    shared.publish()
+    ready.put(True)
+
+
+def time_render(workers, directory, repeats=20):
+    path = os.path.join(directory, f"metrics-{workers}.sqlite3")
+    ready = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=publish_snapshot, args=(path, ready)) for _ in range(workers - 1)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+    for process in processes:
+        process.join()
+    # Published by exited processes, so they still count as live for the gauges: a worst case
+    REGISTRY.shared = SharedMetrics(path)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        REGISTRY.render()
+        timings.append(time.perf_counter() - started)
+    REGISTRY.shared = None
+    return statistics.median(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--rpm", type=int, default=600, help="Requests-per-minute quota for the one model")
+    parser.add_argument("--seconds", type=float, default=3.0, help="How long each level reserves for")
+    parser.add_argument("--json", help="Write the results to this file for comparing runs")
+    args = parser.parse_args(argv)
+
+    # A full bucket plus what refills during the run
+    quota = args.rpm + args.rpm / 60.0 * args.seconds
+    print(f"budget for {args.seconds:g}s at {args.rpm} rpm: {quota:.0f} calls")
+    print(f"{'workers':>7} {'limiter':>9} {'admitted':>9} {'x budget':>9} {'reserve µs':>11} {'render ms':>10}")
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in args.workers:
+            render = time_render(workers, directory)
+            for mode in ("process", "shared"):
+                admitted, latency = run_limiters(mode, workers, args.rpm, args.seconds, directory)
+                row = {
+                    "workers": workers,
+                    "limiter": mode,
+                    "admitted": admitted,
+                    "over_budget": round(admitted / quota, 2),
+                    "reserve_us": round(latency * 1e6, 1),
+                    "render_ms": round(render * 1000, 2),
+                }
+                rows.append(row)
+                print(
+                    f"{workers:>7} {mode:>9} {admitted:>9} {row['over_budget']:>9.2f} "
+                    f"{row['reserve_us']:>11.1f} {row['render_ms'] if mode == 'shared' else '':>10}"
+                )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
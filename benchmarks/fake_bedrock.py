@@ -0,0 +1,318 @@
+"""A local stand-in for the `bedrock-runtime` client, for load tests and offline runs.
+
+Implements `invoke_model` and `invoke_model_with_response_stream` with the same response
+shapes as boto3, returning a canned test plan capped at `max_tokens`. Latency, streaming
+speed, throttling and truncation are configurable so capacity runs are repeatable:
+
+    fake = FakeBedrockRuntime(latency=LatencyModel("lognormal", mean=0.8, sigma=0.4),
+                              tokens_per_second=400, throttle_rate=0.05, truncate_rate=0.1)
+
+Prompt caching is simulated too: usage reports cache_read_input_tokens and
+cache_creation_input_tokens for prefixes marked with cache_control, and
+`prefill_tokens_per_second` makes uncached input tokens add to the time to first token.
+"""
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+
+CHARS_PER_TOKEN = 4
+# Seconds an unused prompt cache entry lives, as on Bedrock
+PROMPT_CACHE_TTL = 300
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    class ClientError(Exception):
+        """Minimal copy of botocore's ClientError for environments without boto3"""
+
+        def __init__(self, error_response, operation_name):
+            self.response = error_response
+            self.operation_name = operation_name
+            code = error_response.get("Error", {}).get("Code")
+            super().__init__(f"An error occurred ({code}) when calling the {operation_name} operation")
+
+
+class LatencyModel:
+    """Time to first token, drawn from a constant, uniform, normal or lognormal distribution"""
+
+    def __init__(self, distribution="lognormal", mean=0.5, sigma=0.3, seed=None):
+        if distribution not in ("constant", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean = mean
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.distribution == "constant":
+                return self.mean
+            if self.distribution == "uniform":
+                return self._random.uniform(max(0.0, self.mean - self.sigma), self.mean + self.sigma)
+            if self.distribution == "normal":
+                return max(0.0, self._random.gauss(self.mean, self.sigma))
+            # sigma is the spread of the underlying normal; mu is chosen so the mean stays `mean`
+            mu = math.log(max(self.mean, 1e-6)) - self.sigma ** 2 / 2
+            return self._random.lognormvariate(mu, self.sigma)
+
+
+def canned_plan(test_cases_per_type=4, test_types=("Unit Tests", "API Tests", "Security Tests")):
+    """A plan in the app's response schema, used as the fake model's output"""
+    return {
+        "test_types": [
+            {
+                "type": name,
+                "description": f"{name} for the feature under test",
+                "test_cases": [
+                    {
+                        "name": f"{name} case {i}",
+                        "objective": "Verify the documented behaviour for valid and invalid input",
+                        "prerequisites": ["Service deployed to the test environment", "Seed data loaded"],
+                        "implementation_steps": [f"Step {j}: send the request and capture the response" for j in range(1, 5)],
+                        "expected_results": "The documented status code and payload are returned",
+                    }
+                    for i in range(1, test_cases_per_type + 1)
+                ],
+            }
+            for name in test_types
+        ],
+        "uat_test_cases": [
+            {
+                "test_case_id": f"UAT-{i:03d}",
+                "test_case_name": f"Business scenario {i}",
+                "test_objective": "Confirm the feature meets the business requirement",
+                "preconditions": "User has an active account",
+                "test_steps": ["Log in", "Perform the scenario", "Review the outcome"],
+                "expected_result": "The outcome matches the requirement",
+                "actual_result": "",
+                "status": "Not Run",
+            }
+            for i in range(1, 3)
+        ],
+    }
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class FakeBedrockRuntime:
+    """Drop-in replacement for `boto3.client('bedrock-runtime')` in tests and benchmarks.
+
+    Every call sleeps for a sampled time to first token plus output tokens at
+    `tokens_per_second` (streamed in `chunk_tokens` pieces for streaming calls).
+    `throttle_rate` of calls raise ThrottlingException before any output, and
+    `truncate_rate` of calls stop early with `stop_reason: "max_tokens"`; continuation
+    requests that prefill the partial output get the rest of the text. Requests with
+    `tools` get the plan as a compact_output tool call.
+
+    The tools and system prompt up to the last cache_control marker are cached per model
+    for PROMPT_CACHE_TTL seconds when they reach the model's minimum in
+    model_router.PROMPT_CACHE_FAMILIES (or `prompt_cache_min_tokens` if set), like Bedrock:
+    the first call reports them as cache_creation_input_tokens and later ones as
+    cache_read_input_tokens. Markers sent to a model without prompt caching are rejected
+    with a ValidationException, as Bedrock does.
+    """
+
+    def __init__(self, latency=None, tokens_per_second=200.0, throttle_rate=0.0, truncate_rate=0.0,
+                 output_text=None, chunk_tokens=8, seed=None, prefill_tokens_per_second=None,
+                 prompt_cache_min_tokens=None):
+        self.latency = latency or LatencyModel("constant", mean=0.0)
+        self.tokens_per_second = tokens_per_second
+        self.throttle_rate = throttle_rate
+        self.truncate_rate = truncate_rate
+        self.output_text = output_text or json.dumps(canned_plan(), indent=2)
+        self.chunk_tokens = chunk_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # prefix hash -> expiry time
+        self._prompt_cache = {}
+        self.calls = 0
+        self.throttled = 0
+        self.truncated = 0
+        self.cache_reads = 0
+        self.cache_writes = 0
+
+    def _roll(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+    def _start_call(self, operation):
+        with self._lock:
+            self.calls += 1
+        if self._roll(self.throttle_rate):
+            with self._lock:
+                self.throttled += 1
+            time.sleep(self.latency.sample() / 10)
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."}},
+                operation,
+            )
+
+    def _usage(self, model_id, body, prompt_tokens):
+        """Input usage for `prompt_tokens` of messages plus the request's tools and system prompt.
+
+        The part up to the last cache_control marker counts as cached once it is long enough.
+        """
+        tools = body.get("tools", [])
+        system = body.get("system", [])
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        blocks = tools + system
+        marked = [i for i, block in enumerate(blocks) if isinstance(block, dict) and "cache_control" in block]
+        min_tokens = None
+        if marked:
+            # Imported here so the fake stays usable without the repo root on sys.path
+            from model_router import prompt_cache_min_tokens
+
+            min_tokens = prompt_cache_min_tokens(model_id)
+            if min_tokens is None:
+                raise ClientError(
+                    {"Error": {"Code": "ValidationException", "Message": f"{model_id} does not support prompt caching"}},
+                    "InvokeModel",
+                )
+        prefix = json.dumps(blocks[:marked[-1] + 1]) if marked else ""
+        rest = json.dumps(blocks[marked[-1] + 1:] if marked else blocks) if blocks else ""
+        prefix_tokens = _estimate_tokens(prefix) if prefix else 0
+        usage = {
+            "input_tokens": prompt_tokens + (_estimate_tokens(rest) if rest else 0),
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+        }
+        if self.prompt_cache_min_tokens is not None:
+            min_tokens = self.prompt_cache_min_tokens
+        if not prefix or prefix_tokens < min_tokens:
+            usage["input_tokens"] += prefix_tokens
+            return usage
+        key = hashlib.sha256(f"{model_id}\n{prefix}".encode("utf-8")).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            hit = self._prompt_cache.get(key, 0) > now
+            self._prompt_cache[key] = now + PROMPT_CACHE_TTL
+            if hit:
+                self.cache_reads += 1
+            else:
+                self.cache_writes += 1
+        usage["cache_read_input_tokens" if hit else "cache_creation_input_tokens"] = prefix_tokens
+        return usage
+
+    def _first_token_delay(self, usage):
+        """Sampled latency, plus prefill time for input not read from the cache"""
+        delay = self.latency.sample()
+        if self.prefill_tokens_per_second:
+            uncached = usage["input_tokens"] + usage["cache_creation_input_tokens"]
+            delay += uncached / self.prefill_tokens_per_second
+        return delay
+
+    def _plan_output(self, body):
+        """(text, stop_reason, input_tokens) for a request body"""
+        messages = body.get("messages", [])
+        prompt = "".join(
+            message["content"] if isinstance(message["content"], str) else json.dumps(message["content"])
+            for message in messages if message.get("role") == "user"
+        )
+        prefix = ""
+        if messages and messages[-1].get("role") == "assistant":
+            prefix = messages[-1]["content"] if isinstance(messages[-1]["content"], str) else ""
+        text = self.output_text[len(prefix):] if self.output_text.startswith(prefix) else self.output_text
+        # Output is capped by max_tokens like the real service
+        max_chars = body.get("max_tokens", 4096) * CHARS_PER_TOKEN
+        stop_reason = "end_turn"
+        if len(text) > max_chars:
+            text, stop_reason = text[:max_chars], "max_tokens"
+        elif not prefix and self._roll(self.truncate_rate):
+            with self._lock:
+                self.truncated += 1
+            text, stop_reason = text[:max(1, len(text) // 2)], "max_tokens"
+        return text, stop_reason, _estimate_tokens(prompt)
+
+    def _tool_output(self, body):
+        """(tool input, stop_reason, output_tokens) for a request that forces a tool call"""
+        # Imported here so the fake stays usable without the repo root on sys.path
+        from compact_output import compact_plan
+
+        tool_input = compact_plan(json.loads(self.output_text))
+        output_tokens = _estimate_tokens(json.dumps(tool_input, separators=(",", ":")))
+        # A tool call cut off at max_tokens leaves no usable input
+        if output_tokens > body.get("max_tokens", 4096) or self._roll(self.truncate_rate):
+            with self._lock:
+                self.truncated += 1
+            return {}, "max_tokens", min(output_tokens, body.get("max_tokens", 4096))
+        return tool_input, "tool_use", output_tokens
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self._start_call("InvokeModel")
+        request = json.loads(body)
+        if request.get("tools"):
+            return self._invoke_tool(modelId, request)
+        text, stop_reason, input_tokens = self._plan_output(request)
+        usage = self._usage(modelId, request, input_tokens)
+        output_tokens = _estimate_tokens(text)
+        time.sleep(self._first_token_delay(usage) + output_tokens / self.tokens_per_second)
+        payload = {
+            "id": "msg_fake",
+            "type": "message",
+            "role": "assistant",
+            "model": modelId,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": stop_reason,
+            "usage": {**usage, "output_tokens": output_tokens},
+        }
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+    def _invoke_tool(self, model_id, request):
+        tool_input, stop_reason, output_tokens = self._tool_output(request)
+        usage = self._usage(model_id, request, _estimate_tokens(json.dumps(request["messages"])))
+        time.sleep(self._first_token_delay(usage) + output_tokens / self.tokens_per_second)
+        payload = {
+            "id": "msg_fake",
+            "type": "message",
+            "role": "assistant",
+            "model": model_id,
+            "content": [{"type": "tool_use", "id": "toolu_fake", "name": request["tools"][0]["name"], "input": tool_input}],
+            "stop_reason": stop_reason,
+            "usage": {**usage, "output_tokens": output_tokens},
+        }
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+    def invoke_model_with_response_stream(self, modelId, body, **kwargs):
+        self._start_call("InvokeModelWithResponseStream")
+        request = json.loads(body)
+        text, stop_reason, input_tokens = self._plan_output(request)
+        usage = self._usage(modelId, request, input_tokens)
+        return {"body": self._stream_events(modelId, text, stop_reason, usage), "contentType": "application/json"}
+
+    def _stream_events(self, model_id, text, stop_reason, usage):
+        def event(message):
+            return {"chunk": {"bytes": json.dumps(message).encode("utf-8")}}
+
+        time.sleep(self._first_token_delay(usage))
+        yield event({
+            "type": "message_start",
+            "message": {"id": "msg_fake", "model": model_id, "usage": {**usage, "output_tokens": 1}},
+        })
+        yield event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        step = self.chunk_tokens * CHARS_PER_TOKEN
+        for start in range(0, len(text), step):
+            time.sleep(self.chunk_tokens / self.tokens_per_second)
+            yield event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text[start:start + step]}})
+        yield event({"type": "content_block_stop", "index": 0})
+        yield event({"type": "message_delta", "delta": {"stop_reason": stop_reason}, "usage": {"output_tokens": _estimate_tokens(text)}})
+        yield event({"type": "message_stop"})
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "truncated": self.truncated,
+                "cache_reads": self.cache_reads,
+                "cache_writes": self.cache_writes,
+            }
@@ -0,0 +1,233 @@
+"""Load-test the FastAPI app offline against a fake Bedrock runtime.
+
+Runs main.app in-process (no network, no AWS credentials) with `main.bedrock` replaced
+by benchmarks/fake_bedrock.py, drives the chosen endpoints at increasing concurrency
+and reports throughput, p50/p95/p99 latency, status codes and process memory per level.
+
+    python benchmarks/load_test.py --endpoints chat test-plan stream --concurrency 1 4 16 64 \\
+        --latency-mean 0.5 --tokens-per-second 800 --throttle-rate 0.05 --truncate-rate 0.1
+
+Set TESTBUDDY_MAX_IN_FLIGHT / TESTBUDDY_MAX_QUEUE to load-test other executor limits.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from batch import percentile  # noqa: E402
+from fake_bedrock import FakeBedrockRuntime, LatencyModel  # noqa: E402
+
+ENDPOINTS = {
+    "chat": "/chat",
+    "test-plan": "/test-plan",
+    "stream": "/test-plan/stream",
+}
+
+# Models the fake account offers, so routing and fallback run as they would against Bedrock
+FAKE_MODELS = [
+    "anthropic.claude-3-haiku-20240307-v1:0",
+    "anthropic.claude-3-5-haiku-20241022-v1:0",
+    "anthropic.claude-3-sonnet-20240229-v1:0",
+    "anthropic.claude-3-5-sonnet-20240620-v1:0",
+]
+
+
+def request_payload(endpoint, sequence):
+    # Every request is unique and skips the cache so each one reaches the fake model
+    if endpoint == "chat":
+        return {"prompt": f"Summarize the acceptance criteria for story {sequence}"}
+    return {
+        "feature_document": f"Story {sequence}: users can reset their password by email. "
+                            "The reset link expires after 30 minutes and can be used once.",
+        "no_cache": True,
+    }
+
+
+async def asgi_request(app, path, payload):
+    """POST a JSON body straight into an ASGI app; returns (status, body bytes)"""
+    body = json.dumps(payload).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    request_sent = False
+    disconnected = asyncio.get_running_loop().create_future()
+    status = None
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The client never disconnects; the app cancels this wait when it is done
+        await disconnected
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # The server error middleware has already sent a 500 when one was possible
+        status = status or 500
+    return status, b"".join(chunks)
+
+
+def memory_mb():
+    """(current RSS, peak RSS) of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == "darwin":
+        peak /= 1024
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        current = None
+    return current, peak
+
+
+async def run_level(app, endpoint, concurrency, total, sequence):
+    latencies = []
+    statuses = {}
+
+    async def worker():
+        while True:
+            number = next(sequence)
+            if number >= total:
+                return
+            started = time.perf_counter()
+            status, body = await asgi_request(app, ENDPOINTS[endpoint], request_payload(endpoint, number))
+            if status == 200 and body.startswith(b'{"error"'):
+                status = "200-error"
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+async def run(args, app, fake):
+    results = []
+    print(f"{'endpoint':<10} {'conc':>5} {'reqs':>5} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+          f"{'rss MB':>7} {'peak MB':>8} {'heap MB':>8}  statuses")
+    for endpoint in args.endpoints:
+        for concurrency in args.concurrency:
+            total = args.requests or max(8, concurrency * 4)
+            if args.tracemalloc:
+                tracemalloc.start()
+            latencies, statuses, elapsed = await run_level(
+                app, endpoint, concurrency, total, itertools.count()
+            )
+            heap_peak = None
+            if args.tracemalloc:
+                heap_peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                tracemalloc.stop()
+            current, peak = memory_mb()
+            row = {
+                "endpoint": endpoint,
+                "concurrency": concurrency,
+                "requests": total,
+                "elapsed_seconds": round(elapsed, 3),
+                "throughput_per_second": round(total / elapsed, 2),
+                "latency_p50": round(percentile(latencies, 50), 4),
+                "latency_p95": round(percentile(latencies, 95), 4),
+                "latency_p99": round(percentile(latencies, 99), 4),
+                "rss_mb": round(current, 1) if current is not None else None,
+                "peak_rss_mb": round(peak, 1),
+                "heap_peak_mb": round(heap_peak, 1) if heap_peak is not None else None,
+                "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            }
+            results.append(row)
+            print(
+                f"{endpoint:<10} {concurrency:>5} {total:>5} {row['throughput_per_second']:>8.2f} "
+                f"{row['latency_p50']:>7.3f} {row['latency_p95']:>7.3f} {row['latency_p99']:>7.3f} "
+                f"{row['rss_mb'] or 0:>7.1f} {row['peak_rss_mb']:>8.1f} {row['heap_peak_mb'] or 0:>8.1f}  "
+                f"{' '.join(f'{status}:{count}' for status, count in row['statuses'].items())}"
+            )
+    return {"config": vars(args), "fake_bedrock": fake.stats(), "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=["chat", "test-plan"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=0, help="Requests per level (default: 4 x concurrency, at least 8)")
+    parser.add_argument("--latency-dist", choices=["constant", "uniform", "normal", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.3, help="Mean seconds to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=5000.0, help="Fake generation speed")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of calls rejected with ThrottlingException")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="Share of calls cut off at max_tokens")
+    parser.add_argument("--rpm", type=int, default=0, help="Put the client-side limiter in front of the fake at this many requests per minute")
+    parser.add_argument("--tpm", type=int, default=0, help="... and this many tokens per minute")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the Python heap peak (slows the run)")
+    parser.add_argument("--json", help="Write the results to this file for comparing runs")
+    args = parser.parse_args(argv)
+
+    # Keep every store the app opens away from the real ones: synthetic plans must not end
+    # up in the cache or the plan history. The app runs in this one process
+    directory = tempfile.mkdtemp(prefix="testbuddy-load-")
+    for name, filename in [
+        ("TESTBUDDY_CACHE_PATH", "cache.sqlite3"),
+        ("TESTBUDDY_HISTORY_PATH", "history.sqlite3"),
+        ("TESTBUDDY_SECTION_STORE_PATH", "sections.sqlite3"),
+        ("TESTBUDDY_JOB_STORE_PATH", "jobs.sqlite3"),
+        ("TESTBUDDY_SHARED_STATE_PATH", "shared.sqlite3"),
+    ]:
+        os.environ[name] = os.path.join(directory, filename)
+    os.environ["TESTBUDDY_WORKERS"] = "1"
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    import main as app_module
+    from model_router import ModelCatalog
+
+    fake = FakeBedrockRuntime(
+        latency=LatencyModel(args.latency_dist, args.latency_mean, args.latency_sigma, seed=args.seed),
+        tokens_per_second=args.tokens_per_second,
+        throttle_rate=args.throttle_rate,
+        truncate_rate=args.truncate_rate,
+        seed=args.seed,
+    )
+    app_module.bedrock = fake
+    if args.rpm or args.tpm:
+        from bedrock_client import RateLimitedClient, RateLimiter
+        app_module.bedrock = RateLimitedClient(fake, RateLimiter(args.rpm, args.tpm))
+    app_module.model_router.catalog = ModelCatalog(lambda: FAKE_MODELS, fallback=FAKE_MODELS)
+
+    report = asyncio.run(run(args, app_module.app, fake))
+    print(f"fake bedrock: {json.dumps(report['fake_bedrock'])}", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Smoke test of the API served by several worker processes through serve.py.
+
+Starts `python serve.py` with `--workers` processes and every store in a temporary
+directory, sends `--requests` requests that need no Bedrock access, and checks that:
+every worker started and publishes to the shared metrics, `/metrics` renders each metric
+family once, and the requests counted by `/metrics` add up over all the workers. Exits
+non-zero with the server's output if a check fails.
+
+    python benchmarks/smoke_workers.py --workers 2 --requests 40
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINT = "GET /cache/stats"
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.status, response.read().decode("utf-8")
+
+
+def wait_until(check, timeout, what):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            result = check()
+        except OSError:
+            result = None
+        if result:
+            return result
+        time.sleep(0.25)
+    raise AssertionError(f"timed out after {timeout:g}s waiting for {what}")
+
+
+def live_workers(path):
+    """Worker processes that have published to the shared metrics and not retired"""
+    if not os.path.exists(path):
+        return 0
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT COUNT(*) FROM metric_processes WHERE retired = 0").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        db.close()
+
+
+def counted_requests(text):
+    total = 0
+    for line in text.splitlines():
+        if line.startswith("testbuddy_http_requests_total{") and f'endpoint="{ENDPOINT}"' in line:
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+def check_families(text):
+    families = Counter(line.split()[2] for line in text.splitlines() if line.startswith("# TYPE "))
+    duplicated = sorted(name for name, count in families.items() if count > 1)
+    if duplicated:
+        raise AssertionError(f"/metrics renders these families more than once: {', '.join(duplicated)}")
+    return len(families)
+
+
+def run(args, directory):
+    shared_path = os.path.join(directory, "shared.sqlite3")
+    env = dict(
+        os.environ,
+        TESTBUDDY_WORKERS=str(args.workers),
+        TESTBUDDY_SHARED_STATE_PATH=shared_path,
+        TESTBUDDY_CACHE_PATH=os.path.join(directory, "cache.sqlite3"),
+        TESTBUDDY_SECTION_STORE_PATH=os.path.join(directory, "sections.sqlite3"),
+        TESTBUDDY_JOB_STORE_PATH=os.path.join(directory, "jobs.sqlite3"),
+        TESTBUDDY_HISTORY_PATH=os.path.join(directory, "history.sqlite3"),
+        # Discovery fails fast offline instead of waiting on credentials
+        AWS_EC2_METADATA_DISABLED="true",
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    log = open(os.path.join(directory, "server.log"), "w+", encoding="utf-8")
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(args.port)],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+    def server_up():
+        if server.poll() is not None:
+            raise AssertionError(f"the server exited with status {server.returncode}")
+        return get(f"{base}/cache/stats")[0] == 200
+
+    def all_counted():
+        text = get(f"{base}/metrics")[1]
+        return text if counted_requests(text) >= args.requests else None
+
+    try:
+        started = time.perf_counter()
+        wait_until(server_up, args.timeout, "the server")
+        wait_until(lambda: live_workers(shared_path) >= args.workers, args.timeout, f"{args.workers} workers to publish")
+        startup = time.perf_counter() - started
+
+        for _ in range(args.requests):
+            status, _ = get(f"{base}/cache/stats")
+            if status != 200:
+                raise AssertionError(f"GET /cache/stats returned {status}")
+
+        # Workers publish every few seconds, so wait for the last one's count to arrive
+        text = wait_until(all_counted, args.timeout, f"/metrics to count {args.requests} requests")
+        families = check_families(text)
+        counted = counted_requests(text)
+        print(f"{args.workers} workers up in {startup:.1f}s · {families} metric families, each rendered once · "
+              f"{counted:.0f} of {args.requests}+ requests counted over all workers")
+    except AssertionError:
+        log.seek(0)
+        print(log.read(), file=sys.stderr)
+        raise
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=40, help="Requests spread over the workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds each check may take")
+    args = parser.parse_args(argv)
+    if args.workers < 2:
+        parser.error("--workers must be at least 2")
+
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            run(args, directory)
+        except AssertionError as e:
+            print(f"FAILED: {e}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import re
+
+# Rough Claude tokenizer ratio for English prose; good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+HEADING_PATTERN = re.compile(
+    r"^(#{1,6}\s+\S"                               # Markdown headings
+    r"|\d+(\.\d+)*\.?\s+[A-Z]"                      # Numbered headings: "2.1 Login flow"
+    r"|[A-Z][A-Z0-9 /&\-]{3,80}:?$"                 # ALL CAPS headings
+    r"|(?i:section|chapter|appendix)\s+\w+)"        # "Section 4", "Appendix A"
+)
+
+CHUNK_NOTE = (
+    "(This is part {index} of {total} of a larger requirements document. "
+    "Generate test cases only for the requirements in this part.)\n\n"
+)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _is_heading(line):
+    stripped = line.strip()
+    return bool(stripped) and len(stripped) <= 120 and bool(HEADING_PATTERN.match(stripped))
+
+
+def split_sections(text):
+    """Split text into sections, starting a new section at every heading line"""
+    sections = []
+    current = []
+    for line in text.split("\n"):
+        if _is_heading(line) and any(part.strip() for part in current):
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if any(part.strip() for part in current):
+        sections.append("\n".join(current).strip())
+    return sections
+
+
+def _split_oversized(section, max_chars):
+    """Break a section larger than the budget on paragraphs, then sentences, then hard cuts"""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", section):
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            pieces.append(sentence)
+    return [piece for piece in pieces if piece.strip()]
+
+
+def chunk_text(text, max_tokens):
+    """Pack heading-delimited sections into chunks that each stay under `max_tokens`"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    current_len = 0
+    for section in split_sections(text):
+        pieces = [section] if len(section) <= max_chars else _split_oversized(section, max_chars)
+        for piece in pieces:
+            if current and current_len + len(piece) + 2 > max_chars:
+                chunks.append("\n\n".join(current))
+                current = []
+                current_len = 0
+            current.append(piece)
+            current_len += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def annotate_chunks(chunks):
+    """Prefix each chunk with a note telling the model it only sees part of the document"""
+    if len(chunks) == 1:
+        return chunks
+    return [CHUNK_NOTE.format(index=i, total=len(chunks)) + chunk for i, chunk in enumerate(chunks, 1)]
+
+
+def _normalize_name(name):
+    return re.sub(r"[^a-z0-9]+", " ", str(name).lower()).strip()
+
+
+def merge_plans(plans):
+    """Merge partial plans into one, combining test types by name and dropping duplicate test cases"""
+    test_types = {}
+    seen_cases = {}
+    uat_test_cases = []
+    seen_uat = set()
+
+    for plan in plans:
+        if not isinstance(plan, dict):
+            continue
+        for test_type in plan.get("test_types", []):
+            type_key = _normalize_name(test_type.get("type", ""))
+            if type_key not in test_types:
+                test_types[type_key] = {
+                    "type": test_type.get("type", ""),
+                    "description": test_type.get("description", ""),
+                    "test_cases": [],
+                }
+                seen_cases[type_key] = set()
+            merged = test_types[type_key]
+            for test_case in test_type.get("test_cases", []):
+                case_key = _normalize_name(test_case.get("name", ""))
+                if case_key in seen_cases[type_key]:
+                    continue
+                seen_cases[type_key].add(case_key)
+                merged["test_cases"].append(test_case)
+
+        for test_case in plan.get("uat_test_cases", []):
+            case_key = _normalize_name(test_case.get("test_case_name", ""))
+            if case_key in seen_uat:
+                continue
+            seen_uat.add(case_key)
+            uat_test_cases.append(test_case)
+
+    # Each chunk numbers its UAT cases from 1, so renumber after merging
+    if len(plans) > 1:
+        for i, test_case in enumerate(uat_test_cases, 1):
+            test_case["test_case_id"] = f"UAT-{i:03d}"
+
+    merged_plan = {"test_types": list(test_types.values())}
+    if uat_test_cases:
+        merged_plan["uat_test_cases"] = uat_test_cases
+    return merged_plan
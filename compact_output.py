@@ -0,0 +1,173 @@
+from plan_parser import recover_plan
+from prompts import PromptTemplate, cached_system
+
+# Bump whenever COMPACT_PROMPT_TEMPLATE or COMPACT_TOOL change
+COMPACT_PROMPT_VERSION = "compact-v2"
+COMPACT_TOOL_NAME = "record_test_plan"
+
+# Sent as the cacheable system prompt after COMPACT_TOOL; the document follows as the user turn
+COMPACT_PROMPT_TEMPLATE = """
+You are a QA specialist and test automation expert responsible for comprehensive test planning.
+
+A new feature/requirement or document has been provided as the Feature Document that needs thorough testing coverage across multiple technical test types and UAT test cases.
+
+Instructions:
+1. Analyze the provided feature document thoroughly
+2. Generate a comprehensive test plan covering Unit, Integration, UI, API, End-to-End, Performance, Security, Database, Contract and Smoke Tests
+3. Generate UAT (User Acceptance Test) cases that focus on business requirements validation
+4. For each test type, provide specific test cases with technical implementation details
+5. Include test frameworks, tools, and automation approaches
+6. Consider edge cases, error scenarios, and boundary conditions
+
+Record the plan with the {tool_name} tool, using the positional record formats it describes.
+"""
+
+COMPACT_PROMPT = PromptTemplate(
+    COMPACT_PROMPT_VERSION, "Feature Document:\n{input_document}\n", COMPACT_PROMPT_TEMPLATE
+).partial(tool_name=COMPACT_TOOL_NAME)
+
+# Records are positional arrays, so the model doesn't repeat key names for every test case
+COMPACT_TOOL = {
+    "name": COMPACT_TOOL_NAME,
+    "description": "Record a QA test plan. Every record is a positional array; keep the field order exactly.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "t": {
+                "type": "array",
+                "description": (
+                    "Technical test types. Each is [type name, description, test cases]; each test case is "
+                    "[name, objective, [prerequisites], [implementation steps], expected results]."
+                ),
+                "items": {"type": "array"},
+            },
+            "u": {
+                "type": "array",
+                "description": "UAT test cases. Each is [name, objective, preconditions, [test steps], expected result].",
+                "items": {"type": "array"},
+            },
+        },
+        "required": ["t", "u"],
+    },
+}
+
+
+def build_compact_body(final_input, max_tokens):
+    """A request that makes the model answer with one call to the compact plan tool"""
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "tools": [COMPACT_TOOL],
+        "tool_choice": {"type": "tool", "name": COMPACT_TOOL_NAME},
+        "system": cached_system(COMPACT_PROMPT.render_system()),
+        "messages": [{"role": "user", "content": COMPACT_PROMPT.render(input_document=final_input)}]
+    }
+
+
+def _field(record, index, default=""):
+    return record[index] if len(record) > index and record[index] is not None else default
+
+
+def _strings(value):
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [str(value)] if value else []
+
+
+def expand_test_case(record):
+    if isinstance(record, dict):
+        return record
+    return {
+        "name": str(_field(record, 0)),
+        "objective": str(_field(record, 1)),
+        "prerequisites": _strings(_field(record, 2, [])),
+        "implementation_steps": _strings(_field(record, 3, [])),
+        "expected_results": str(_field(record, 4)),
+    }
+
+
+def expand_uat_case(index, record):
+    if isinstance(record, dict):
+        return record
+    # IDs, actual result and status are boilerplate, so they are filled in here instead of generated
+    return {
+        "test_case_id": f"UAT-{index:03d}",
+        "test_case_name": str(_field(record, 0)),
+        "test_objective": str(_field(record, 1)),
+        "preconditions": str(_field(record, 2)),
+        "test_steps": _strings(_field(record, 3, [])),
+        "expected_result": str(_field(record, 4)),
+        "actual_result": "",
+        "status": "Not Run",
+    }
+
+
+def expand_compact_plan(data):
+    """Expand the compact tool input into the standard `test_types` / `uat_test_cases` plan.
+
+    Records the model wrote as objects instead of arrays are passed through unchanged.
+    """
+    test_types = []
+    for record in data.get("t") or []:
+        if isinstance(record, dict):
+            test_types.append(record)
+            continue
+        if not isinstance(record, list) or not record:
+            continue
+        test_types.append({
+            "type": str(_field(record, 0)),
+            "description": str(_field(record, 1)),
+            "test_cases": [expand_test_case(case) for case in _field(record, 2, []) if isinstance(case, (list, dict))],
+        })
+    uat_records = [record for record in data.get("u") or [] if isinstance(record, (list, dict))]
+    return {
+        "test_types": test_types,
+        "uat_test_cases": [expand_uat_case(i, record) for i, record in enumerate(uat_records, 1)],
+    }
+
+
+def compact_plan(plan):
+    """Encode a standard plan in the compact format (the inverse of expand_compact_plan)"""
+    return {
+        "t": [
+            [
+                test_type.get("type", ""),
+                test_type.get("description", ""),
+                [
+                    [case.get("name", ""), case.get("objective", ""), case.get("prerequisites", []),
+                     case.get("implementation_steps", []), case.get("expected_results", "")]
+                    for case in test_type.get("test_cases", [])
+                ],
+            ]
+            for test_type in plan.get("test_types", [])
+        ],
+        "u": [
+            [case.get("test_case_name", ""), case.get("test_objective", ""), case.get("preconditions", ""),
+             case.get("test_steps", []), case.get("expected_result", "")]
+            for case in plan.get("uat_test_cases", [])
+        ],
+    }
+
+
+def compact_result_plan(result):
+    """Expand a decoded `invoke_model` response to the compact tool request; returns (plan, complete).
+
+    `plan` is None when the response holds no usable test cases, e.g. when it was cut
+    off before the tool input could be parsed. A model that answered in text instead of
+    calling the tool is parsed like a standard response.
+    """
+    complete = result.get("stop_reason") != "max_tokens"
+    for block in result.get("content", []):
+        if block.get("type") == "tool_use" and block.get("name") == COMPACT_TOOL_NAME:
+            data = block.get("input")
+            if not isinstance(data, dict):
+                return None, False
+            plan = expand_compact_plan(data)
+            if not plan["test_types"] and not plan["uat_test_cases"]:
+                return None, False
+            return plan, complete
+    text = "".join(block.get("text", "") for block in result.get("content", []) if block.get("type") == "text")
+    plan, parsed_complete = recover_plan(text)
+    if not isinstance(plan, dict):
+        return None, False
+    return plan, complete and parsed_complete
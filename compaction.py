@@ -0,0 +1,106 @@
+import hashlib
+import re
+from collections import Counter
+
+from chunking import estimate_tokens
+
+# Form feed marks page boundaries in extracted PDF text
+PAGE_BREAK = "\f"
+
+# Paragraphs shorter than this (headings, labels) are never treated as duplicates
+MIN_DEDUP_CHARS = 40
+# Header/footer candidates are taken from this many lines at the top and bottom of each page
+EDGE_LINES = 3
+# A line is boilerplate when it appears at a page edge on at least this share of pages
+BOILERPLATE_PAGE_RATIO = 0.5
+MIN_BOILERPLATE_PAGES = 3
+# Longer lines are body text, never headers or footers
+MAX_BOILERPLATE_CHARS = 100
+
+PAGE_NUMBER = re.compile(r"^(page )?[-–(\[ ]*\d+[-–)\] ]*(( of|/) ?\d+)?$")
+ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\ufeff]")
+
+
+def normalize_whitespace(text):
+    """Collapse runs of spaces/tabs, trim every line and cap blank lines at one"""
+    text = ZERO_WIDTH.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    lines = [re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _boilerplate_key(line):
+    # Page numbers differ on every page, so they all share one key
+    line = re.sub(r"\s+", " ", line).strip().lower()
+    return "<page number>" if PAGE_NUMBER.match(line) else line
+
+
+def _edge_positions(lines):
+    """Indexes of the short non-blank lines at the top and bottom of a page"""
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    edges = content[:EDGE_LINES] + content[max(EDGE_LINES, len(content) - EDGE_LINES):]
+    return [i for i in edges if len(lines[i].strip()) <= MAX_BOILERPLATE_CHARS]
+
+
+def remove_boilerplate(text):
+    """Drop header/footer lines repeated across pages. Returns (text, lines_removed).
+
+    Only text carrying page breaks (extracted PDFs) is considered, and only lines near
+    the top or bottom of a page, so repeated lines in the body are left alone.
+    """
+    pages = text.split(PAGE_BREAK)
+    if len(pages) < MIN_BOILERPLATE_PAGES:
+        return text, 0
+
+    page_lines = [page.split("\n") for page in pages]
+    edge_counts = Counter()
+    for lines in page_lines:
+        edge_counts.update({_boilerplate_key(lines[i]) for i in _edge_positions(lines)})
+
+    threshold = max(MIN_BOILERPLATE_PAGES, int(len(pages) * BOILERPLATE_PAGE_RATIO))
+    boilerplate = {key for key, count in edge_counts.items() if count >= threshold}
+    if not boilerplate:
+        return text, 0
+
+    removed = 0
+    kept_pages = []
+    for lines in page_lines:
+        drop = {i for i in _edge_positions(lines) if _boilerplate_key(lines[i]) in boilerplate}
+        removed += len(drop)
+        kept_pages.append("\n".join(line for i, line in enumerate(lines) if i not in drop))
+    return PAGE_BREAK.join(kept_pages), removed
+
+
+def dedupe_paragraphs(text):
+    """Keep only the first copy of each paragraph. Returns (text, paragraphs_removed)"""
+    seen = set()
+    kept = []
+    removed = 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        normalized = re.sub(r"\s+", " ", paragraph).strip().lower()
+        if len(normalized) >= MIN_DEDUP_CHARS:
+            digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+            if digest in seen:
+                removed += 1
+                continue
+            seen.add(digest)
+        kept.append(paragraph)
+    return "\n\n".join(kept), removed
+
+
+def compact_input(text):
+    """Remove per-page boilerplate, duplicate paragraphs and redundant whitespace before prompting.
+
+    Returns (compacted_text, stats) where stats reports estimated input tokens before and
+    after plus how much was removed.
+    """
+    tokens_before = estimate_tokens(text)
+    text, boilerplate_lines = remove_boilerplate(text)
+    text = normalize_whitespace(text.replace(PAGE_BREAK, "\n"))
+    text, duplicate_paragraphs = dedupe_paragraphs(text)
+    tokens_after = estimate_tokens(text)
+    return text, {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "boilerplate_lines_removed": boilerplate_lines,
+        "duplicate_paragraphs_removed": duplicate_paragraphs,
+    }
@@ -0,0 +1,181 @@
+import functools
+import re
+import zlib
+
+MODES = ("flag", "merge")
+# Jaccard similarity of word-bigram sets above which two test cases count as duplicates
+DEFAULT_THRESHOLD = 0.7
+
+# MinHash signature length, split into LSH bands of NUM_PERM // BANDS rows. With 16 bands
+# of 4 rows, pairs at 0.7 similarity become candidates ~99% of the time, pairs at 0.3 ~12%.
+NUM_PERM = 64
+BANDS = 16
+# Larger LSH buckets are linked through their first member instead of pairwise
+MAX_BUCKET_PAIRS = 32
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+@functools.lru_cache(maxsize=None)
+def _hashing():
+    """(numpy, prime, a, b, mix) for the MinHash permutations.
+
+    NumPy is imported on the first dedupe rather than at startup, as most requests never dedupe.
+    """
+    import numpy as np
+    rng = np.random.default_rng(1)
+    # Kept below 2**31 so (hash * a + b) of a 32-bit hash never overflows uint64
+    a = rng.integers(1, 2 ** 31, size=NUM_PERM, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 31, size=NUM_PERM, dtype=np.uint64)
+    return np, np.uint64(4294967311), a, b, np.uint64(1000003)
+
+
+def case_text(test_case):
+    """The text a test case is compared on: its name, objective and steps"""
+    parts = [
+        test_case.get("name") or test_case.get("test_case_name") or "",
+        test_case.get("objective") or test_case.get("test_objective") or "",
+    ]
+    steps = test_case.get("implementation_steps") or test_case.get("test_steps") or []
+    parts.extend(steps if isinstance(steps, list) else [steps])
+    return " ".join(str(part) for part in parts)
+
+
+def shingles(text):
+    """Word bigrams of a text (its words if it has fewer than two)"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < 2:
+        return set(words) or {""}
+    return {f"{first} {second}" for first, second in zip(words, words[1:])}
+
+
+def minhash_signatures(shingle_sets):
+    """(len(shingle_sets), NUM_PERM) array of MinHash signatures"""
+    np, prime, a, b, _ = _hashing()
+    lengths = np.fromiter((len(shingle_set) for shingle_set in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle_set in shingle_sets for shingle in shingle_set),
+        dtype=np.uint64,
+        count=int(lengths.sum()),
+    )
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    signatures = np.empty((len(shingle_sets), NUM_PERM), dtype=np.uint64)
+    for i in range(NUM_PERM):
+        # Every set is non-empty, so each reduceat segment is the set's own hashes
+        signatures[:, i] = np.minimum.reduceat((hashes * a[i] + b[i]) % prime, offsets)
+    return signatures
+
+
+def candidate_pairs(signatures):
+    """Index pairs (i < j) that share at least one LSH band"""
+    np, _, _, _, mix = _hashing()
+    rows = NUM_PERM // BANDS
+    pairs = set()
+    for band in range(BANDS):
+        block = signatures[:, band * rows:(band + 1) * rows]
+        key = block[:, 0].copy()
+        for j in range(1, rows):
+            key = key * mix ^ block[:, j]
+        _, labels, counts = np.unique(key, return_inverse=True, return_counts=True)
+        labels = labels.ravel()
+        shared = np.flatnonzero(counts[labels] > 1)
+        if not len(shared):
+            continue
+        order = shared[np.argsort(labels[shared], kind="stable")]
+        boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+        for bucket in np.split(order, boundaries):
+            members = sorted(bucket.tolist())
+            if len(members) <= MAX_BUCKET_PAIRS:
+                pairs.update((a, b) for index, a in enumerate(members) for b in members[index + 1:])
+            else:
+                pairs.update((members[0], b) for b in members[1:])
+    return pairs
+
+
+def _jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+def cluster_duplicates(texts, threshold=DEFAULT_THRESHOLD):
+    """Group texts whose word-bigram Jaccard similarity reaches `threshold`.
+
+    MinHash + LSH finds candidate pairs without comparing every pair; candidates are then
+    checked exactly. Returns clusters of two or more indices, each sorted ascending.
+    """
+    if len(texts) < 2:
+        return []
+    shingle_sets = [shingles(text) for text in texts]
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in candidate_pairs(minhash_signatures(shingle_sets)):
+        if _jaccard(shingle_sets[a], shingle_sets[b]) >= threshold:
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = {}
+    for i in range(len(texts)):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def _plan_cases(plan):
+    """(section name, test case) for every test case in plan order, UAT cases last"""
+    entries = []
+    for test_type in plan.get("test_types", []):
+        for test_case in test_type.get("test_cases", []):
+            if isinstance(test_case, dict):
+                entries.append((test_type.get("type", ""), test_case))
+    for test_case in plan.get("uat_test_cases", []):
+        if isinstance(test_case, dict):
+            entries.append(("UAT Tests", test_case))
+    return entries
+
+
+def _reference(section, test_case):
+    return {"test_type": section, "name": test_case.get("name") or test_case.get("test_case_name", "")}
+
+
+def dedupe_plan(plan, mode="flag", threshold=DEFAULT_THRESHOLD):
+    """Find near-duplicate test cases across the whole plan, updating it in place.
+
+    The first case of each cluster (in plan order) is kept. With "flag" the others get a
+    `duplicate_of` reference to it; with "merge" they are removed and listed under the kept
+    case's `also_covers`. Returns (plan, stats).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown dedupe mode: {mode}. Choose from: {', '.join(MODES)}")
+    entries = _plan_cases(plan)
+    clusters = cluster_duplicates([case_text(test_case) for _, test_case in entries], threshold)
+
+    dropped = set()
+    for members in clusters:
+        kept_section, kept = entries[members[0]]
+        for index in members[1:]:
+            section, test_case = entries[index]
+            if mode == "flag":
+                test_case["duplicate_of"] = _reference(kept_section, kept)
+            else:
+                kept.setdefault("also_covers", []).append(_reference(section, test_case))
+                dropped.add(id(test_case))
+
+    if dropped:
+        for test_type in plan.get("test_types", []):
+            test_type["test_cases"] = [case for case in test_type.get("test_cases", []) if id(case) not in dropped]
+        if "uat_test_cases" in plan:
+            plan["uat_test_cases"] = [case for case in plan["uat_test_cases"] if id(case) not in dropped]
+
+    stats = {
+        "mode": mode,
+        "threshold": threshold,
+        "cases": len(entries),
+        "groups": len(clusters),
+        "duplicates": sum(len(members) - 1 for members in clusters),
+    }
+    return plan, stats
@@ -0,0 +1,193 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import wait
+
+from compaction import PAGE_BREAK
+
+PDF_TYPE = "application/pdf"
+TEXT_TYPE = "text/plain"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# PDFs with more pages than this are split into page ranges parsed by separate workers
+PDF_PAGES_PER_TASK = 25
+
+EXTENSION_TYPES = {".pdf": PDF_TYPE, ".txt": TEXT_TYPE, ".docx": DOCX_TYPE}
+
+
+class UnsupportedFormatError(ValueError):
+    pass
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def guess_mime_type(filename, content_type=None):
+    """Resolve a file's type from its declared content type, falling back to the extension"""
+    if content_type in (PDF_TYPE, TEXT_TYPE, DOCX_TYPE):
+        return content_type
+    return EXTENSION_TYPES.get(os.path.splitext(filename or "")[1].lower(), content_type)
+
+
+def iter_pdf_pages(fileobj, start=0, end=None):
+    """Yield the text of pages [start, end) of a PDF, one page at a time.
+
+    Each page ends with PAGE_BREAK so compaction can recognise repeated headers and footers.
+    """
+    # The parsers are only imported once a file of their type arrives, keeping startup fast
+    from PyPDF2 import PdfReader
+    reader = PdfReader(fileobj)
+    for page in reader.pages[start:end]:
+        yield (page.extract_text() or "") + PAGE_BREAK
+
+
+def iter_text_lines(fileobj):
+    wrapper = io.TextIOWrapper(fileobj, encoding="utf-8")
+    try:
+        for line in wrapper:
+            yield line.rstrip("\n")
+    finally:
+        # Leave the caller's file object open
+        wrapper.detach()
+
+
+def iter_docx_paragraphs(fileobj):
+    from docx import Document
+    for paragraph in Document(fileobj).paragraphs:
+        yield paragraph.text
+
+
+def iter_text_parts(fileobj, mime_type):
+    """Yield the text of a file piece by piece (pages, paragraphs or lines) from a binary file object"""
+    if mime_type == PDF_TYPE:
+        return iter_pdf_pages(fileobj)
+    if mime_type == TEXT_TYPE:
+        return iter_text_lines(fileobj)
+    if mime_type == DOCX_TYPE:
+        return iter_docx_paragraphs(fileobj)
+    raise UnsupportedFormatError("Unsupported file format")
+
+
+def preload_parsers():
+    """Import the PDF and DOCX parsers ahead of the first upload, e.g. from a startup prewarm"""
+    import PyPDF2  # noqa: F401
+    import docx  # noqa: F401
+
+
+def extract_file(fileobj, mime_type):
+    """Extract text from a seekable binary file object; returns (text, number of pages/parts)"""
+    parts = list(iter_text_parts(fileobj, mime_type))
+    return "\n".join(parts) + "\n", len(parts)
+
+
+def extract_pdf_pages(data, start=0, end=None):
+    """Extract text from pages [start, end) of a PDF held in memory"""
+    return "\n".join(iter_pdf_pages(io.BytesIO(data), start, end)) + "\n"
+
+
+def count_pdf_pages(data):
+    from PyPDF2 import PdfReader
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def extract_bytes(data, mime_type):
+    """Extract text from a whole file; runs in worker processes, so it must stay picklable"""
+    if mime_type == TEXT_TYPE:
+        return str(data, "utf-8")
+    text, _ = extract_file(io.BytesIO(data), mime_type)
+    return text
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    text = fn(*args)
+    return text, time.perf_counter() - started
+
+
+class ExtractionCache:
+    """LRU of extracted text keyed by file content hash, bounded by total stored characters"""
+
+    def __init__(self, max_chars=50_000_000):
+        self.max_chars = max_chars
+        self.total_chars = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def set(self, key, text):
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_chars -= len(previous)
+            self._entries[key] = text
+            self.total_chars += len(text)
+            while self.total_chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_chars -= len(evicted)
+
+
+def _submit_file(pool, data, mime_type):
+    """Submit the extraction tasks for one file; large PDFs are split into page ranges"""
+    if mime_type == PDF_TYPE:
+        page_count = count_pdf_pages(data)
+        if page_count > PDF_PAGES_PER_TASK:
+            return [
+                pool.submit(_timed, extract_pdf_pages, data, start, min(start + PDF_PAGES_PER_TASK, page_count))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            ]
+    return [pool.submit(_timed, extract_bytes, data, mime_type)]
+
+
+def extract_documents(files, pool, cache=None):
+    """Extract text from several files at once.
+
+    `files` is a list of (name, mime_type, data) tuples. Uncached files are parsed on
+    `pool` (a process pool) in parallel. Returns one dict per file, in input order, with
+    "name", "text", "error", "seconds" and "cached"; "seconds" is the parse time spent on
+    that file, not the wall time of the whole batch.
+    """
+    results = []
+    pending = []
+    for name, mime_type, data in files:
+        started = time.perf_counter()
+        key = content_hash(data)
+        result = {"name": name, "text": None, "error": None, "seconds": 0.0, "cached": False}
+        results.append(result)
+
+        text = cache.get(key) if cache is not None else None
+        if text is not None:
+            result.update(text=text, cached=True, seconds=round(time.perf_counter() - started, 3))
+            continue
+        try:
+            futures = _submit_file(pool, data, mime_type)
+        except Exception as e:
+            result["error"] = f"Error reading file: {str(e)}"
+            continue
+        pending.append((result, key, futures, time.perf_counter() - started))
+
+    wait([future for _, _, futures, _ in pending for future in futures])
+    for result, key, futures, setup_seconds in pending:
+        try:
+            parts = [future.result() for future in futures]
+        except UnsupportedFormatError as e:
+            result["error"] = str(e)
+        except Exception as e:
+            result["error"] = f"Error reading file: {str(e)}"
+        else:
+            result["text"] = "".join(text for text, _ in parts)
+            result["seconds"] = round(setup_seconds + sum(seconds for _, seconds in parts), 3)
+            if cache is not None:
+                cache.set(key, result["text"])
+    return results
@@ -0,0 +1,298 @@
+import json
+import logging
+import threading
+import time
+
+from bedrock_executor import USAGE_FIELDS, BedrockOverloadedError, decode_stream_event, stream_text_delta, stream_usage
+from metrics import observe_stage, record_bedrock_call, span
+from fan_out import parse_focused_result
+from model_router import is_fallback_error
+from plan_parser import MAX_CONTINUATIONS, PlanStreamParser, continuation_body, recover_plan
+from prompts import cached_system, encode_body
+
+logger = logging.getLogger("testbuddy")
+
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+TEST_PLAN_MAX_TOKENS = 4000
+
+
+def build_test_plan_body(prompt, final_input, max_tokens=TEST_PLAN_MAX_TOKENS):
+    """An invoke_model body asking `prompt` (a PromptTemplate) for a test plan of `final_input`.
+
+    The prompt's fixed instructions go first, as a cacheable system prompt, and the input
+    after them, so every call shares the same prefix.
+    """
+    with span("prompt_build"):
+        content = prompt.render(input_document=final_input)
+        system = prompt.render_system()
+    body = {"anthropic_version": ANTHROPIC_VERSION, "max_tokens": max_tokens}
+    if system is not None:
+        body["system"] = cached_system(system)
+    body["messages"] = [{"role": "user", "content": content}]
+    return body
+
+
+def generated_plan(text, stop_reason):
+    """Parse a generation's output into (plan, complete).
+
+    `plan` is None if no plan could be recovered. `complete` is False when the output was
+    cut off, so the plan is missing test cases and isn't worth caching.
+    """
+    with span("parse"):
+        plan, complete = recover_plan(text)
+    if not isinstance(plan, dict):
+        return None, False
+    return plan, complete and stop_reason != "max_tokens"
+
+
+def generated_focused_result(test_type_key, text, stop_reason):
+    """Parse a focused generation's output into (result, complete), as generated_plan does"""
+    with span("parse"):
+        parsed = parse_focused_result(test_type_key, text)
+    usable = parsed and not (isinstance(parsed, dict) and "raw_text" in parsed)
+    return parsed, bool(usable) and stop_reason != "max_tokens"
+
+
+def record_call_failure(router, models, attempt, error):
+    """Record a failed call to `models[attempt]` and decide whether to fall back.
+
+    Re-raises `error` unless it is a throttle or timeout and another model is left to try;
+    otherwise returns a message describing the fallback.
+    """
+    model_id = models[attempt]
+    if not is_fallback_error(error):
+        # The executor turning a call away says nothing about the model
+        if not isinstance(error, BedrockOverloadedError):
+            record_bedrock_call(model_id, "error")
+        raise error
+    record_bedrock_call(model_id, "throttled")
+    router.record_failure(model_id)
+    if attempt == len(models) - 1:
+        raise error
+    return f"{model_id} unavailable ({error}), falling back to {models[attempt + 1]}"
+
+
+def record_call_success(router, model_id, result, started):
+    """Record a successful call's token usage and latency for metrics and routing"""
+    usage = result.get('usage', {})
+    record_bedrock_call(
+        model_id, "ok", usage.get('input_tokens', 0), usage.get('output_tokens', 0),
+        usage.get('cache_read_input_tokens', 0), usage.get('cache_creation_input_tokens', 0)
+    )
+    router.record_success(model_id, time.perf_counter() - started, usage.get('output_tokens'))
+
+
+class Continuation:
+    """Joins the output of a generation continued across calls after hitting max_tokens.
+
+    `feed()` takes each response and returns the (body, models) to invoke next, or None
+    once the output is finished or MAX_CONTINUATIONS is reached. Shared by the blocking
+    and the async call paths, which only differ in how they invoke.
+    """
+
+    def __init__(self, body, models):
+        self.body = body
+        self.models = list(models)
+        self.text = ""
+        self.stop_reason = None
+        self.continuations = 0
+        self.model_id = None
+
+    def feed(self, result, model_id):
+        self.model_id = model_id
+        self.text += result['content'][0]['text']
+        self.stop_reason = result.get('stop_reason')
+        if self.stop_reason != "max_tokens" or self.continuations >= MAX_CONTINUATIONS:
+            return None
+        self.continuations += 1
+        self.text = self.text.rstrip()
+        # Stay on the model that wrote the prefix unless it is throttled
+        models = [model_id] + [m for m in self.models if m != model_id]
+        return continuation_body(self.body, self.text), models
+
+
+class PlanStream:
+    """Turns the messages of a streamed plan generation, continued across calls after
+    hitting max_tokens, into PlanStreamParser events.
+
+    `feed()` takes each decoded stream message and returns the events it completed;
+    `end_call()` records a finished call and returns the (body, models) to stream next, or
+    None once the output is finished or MAX_CONTINUATIONS is reached. Shared by the
+    blocking and the async streaming paths, which only differ in how they read a stream.
+    Times in `metrics` are measured from `started`, e.g. when the request arrived.
+    """
+
+    def __init__(self, body, models, started=None, log=logger.debug):
+        self.body = body
+        self.models = list(models)
+        self.started = time.perf_counter() if started is None else started
+        self.log = log
+        self.parser = PlanStreamParser()
+        self.metrics = {"time_to_first_token": None, "time_to_first_test_case": None}
+        self.usage = dict.fromkeys(USAGE_FIELDS, 0)
+        self.stop_reason = None
+        self.continuations = 0
+        self.model_id = None
+        self._call_usage = None
+        self._call_started = None
+
+    @property
+    def text(self):
+        return self.parser.text
+
+    def begin(self, model_id):
+        """Start reading the stream of a call to `model_id`"""
+        self.model_id = model_id
+        self._call_usage = dict.fromkeys(USAGE_FIELDS, 0)
+        self._call_started = time.perf_counter()
+
+    def feed(self, message):
+        stream_usage(message, self._call_usage)
+        if message.get("type") == "message_delta":
+            self.stop_reason = message.get("delta", {}).get("stop_reason")
+        delta = stream_text_delta(message)
+        if not delta:
+            return []
+        if self.metrics["time_to_first_token"] is None:
+            self.metrics["time_to_first_token"] = round(time.perf_counter() - self.started, 3)
+            observe_stage("time_to_first_token", time.perf_counter() - self.started)
+            self.log(f"First token after {self.metrics['time_to_first_token']}s")
+        events = self.parser.feed(delta)
+        if self.metrics["time_to_first_test_case"] is None and any(event != "test_type" for event, _ in events):
+            self.metrics["time_to_first_test_case"] = round(time.perf_counter() - self.started, 3)
+            self.log(f"First test case after {self.metrics['time_to_first_test_case']}s")
+        return events
+
+    def end_call(self):
+        usage = self._call_usage
+        # Includes the time the consumer spent between reads, e.g. drawing streamed cases
+        observe_stage("bedrock_call", time.perf_counter() - self._call_started)
+        record_bedrock_call(
+            self.model_id, "ok", usage["input_tokens"], usage["output_tokens"],
+            usage["cache_read_input_tokens"], usage["cache_creation_input_tokens"]
+        )
+        for field in USAGE_FIELDS:
+            self.usage[field] += usage[field]
+        if usage["cache_read_input_tokens"] or usage["cache_creation_input_tokens"]:
+            self.log(
+                f"Prompt cache: {usage['cache_read_input_tokens']} tokens read, "
+                f"{usage['cache_creation_input_tokens']} written"
+            )
+        if self.stop_reason != "max_tokens" or self.continuations >= MAX_CONTINUATIONS:
+            return None
+        self.continuations += 1
+        self.log(f"Response hit max_tokens, continuing ({self.continuations}/{MAX_CONTINUATIONS})")
+        # Stay on the model that wrote the prefix unless it is throttled
+        models = [self.model_id] + [m for m in self.models if m != self.model_id]
+        return continuation_body(self.body, self.text), models
+
+    def finish(self, router):
+        """Record the whole generation's latency for routing once the stream is done"""
+        self.metrics["total_time"] = round(time.perf_counter() - self.started, 3)
+        router.record_success(self.model_id, self.metrics["total_time"], self.usage["output_tokens"])
+        return self.metrics
+
+
+def invoke_routed(client, router, body, models, log=logger.warning):
+    """Blocking invoke of the first of `models` that isn't throttled or timing out.
+
+    Returns (result, model_id). `log` receives a message for each fallback.
+    """
+    for attempt, model_id in enumerate(models):
+        started = time.perf_counter()
+        try:
+            with span("bedrock_call"):
+                response = client.invoke_model(modelId=model_id, body=encode_body(body, model_id))
+                result = json.loads(response['body'].read())
+        except Exception as e:
+            log(record_call_failure(router, models, attempt, e))
+            continue
+        record_call_success(router, model_id, result, started)
+        return result, model_id
+
+
+def open_routed_stream(client, router, body, models, log=logger.warning):
+    """Blocking start of a response stream on the first of `models` that accepts it; returns (response, model_id)"""
+    for attempt, model_id in enumerate(models):
+        try:
+            return client.invoke_model_with_response_stream(modelId=model_id, body=encode_body(body, model_id)), model_id
+        except Exception as e:
+            log(record_call_failure(router, models, attempt, e))
+
+
+def invoke_with_continuation(client, router, body, models, log=logger.warning):
+    """Blocking invoke that continues output cut off at max_tokens instead of regenerating it.
+
+    Returns (text, stop_reason, continuations, model_id).
+    """
+    continuation = Continuation(body, models)
+    request = (body, models)
+    while request is not None:
+        result, model_id = invoke_routed(client, router, *request, log=log)
+        request = continuation.feed(result, model_id)
+        if request is not None:
+            log(f"Response hit max_tokens, continuing ({continuation.continuations}/{MAX_CONTINUATIONS})")
+    return continuation.text, continuation.stop_reason, continuation.continuations, continuation.model_id
+
+
+def stream_with_continuation(client, router, plan_stream, log=logger.warning):
+    """Blocking stream of `plan_stream`'s generation, continuing output cut off at max_tokens.
+
+    Yields PlanStreamParser events as objects complete, and ("continuation", {"attempt"})
+    before each continuation. `plan_stream` holds the text, usage and timings afterwards.
+    """
+    request = (plan_stream.body, plan_stream.models)
+    while request is not None:
+        response, model_id = open_routed_stream(client, router, *request, log=log)
+        plan_stream.begin(model_id)
+        for stream_event in response['body']:
+            message = decode_stream_event(stream_event)
+            if message:
+                yield from plan_stream.feed(message)
+        request = plan_stream.end_call()
+        if request is not None:
+            yield "continuation", {"attempt": plan_stream.continuations}
+
+
+class LazyClient:
+    """A client created on first use, so loading a front end doesn't wait for boto3.
+
+    Attribute access is forwarded to the real client. `prewarm(client.get)` creates it on
+    a background thread at startup, ahead of the first request.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def prewarm(*tasks):
+    """Run warm-up callables one after another on a daemon thread; returns the thread.
+
+    Failures are only logged: whatever a task didn't warm up happens on first use instead.
+    """
+    def run():
+        for task in tasks:
+            name = getattr(task, "__qualname__", repr(task))
+            started = time.perf_counter()
+            try:
+                task()
+            except Exception as e:
+                logger.warning("prewarm %s failed: %s", name, e)
+            else:
+                logger.info("prewarmed %s in %.3fs", name, time.perf_counter() - started)
+
+    thread = threading.Thread(target=run, name="testbuddy-prewarm", daemon=True)
+    thread.start()
+    return thread
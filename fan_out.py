@@ -0,0 +1,167 @@
+from plan_parser import parse_plan_text
+from prompts import PromptTemplate, cached_system
+
+FOCUSED_MAX_TOKENS = 2000
+# Bump whenever FOCUSED_PROMPT_TEMPLATE or the schemas change
+FOCUSED_PROMPT_VERSION = "focused-v2"
+
+# Keys accepted in requests, with the display name and focus used in the prompt
+TEST_TYPES = {
+    "unit": ("Unit Tests", "individual component/function testing"),
+    "integration": ("Integration Tests", "component interaction testing"),
+    "ui": ("UI Tests", "user interface testing"),
+    "api": ("API Tests", "endpoint and service testing"),
+    "e2e": ("End-to-End Tests", "complete user workflow testing"),
+    "performance": ("Performance Tests", "load, stress, scalability testing"),
+    "security": ("Security Tests", "vulnerability and penetration testing"),
+    "database": ("Database Tests", "data integrity and CRUD operations"),
+    "contract": ("Contract Tests", "API contract validation"),
+    "smoke": ("Smoke Tests", "basic functionality verification"),
+    "uat": ("UAT Tests", "user acceptance testing of business requirements"),
+}
+
+# Sent as the cacheable system prompt; the document follows as the user turn
+FOCUSED_PROMPT_TEMPLATE = """
+You are a QA specialist and test automation expert responsible for comprehensive test planning.
+
+A feature document has been provided as the Feature Document.
+
+Instructions:
+1. Analyze the provided feature document thoroughly
+2. Generate {test_type} only ({focus}) - do not include any other test types
+3. Provide specific test cases with technical implementation details
+4. Include test frameworks, tools, and automation approaches
+5. Consider edge cases, error scenarios, and boundary conditions
+
+Return only JSON in this format:
+{schema}
+"""
+
+TEST_TYPE_SCHEMA = """{{
+"type": "{test_type}",
+"description": "string",
+"test_cases": [
+{{
+"name": "string",
+"objective": "string",
+"prerequisites": ["string"],
+"implementation_steps": ["string"],
+"expected_results": "string"
+}}
+]
+}}"""
+
+UAT_SCHEMA = """{
+"uat_test_cases": [
+{
+"test_case_id": "string",
+"test_case_name": "string",
+"test_objective": "string",
+"preconditions": "string",
+"test_steps": ["string"],
+"expected_result": "string",
+"actual_result": "string",
+"status": "string"
+}
+]
+}"""
+
+FOCUSED_PROMPT = PromptTemplate(FOCUSED_PROMPT_VERSION, "Feature Document:\n{input_document}\n", FOCUSED_PROMPT_TEMPLATE)
+# Everything but the input document is fixed per test type, so it is filled in once at import
+FOCUSED_PROMPTS = {
+    key: FOCUSED_PROMPT.partial(
+        test_type=name,
+        focus=focus,
+        schema=UAT_SCHEMA if key == "uat" else TEST_TYPE_SCHEMA.format(test_type=name),
+    )
+    for key, (name, focus) in TEST_TYPES.items()
+}
+
+
+def resolve_test_types(requested=None):
+    """Map requested type names to TEST_TYPES keys, defaulting to all of them.
+
+    Accepts keys ("api"), short names ("API") or display names ("API Tests").
+    Raises ValueError listing any names that don't match.
+    """
+    if not requested:
+        return list(TEST_TYPES)
+    if isinstance(requested, str):
+        requested = [requested]
+
+    lookup = {}
+    for key, (name, _) in TEST_TYPES.items():
+        lookup[key] = key
+        lookup[name.lower()] = key
+        lookup[name.lower().replace(" tests", "")] = key
+
+    resolved = []
+    unknown = []
+    for name in requested:
+        key = lookup.get(str(name).strip().lower())
+        if key is None:
+            unknown.append(str(name))
+        elif key not in resolved:
+            resolved.append(key)
+    if unknown:
+        raise ValueError(f"Unknown test types: {', '.join(unknown)}. Choose from: {', '.join(TEST_TYPES)}")
+    return resolved
+
+
+def build_focused_body(test_type_key, final_input):
+    prompt = FOCUSED_PROMPTS[test_type_key]
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": FOCUSED_MAX_TOKENS,
+        "system": cached_system(prompt.render_system()),
+        "messages": [{"role": "user", "content": prompt.render(input_document=final_input)}]
+    }
+
+
+def parse_focused_result(test_type_key, text):
+    """Parse one focused response into a test type dict, or a list of UAT cases for "uat"."""
+    parsed = parse_plan_text(text)
+    if test_type_key == "uat":
+        return parsed.get("uat_test_cases", []) if isinstance(parsed, dict) else []
+    name, _ = TEST_TYPES[test_type_key]
+    if not isinstance(parsed, dict):
+        return {"type": name, "description": "Response could not be parsed", "test_cases": [], "raw_text": text}
+    if "test_types" in parsed and parsed["test_types"]:
+        parsed = parsed["test_types"][0]
+    if not parsed.get("type"):
+        parsed["type"] = name
+    parsed.setdefault("test_cases", [])
+    return parsed
+
+
+def uat_test_type(uat_test_cases):
+    """Present UAT cases as a test type entry for renderers that only show `test_types`"""
+    return {
+        "type": TEST_TYPES["uat"][0],
+        "description": "User acceptance test cases validating business requirements",
+        "test_cases": [
+            {
+                "name": case.get("test_case_name", case.get("test_case_id", "")),
+                "objective": case.get("test_objective", ""),
+                "prerequisites": [case["preconditions"]] if case.get("preconditions") else [],
+                "implementation_steps": case.get("test_steps", []),
+                "expected_results": case.get("expected_result", ""),
+            }
+            for case in uat_test_cases
+        ],
+    }
+
+
+def assemble_plan(results, uat_as_test_type=False):
+    """Assemble focused results ({type_key: parsed}) into the standard plan shape in TEST_TYPES order"""
+    plan = {"test_types": [], "uat_test_cases": []}
+    for key in TEST_TYPES:
+        if key not in results:
+            continue
+        if key == "uat":
+            plan["uat_test_cases"] = results[key]
+        else:
+            plan["test_types"].append(results[key])
+    if uat_as_test_type and plan["uat_test_cases"]:
+        plan["test_types"].append(uat_test_type(plan.pop("uat_test_cases")))
+    return plan
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import re
+import threading
+import time
+
+from plan_cache import normalize_input
+from storage import connect
+
+# Test case columns are weighted name > objective > steps when ranking matches
+RANK_WEIGHTS = (5.0, 2.0, 1.0)
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def input_hash(final_input):
+    """Hash of the normalized input text, shared by every plan generated from the same document"""
+    return hashlib.sha256(normalize_input(final_input).encode("utf-8")).hexdigest()
+
+
+def plan_test_cases(plan):
+    """(test type, test case) for every test case in a plan, UAT cases last"""
+    for test_type in plan.get("test_types", []):
+        for test_case in test_type.get("test_cases", []):
+            if isinstance(test_case, dict):
+                yield test_type.get("type", ""), test_case
+    for test_case in plan.get("uat_test_cases", []):
+        if isinstance(test_case, dict):
+            yield "UAT Tests", test_case
+
+
+def _indexed_fields(test_case):
+    name = test_case.get("name") or test_case.get("test_case_name") or ""
+    objective = test_case.get("objective") or test_case.get("test_objective") or ""
+    steps = test_case.get("implementation_steps") or test_case.get("test_steps") or []
+    if not isinstance(steps, list):
+        steps = [steps]
+    return str(name), str(objective), "\n".join(str(step) for step in steps)
+
+
+def match_query(text):
+    """Turn free text into an FTS5 query matching every word, the last one as a prefix.
+
+    Quoting each word keeps FTS5 operators and punctuation in user input from being parsed.
+    Returns None when the text has no words.
+    """
+    words = WORD_PATTERN.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _matches(token, words):
+    # A rough stand-in for the index's porter stemming: "resets" and "resetting" match "reset"
+    token = token.lower()
+    return any(token.startswith(word[:max(3, len(word) - 2)]) for word in words)
+
+
+def snippet(text, words, size=12):
+    """Up to `size` words of `text` around its first match of `words`, matches in [brackets]"""
+    tokens = text.split()
+    first = next((i for i, token in enumerate(tokens) if _matches(token, words)), 0)
+    start = max(0, min(first - size // 3, len(tokens) - size))
+    window = [f"[{token}]" if _matches(token, words) else token for token in tokens[start:start + size]]
+    return ("… " if start > 0 else "") + " ".join(window) + (" …" if start + size < len(tokens) else "")
+
+
+class PlanHistory:
+    """Every generated plan with its metadata, and a full-text index over its test cases.
+
+    Plans are stored whole; each test case is also stored as its own row and indexed by
+    an FTS5 table (kept in sync by triggers) over its name, objective and steps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS plans (
+                id INTEGER PRIMARY KEY, created_at REAL NOT NULL, source TEXT, input_hash TEXT NOT NULL,
+                model TEXT, cache_status TEXT, duration REAL, timings TEXT, test_cases INTEGER NOT NULL,
+                plan TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS plans_input_hash ON plans (input_hash);
+            CREATE INDEX IF NOT EXISTS plans_created_at ON plans (created_at);
+            CREATE TABLE IF NOT EXISTS test_cases (
+                id INTEGER PRIMARY KEY, plan_id INTEGER NOT NULL, position INTEGER NOT NULL,
+                test_type TEXT NOT NULL, name TEXT NOT NULL, objective TEXT NOT NULL, steps TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS test_cases_plan ON test_cases (plan_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS test_cases_fts USING fts5(
+                name, objective, steps, content='test_cases', content_rowid='id',
+                tokenize='porter unicode61', prefix='2 3'
+            );
+            CREATE TRIGGER IF NOT EXISTS test_cases_ai AFTER INSERT ON test_cases BEGIN
+                INSERT INTO test_cases_fts (rowid, name, objective, steps)
+                VALUES (new.id, new.name, new.objective, new.steps);
+            END;
+            CREATE TRIGGER IF NOT EXISTS test_cases_ad AFTER DELETE ON test_cases BEGIN
+                INSERT INTO test_cases_fts (test_cases_fts, rowid, name, objective, steps)
+                VALUES ('delete', old.id, old.name, old.objective, old.steps);
+            END;
+            """
+        )
+        self._db.commit()
+
+    def record(self, plan, input_hash, model=None, source=None, cache_status=None, duration=None, timings=None):
+        """Store a plan and index its test cases; returns the plan's history ID"""
+        cases = list(plan_test_cases(plan))
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO plans (created_at, source, input_hash, model, cache_status, duration, timings, "
+                "test_cases, plan) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), source, input_hash, model, cache_status, duration,
+                 json.dumps(timings) if timings is not None else None, len(cases), json.dumps(plan))
+            )
+            plan_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO test_cases (plan_id, position, test_type, name, objective, steps, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (plan_id, position, test_type, *_indexed_fields(test_case), json.dumps(test_case))
+                    for position, (test_type, test_case) in enumerate(cases)
+                ]
+            )
+            self._db.commit()
+        return plan_id
+
+    def search(self, query, limit=20, test_type=None, model=None):
+        """Test cases matching every word of `query`, best first, each with its plan's metadata"""
+        match = match_query(query)
+        if match is None:
+            return []
+        # Only the ranking runs over every match; rows and snippets are read for the returned ones
+        sql = "SELECT test_cases_fts.rowid FROM test_cases_fts"
+        filters = ""
+        params = [match]
+        if test_type or model:
+            sql += " JOIN test_cases c ON c.id = test_cases_fts.rowid JOIN plans p ON p.id = c.plan_id"
+        if test_type:
+            filters += " AND c.test_type = ?"
+            params.append(test_type)
+        if model:
+            filters += " AND p.model = ?"
+            params.append(model)
+        sql += (
+            f" WHERE test_cases_fts MATCH ?{filters}"
+            f" ORDER BY bm25(test_cases_fts, {', '.join(map(str, RANK_WEIGHTS))}) LIMIT ?"
+        )
+        params.append(limit)
+        with self._lock:
+            ids = [row[0] for row in self._db.execute(sql, params).fetchall()]
+            if not ids:
+                return []
+            rows = self._db.execute(
+                "SELECT c.id, c.plan_id, c.position, c.test_type, c.name, c.objective, c.steps, c.data, "
+                "p.created_at, p.model, p.input_hash FROM test_cases c JOIN plans p ON p.id = c.plan_id "
+                f"WHERE c.id IN ({', '.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        words = [word.lower() for word in WORD_PATTERN.findall(query)]
+        results = []
+        for case_id in ids:
+            _, plan_id, position, case_type, name, objective, steps, data, created_at, plan_model, plan_input_hash = by_id[case_id]
+            results.append({
+                "plan_id": plan_id,
+                "position": position,
+                "test_type": case_type,
+                "test_case": json.loads(data),
+                "snippet": snippet(" ".join((name, objective, steps)), words),
+                "created_at": created_at,
+                "model": plan_model,
+                "input_hash": plan_input_hash,
+            })
+        return results
+
+    def _metadata(self, row):
+        plan_id, created_at, source, plan_input_hash, model, cache_status, duration, timings, test_cases = row
+        return {
+            "id": plan_id,
+            "created_at": created_at,
+            "source": source,
+            "input_hash": plan_input_hash,
+            "model": model,
+            "cache_status": cache_status,
+            "duration": duration,
+            "timings": json.loads(timings) if timings else None,
+            "test_cases": test_cases,
+        }
+
+    def recent(self, limit=20, input_hash=None):
+        """Metadata of the latest plans, optionally only those generated from one input"""
+        sql = (
+            "SELECT id, created_at, source, input_hash, model, cache_status, duration, timings, test_cases FROM plans"
+        )
+        params = []
+        if input_hash:
+            sql += " WHERE input_hash = ?"
+            params.append(input_hash)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [self._metadata(row) for row in rows]
+
+    def get(self, plan_id):
+        """A stored plan with its metadata, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, created_at, source, input_hash, model, cache_status, duration, timings, test_cases, plan "
+                "FROM plans WHERE id = ?",
+                (plan_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {**self._metadata(row[:-1]), "plan": json.loads(row[-1])}
+
+    def purge(self, older_than):
+        """Delete plans created more than `older_than` seconds ago; returns how many were deleted"""
+        cutoff = time.time() - older_than
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM test_cases WHERE plan_id IN (SELECT id FROM plans WHERE created_at < ?)", (cutoff,)
+            )
+            deleted = self._db.execute("DELETE FROM plans WHERE created_at < ?", (cutoff,)).rowcount
+            self._db.commit()
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            plans = self._db.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+            test_cases = self._db.execute("SELECT COUNT(*) FROM test_cases").fetchone()[0]
+        return {"plans": plans, "test_cases": test_cases}
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+
+from chunking import chunk_text, merge_plans, split_sections
+from storage import connect
+
+SECTION_NOTE = (
+    "(This is one section of a larger requirements document. "
+    "Generate test cases only for the requirements in this section.)\n\n"
+)
+
+# Sections shorter than this (e.g. a heading directly followed by a subheading) join the next one
+MIN_SECTION_CHARS = 200
+
+
+def split_document(text, max_tokens):
+    """Split a document into heading-delimited sections, each under `max_tokens`.
+
+    Boundaries depend only on the headings around them, so editing one section leaves the
+    others (and their hashes) unchanged.
+    """
+    units = []
+    pending = ""
+    for section in split_sections(text):
+        if pending:
+            section = pending + "\n\n" + section
+            pending = ""
+        if len(section) < MIN_SECTION_CHARS:
+            pending = section
+            continue
+        units.extend(chunk_text(section, max_tokens))
+    if pending:
+        if units:
+            units[-1] += "\n\n" + pending
+        else:
+            units.append(pending)
+    return units
+
+
+def annotate_section(text):
+    """Prefix a section with a note telling the model it only sees part of the document"""
+    return SECTION_NOTE + text
+
+
+class SectionPlanStore:
+    """The sections of each document's latest version, with the partial plan each produced.
+
+    Rows are keyed by a caller-supplied document ID; `section_key` is a hash of the
+    section text together with everything else that shaped its plan (prompt, model).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS section_plans ("
+            "document_id TEXT NOT NULL, position INTEGER NOT NULL, section_key TEXT NOT NULL, "
+            "heading TEXT NOT NULL, plan TEXT, updated_at REAL NOT NULL, PRIMARY KEY (document_id, position))"
+        )
+        self._db.commit()
+
+    def load(self, document_id):
+        """The stored sections in document order, as dicts with key, heading and plan"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT section_key, heading, plan FROM section_plans WHERE document_id = ? ORDER BY position",
+                (document_id,)
+            ).fetchall()
+        return [
+            {"key": key, "heading": heading, "plan": json.loads(plan) if plan is not None else None}
+            for key, heading, plan in rows
+        ]
+
+    def save(self, document_id, sections, plans):
+        """Replace a document's sections, storing `plans[section key]` for each"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM section_plans WHERE document_id = ?", (document_id,))
+            self._db.executemany(
+                "INSERT INTO section_plans (document_id, position, section_key, heading, plan, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (document_id, position, section["key"], section["heading"],
+                     json.dumps(plans[section["key"]]) if plans.get(section["key"]) is not None else None, now)
+                    for position, section in enumerate(sections)
+                ]
+            )
+            self._db.commit()
+
+
+def _heading(text):
+    return text.strip().split("\n", 1)[0].strip()[:120]
+
+
+def prepare_update(store, document_id, final_input, max_tokens, section_key, reuse=True):
+    """Split a new version of a document and diff it against the stored version.
+
+    `section_key(text)` hashes a section. Returns (sections, plans, diff): the new sections
+    (dicts with key, heading and text), the reusable stored plans by section key, and
+    counts of unchanged, changed, added and removed sections. A new section whose heading
+    matches a section that disappeared counts as changed rather than added.
+    """
+    sections = [
+        {"key": section_key(text), "heading": _heading(text), "text": text}
+        for text in split_document(final_input, max_tokens)
+    ]
+    previous = store.load(document_id)
+    previous_keys = {row["key"] for row in previous}
+    previous_plans = {row["key"]: row["plan"] for row in previous if row["plan"] is not None}
+    current_keys = {section["key"] for section in sections}
+    removed_headings = [row["heading"] for row in previous if row["key"] not in current_keys]
+
+    plans = {}
+    diff = {"sections": len(sections), "unchanged": 0, "changed": 0, "added": 0, "removed": 0}
+    for section in sections:
+        if section["key"] in previous_keys:
+            diff["unchanged"] += 1
+            # A section whose plan could not be parsed last time is generated again
+            if reuse and section["key"] in previous_plans:
+                plans[section["key"]] = previous_plans[section["key"]]
+        elif section["heading"] in removed_headings:
+            removed_headings.remove(section["heading"])
+            diff["changed"] += 1
+        else:
+            diff["added"] += 1
+    diff["removed"] = len(removed_headings)
+    diff["regenerated"] = sum(1 for section in sections if section["key"] not in plans)
+    return sections, plans, diff
+
+
+def save_update(store, document_id, sections, plans):
+    """Store the new version's section plans and return them merged into one plan"""
+    store.save(document_id, sections, plans)
+    # merge_plans renumbers UAT cases in place, so merge copies of what was stored
+    return merge_plans([json.loads(json.dumps(plans.get(section["key"]))) for section in sections])
@@ -0,0 +1,390 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+from storage import connect
+
+STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED = {"succeeded", "failed", "cancelled"}
+_JSON_FIELDS = ("request", "progress", "result")
+
+logger = logging.getLogger("testbuddy")
+
+
+def _encode(fields):
+    return {
+        name: json.dumps(value) if name in _JSON_FIELDS and value is not None else value
+        for name, value in fields.items()
+    }
+
+
+async def _in_thread(fn, *args, **kwargs):
+    """Run a blocking store call off the event loop, since SQLite may wait on another process's lock"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+class JobStore:
+    """SQLite-backed job records, so queued and finished jobs survive a restart.
+
+    `request`, `progress` and `result` are stored as JSON text. A running job's
+    `heartbeat_at` is refreshed by the process running it, so jobs left behind by a
+    process that died can be told apart from those still running.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, request TEXT NOT NULL, progress TEXT, result TEXT, "
+            "error TEXT, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "heartbeat_at REAL)"
+        )
+        # Stores created before heartbeats were kept
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat_at" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+
+    def create(self, request):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, request, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(request), time.time())
+            )
+            self._db.commit()
+        return job_id
+
+    def get(self, job_id, include_request=False):
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            job = dict(zip([column[0] for column in cursor.description], row))
+        for field in _JSON_FIELDS:
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        if not include_request:
+            del job["request"]
+        return job
+
+    def update(self, job_id, **fields):
+        fields = _encode(fields)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def record_progress(self, job_id, progress):
+        """Store a running job's progress; False once it has stopped running, e.g. was cancelled"""
+        with self._lock:
+            updated = self._db.execute(
+                "UPDATE jobs SET progress = ? WHERE id = ? AND status = 'running'", (json.dumps(progress), job_id)
+            ).rowcount
+            self._db.commit()
+        return updated == 1
+
+    def claim(self, job_id):
+        """Mark a queued job running; False if it isn't queued, e.g. another worker process claimed it"""
+        now = time.time()
+        with self._lock:
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? WHERE id = ? AND status = 'queued'",
+                (now, now, job_id)
+            ).rowcount
+            self._db.commit()
+        return claimed == 1
+
+    def finish(self, job_id, status, **fields):
+        """Record a running job's outcome unless it was cancelled meanwhile; returns whether it was recorded"""
+        fields = _encode({"status": status, "finished_at": time.time(), **fields})
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            updated = self._db.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = 'running'", (*fields.values(), job_id)
+            ).rowcount
+            self._db.commit()
+        return updated == 1
+
+    def heartbeat(self, job_id):
+        """Note that a running job is still being worked on; returns its status"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id)
+            )
+            self._db.commit()
+            row = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def status(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def queued_ids(self):
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [row[0] for row in rows]
+
+    def requeue_running(self):
+        """Put jobs left running by a previous process back in the queue; returns how many"""
+        with self._lock:
+            count = self._db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+            self._db.commit()
+        return count
+
+    def requeue_stale(self, older_than):
+        """Put running jobs without a heartbeat for `older_than` seconds back in the queue; returns how many.
+
+        Their process died or hung, so any worker may claim them again.
+        """
+        with self._lock:
+            count = self._db.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+                (time.time() - older_than,)
+            ).rowcount
+            self._db.commit()
+        return count
+
+    def purge(self, older_than):
+        """Delete finished jobs that finished more than `older_than` seconds ago"""
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+                (time.time() - older_than,)
+            )
+            self._db.commit()
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: dict(rows).get(status, 0) for status in STATUSES}
+
+
+class _JobProgress:
+    """Partial results of the job running in the current context.
+
+    Written to the store off the event loop, one write at a time; pieces added while a
+    write is running go out together in the next one. Writes stop once the job is no
+    longer running, so a cancelled job's progress stays where it was cancelled.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.partial = {}
+        self.total = None
+        self._writer = None
+        self._dirty = False
+
+    def add(self, name, result, total=None):
+        self.partial[name] = result
+        if total is not None:
+            self.total = total
+        self._dirty = True
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        try:
+            while self._dirty:
+                self._dirty = False
+                progress = {"completed": len(self.partial), "total": self.total, "partial": dict(self.partial)}
+                if not await _in_thread(self.store.record_progress, self.job_id, progress):
+                    break
+        finally:
+            self._writer = None
+
+    async def flush(self):
+        """Wait for the progress reported so far to be stored"""
+        if self._writer is not None:
+            await asyncio.shield(self._writer)
+
+
+_current_job = contextvars.ContextVar("testbuddy_job", default=None)
+
+
+def report_partial(name, result, total=None):
+    """Record one finished piece (a chunk or test type) of the current job's plan.
+
+    Does nothing outside a job, so generation code can call it unconditionally.
+    """
+    progress = _current_job.get()
+    if progress is not None:
+        progress.add(name, result, total)
+
+
+class JobQueue:
+    """Runs stored jobs with `workers` concurrent asyncio workers.
+
+    `handler(request)` returns a content dict; a dict with "error" fails the job, while
+    exceptions are retried up to `retries` times with jittered exponential backoff (as in
+    batch.run_batch). Jobs interrupted by a shutdown are re-queued and resume on start.
+
+    Several processes may run a queue over the same store: each job is claimed atomically,
+    so it runs once. Only one of them should `start(recover=True)`, since recovery re-queues
+    every running job, including those running in the other processes. A job cancelled
+    through another process is seen in the store within `cancel_poll_interval` seconds and
+    stopped there; the same check refreshes the job's heartbeat. Every `poll_interval`
+    seconds each queue re-queues running jobs whose heartbeat is older than `stale_after`
+    seconds, then picks up queued jobs it doesn't hold yet, so jobs submitted to or left by
+    a process that died are run by the others.
+    """
+
+    def __init__(self, store, handler, workers=2, retries=2, backoff=1.0, cancel_poll_interval=1.0,
+                 poll_interval=5.0, stale_after=60.0):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.cancel_poll_interval = cancel_poll_interval
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._queue = None
+        self._worker_tasks = []
+        self._pending = set()
+        self._running = {}
+        self._cancel_requested = set()
+
+    def start(self, recover=True):
+        """Start the workers on the running event loop and enqueue jobs left from earlier runs.
+
+        With `recover`, jobs left running by a previous process are queued again first.
+        """
+        self._queue = asyncio.Queue()
+        self._pending = set()
+        if recover:
+            self.store.requeue_running()
+        for job_id in self.store.queued_ids():
+            self._enqueue(job_id)
+        self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._worker_tasks.append(asyncio.ensure_future(self._poll()))
+
+    async def stop(self):
+        tasks = self._worker_tasks + list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, request):
+        job_id = await _in_thread(self.store.create, request)
+        self._enqueue(job_id)
+        return job_id
+
+    def _enqueue(self, job_id):
+        if job_id not in self._pending and job_id not in self._running:
+            self._pending.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _poll(self):
+        """Take over stale jobs and pick up jobs queued through other processes"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                stale = await _in_thread(self.store.requeue_stale, self.stale_after)
+                if stale:
+                    logger.info("re-queued %d jobs without a heartbeat for %gs", stale, self.stale_after)
+                for job_id in await _in_thread(self.store.queued_ids):
+                    self._enqueue(job_id)
+            except Exception as e:
+                logger.warning("polling the job store failed: %s", e)
+
+    async def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None if there is no such job"""
+        job = await _in_thread(self.store.get, job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            self._cancel_requested.add(job_id)
+            task.cancel()
+        await _in_thread(self.store.update, job_id, status="cancelled", finished_at=time.time())
+        return await _in_thread(self.store.get, job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            task = asyncio.ensure_future(self._run(job_id))
+            self._running[job_id] = task
+            self._pending.discard(job_id)
+            watcher = asyncio.ensure_future(self._watch_cancel(job_id, task))
+            try:
+                # wait() doesn't raise when the job task is cancelled, only when this worker is
+                await asyncio.wait([task])
+            finally:
+                watcher.cancel()
+                self._running.pop(job_id, None)
+                self._cancel_requested.discard(job_id)
+
+    async def _watch_cancel(self, job_id, task):
+        """Keep a running job's heartbeat fresh and stop the job once its stored status says
+        another process cancelled it.
+
+        Cancelling the task stops the job between and during its chunks, test types and
+        retries, so it makes no further Bedrock calls.
+        """
+        while not task.done():
+            await asyncio.sleep(self.cancel_poll_interval)
+            if await _in_thread(self.store.heartbeat, job_id) == "cancelled":
+                self._cancel_requested.add(job_id)
+                task.cancel()
+                return
+
+    async def _run(self, job_id):
+        # Fails when the job was cancelled while it waited, or another worker process took it
+        if not await _in_thread(self.store.claim, job_id):
+            return
+        job = await _in_thread(self.store.get, job_id, include_request=True)
+        progress = _JobProgress(self.store, job_id)
+        token = _current_job.set(progress)
+        attempts = 0
+        try:
+            while True:
+                attempts += 1
+                await _in_thread(self.store.update, job_id, attempts=attempts)
+                try:
+                    content = await self.handler(job["request"])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if attempts > self.retries:
+                        content = {"error": f"{type(e).__name__}: {e}"}
+                    else:
+                        await asyncio.sleep(self.backoff * 2 ** (attempts - 1) * (0.5 + random.random()))
+                        continue
+                break
+        except asyncio.CancelledError:
+            if job_id in self._cancel_requested:
+                await _in_thread(self.store.update, job_id, status="cancelled", finished_at=time.time())
+            else:
+                await _in_thread(self.store.update, job_id, status="queued")
+            raise
+        finally:
+            _current_job.reset(token)
+
+        await progress.flush()
+        # A cancel handled by another worker process only shows in the store; keep it
+        if "error" in content:
+            await _in_thread(self.store.finish, job_id, "failed", error=content["error"])
+        else:
+            await _in_thread(self.store.finish, job_id, "succeeded", result=content)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            **self.store.counts(),
+        }
@@ -1,23 +1,84 @@
-import boto3
 import json
 
-bedrock = boto3.client('bedrock', region_name='us-east-1')
+# Used when the model list can't be fetched
+FALLBACK_MODEL_IDS = [
+    "anthropic.claude-3-sonnet-20240229-v1:0",
+    "anthropic.claude-3-haiku-20240307-v1:0",
+    "anthropic.claude-instant-v1",
+]
 
-try:
-    response = bedrock.list_foundation_models()
-    claude_models = [model for model in response['modelSummaries'] 
-                    if 'claude' in model['modelId'].lower()]
-    
-    print("Available Claude models:")
-    for model in claude_models:
-        print(f"- {model['modelId']}")
+
+def inference_profile_ids(client):
+    """{model ARN: system-defined inference profile ID} for the account's region.
+
+    Empty when the profiles can't be listed, e.g. for lack of permission.
+    """
+    profiles = {}
+    kwargs = {"typeEquals": "SYSTEM_DEFINED"}
+    try:
+        while True:
+            response = client.list_inference_profiles(**kwargs)
+            for profile in response.get('inferenceProfileSummaries', []):
+                for model in profile.get('models', []):
+                    # Several regions' profiles can serve a model; keep the first listed
+                    profiles.setdefault(model['modelArn'], profile['inferenceProfileId'])
+            if not response.get('nextToken'):
+                return profiles
+            kwargs["nextToken"] = response['nextToken']
+    except Exception:
+        return profiles
+
+
+def list_claude_models(client=None, on_demand_only=True):
+    """Return the IDs of Claude models available in the account's region.
+
+    With `on_demand_only`, provisioned-throughput variants (e.g. `...:0:200k`) are left
+    out, since `invoke_model` can't call them by model ID. Models only reachable through
+    an inference profile (Claude 3.7 Sonnet, the Claude 4 family) are returned as that
+    profile's ID (e.g. `us.anthropic.claude-sonnet-4-...`), which `invoke_model` accepts.
+    """
+    if client is None:
+        import boto3
+        client = boto3.client('bedrock', region_name='us-east-1')
+    response = client.list_foundation_models(byProvider='Anthropic')
+    model_ids = []
+    profiles = None
+    for model in response['modelSummaries']:
+        if 'claude' not in model['modelId'].lower():
+            continue
+        if model.get('modelLifecycle', {}).get('status', 'ACTIVE') != 'ACTIVE':
+            continue
+        inference_types = model.get('inferenceTypesSupported', ['ON_DEMAND'])
+        if on_demand_only and 'ON_DEMAND' not in inference_types:
+            if 'INFERENCE_PROFILE' not in inference_types:
+                continue
+            if profiles is None:
+                profiles = inference_profile_ids(client)
+            profile_id = profiles.get(model.get('modelArn'))
+            if profile_id is not None:
+                model_ids.append(profile_id)
+            continue
+        model_ids.append(model['modelId'])
+    return model_ids
+
+
+def main():
+    try:
+        claude_models = list_claude_models(on_demand_only=False)
         
-except Exception as e:
-    print(f"Error: {e}")
-    print("\nTry these common Claude model IDs:")
-    print("- anthropic.claude-3-sonnet-20240229-v1:0")
-    print("- anthropic.claude-3-haiku-20240307-v1:0")
-    print("- anthropic.claude-instant-v1")
+        print("Available Claude models:")
+        for model_id in claude_models:
+            print(f"- {model_id}")
+            
+    except Exception as e:
+        print(f"Error: {e}")
+        print("\nTry these common Claude model IDs:")
+        for model_id in FALLBACK_MODEL_IDS:
+            print(f"- {model_id}")
+
+
+if __name__ == "__main__":
+    main()
 
 """
 Available Claude models:
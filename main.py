@@ -1,98 +1,165 @@
-from fastapi import FastAPI
-import boto3
+from fastapi import FastAPI, File, Form, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import List
+import asyncio
+import contextvars
 import json
+import logging
+import os
+import time
+
+from batch import parse_jsonl, run_batch, summarize
+from bedrock_client import create_client
+from bedrock_executor import BedrockExecutor, BedrockOverloadedError
+from compact_output import COMPACT_PROMPT_VERSION, build_compact_body, compact_result_plan
+from compaction import compact_input
+from chunking import annotate_chunks, chunk_text, estimate_tokens, merge_plans
+from dedupe import DEFAULT_THRESHOLD, MODES as DEDUPE_MODES, dedupe_plan
+from document_extraction import UnsupportedFormatError, extract_file, guess_mime_type, preload_parsers
+from engine import (
+    TEST_PLAN_MAX_TOKENS, Continuation, LazyClient, PlanStream, build_test_plan_body as build_plan_body,
+    generated_focused_result, generated_plan, prewarm, record_call_failure, record_call_success
+)
+from list_models import list_claude_models
+from metrics import (
+    HTTP_IN_FLIGHT, REGISTRY, Counter, Gauge, SharedMetrics, annotate, current_trace, enable_request_log,
+    end_trace, finish_request, observe_stage, span, start_trace
+)
+from model_router import ModelCatalog, ModelRouter, resolve_slo
+from history import PlanHistory, input_hash as hash_input
+from incremental import SectionPlanStore, annotate_section, prepare_update, save_update
+from jobs import JobQueue, JobStore, report_partial
+from fan_out import (
+    FOCUSED_MAX_TOKENS, FOCUSED_PROMPT_VERSION, assemble_plan, build_focused_body, resolve_test_types
+)
+from plan_cache import PlanCache, make_cache_key
+from plan_parser import MAX_CONTINUATIONS, PlanStreamParser, parse_plan_text, recover_plan
+from prompts import API_QA_PROMPT
+from single_flight import SingleFlight
+from storage import shared_state_path, worker_count
+
+logger = logging.getLogger("testbuddy")
 
 app = FastAPI()
 
-bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
-
-QA_PROMPT_TEMPLATE = """
-    You are a QA specialist and test automation expert responsible for comprehensive test planning.
-
-    A new feature/requirement or document has been provided that needs thorough testing coverage across multiple technical test types and UAT test cases.
-
-    Feature Document:
-    {input_document}
-
-    Instructions:
-    1. Analyze the provided feature document thoroughly
-    2. Generate a comprehensive test plan focusing on technical test types including:
-    - Unit Tests (individual component/function testing)
-    - Integration Tests (component interaction testing)
-    - UI Tests (user interface testing)
-    - API Tests (endpoint and service testing)
-    - End-to-End Tests (complete user workflow testing)
-    - Performance Tests (load, stress, scalability testing)
-    - Security Tests (vulnerability and penetration testing)
-    - Database Tests (data integrity and CRUD operations)
-    - Contract Tests (API contract validation)
-    - Smoke Tests (basic functionality verification)
-    3. Generate UAT (User Acceptance Test) cases that focus on business requirements validation
-    4. For each test type, provide specific test cases with technical implementation details
-    5. Include test frameworks, tools, and automation approaches
-    6. Consider edge cases, error scenarios, and boundary conditions
-
-    Return the response in this JSON format:
-    {{
-    "test_types": [
-    {{
-    "type": "string",
-    "description": "string", 
-    "test_cases": [
-    {{
-    "name": "string",
-    "objective": "string",
-    "prerequisites": ["string"],
-    "implementation_steps": ["string"],
-    "expected_results": "string"
-    }}
-    ]
-    }}
-    ],
-    "uat_test_cases": [
-    {{
-    "test_case_id": "string",
-    "test_case_name": "string",
-    "test_objective": "string",
-    "preconditions": "string",
-    "test_steps": ["string"],
-    "expected_result": "string",
-    "actual_result": "string",
-    "status": "string"
-    }}
-    ]
-    }}
-"""
+# Pooled, adaptively retrying and (when TESTBUDDY_BEDROCK_RPM/TPM are set) rate-limited client.
+# Created by the startup prewarm, so importing the app doesn't wait for boto3.
+bedrock = LazyClient(lambda: create_client('bedrock-runtime', region_name='us-east-1'))
 
-@app.post("/chat")
-async def chat(message: dict):
-    prompt = message.get("prompt", "").strip()
-    
-    if not prompt:
-        return {"error": "Prompt cannot be empty"}
-    
-    body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 1000,
-        "messages": [{"role": "user", "content": prompt}]
-    }
-    
-    response = bedrock.invoke_model(
-        modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-        body=json.dumps(body)
+# Primary model of requests without an slo, and the only one known when model discovery fails
+MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+# Versioned in prompts.py; the version is part of every cache key built from it
+QA_PROMPT = API_QA_PROMPT
+# Near-duplicate handling when a request doesn't set `dedupe`: "off", "flag" or "merge"
+DEFAULT_DEDUPE_MODE = os.environ.get("TESTBUDDY_DEDUPE", "off")
+DEFAULT_DEDUPE_THRESHOLD = float(os.environ.get("TESTBUDDY_DEDUPE_THRESHOLD", str(DEFAULT_THRESHOLD)))
+# Inputs larger than this are split into chunks and generated map-reduce style
+DEFAULT_CHUNK_TOKENS = int(os.environ.get("TESTBUDDY_CHUNK_TOKENS", "6000"))
+DEFAULT_CHUNK_PARALLELISM = int(os.environ.get("TESTBUDDY_CHUNK_PARALLELISM", "4"))
+
+# Shared execution layer for every Bedrock call made by the API
+executor = BedrockExecutor(
+    max_in_flight=int(os.environ.get("TESTBUDDY_MAX_IN_FLIGHT", "16")),
+    max_queue=int(os.environ.get("TESTBUDDY_MAX_QUEUE", "64")),
+    queue_timeout=float(os.environ.get("TESTBUDDY_QUEUE_TIMEOUT", "30")),
+)
+
+# Picks the model for each request from the models discovered in the account
+model_router = ModelRouter(
+    ModelCatalog(
+        lambda: list_claude_models(create_client('bedrock', region_name='us-east-1')),
+        fallback=[MODEL_ID],
+        ttl=float(os.environ.get("TESTBUDDY_MODEL_LIST_TTL", "3600")),
+    ),
+    default_model=MODEL_ID,
+)
+
+# Worker processes `python serve.py` serves the API with. With more than one, the Bedrock
+# rate limit budget and /metrics are shared through SQLite, like the cache and job store
+WORKERS = worker_count()
+SHARED_STATE_PATH = shared_state_path()
+shared_metrics = SharedMetrics(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+# Set TESTBUDDY_REQUEST_LOG=1 to log one structured JSON line per request
+REQUEST_LOG = os.environ.get("TESTBUDDY_REQUEST_LOG", "").lower() in ("1", "true", "yes")
+if REQUEST_LOG:
+    enable_request_log()
+
+BEDROCK_IN_FLIGHT = Gauge("testbuddy_bedrock_in_flight", "Bedrock calls currently running")
+BEDROCK_WAITING = Gauge("testbuddy_bedrock_waiting", "Bedrock calls waiting for a free slot")
+
+def collect_executor_stats():
+    stats = executor.stats()
+    BEDROCK_IN_FLIGHT.set(stats["in_flight"])
+    BEDROCK_WAITING.set(stats["waiting"])
+
+REGISTRY.add_collector(collect_executor_stats)
+
+# Limits how many uploaded files are parsed at once across all requests
+extraction_slots = asyncio.Semaphore(int(os.environ.get("TESTBUDDY_EXTRACTION_CONCURRENCY", "4")))
+
+plan_cache = PlanCache(
+    os.environ.get("TESTBUDDY_CACHE_PATH", "testbuddy_cache.sqlite3"),
+    max_memory_entries=int(os.environ.get("TESTBUDDY_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_entries=int(os.environ.get("TESTBUDDY_CACHE_DISK_ENTRIES", "5000")),
+    ttl=float(os.environ.get("TESTBUDDY_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+# Per-section plans of documents submitted with a `document_id`, for incremental regeneration
+section_store = SectionPlanStore(os.environ.get("TESTBUDDY_SECTION_STORE_PATH", "testbuddy_sections.sqlite3"))
+
+# Every generated plan, searchable by its test cases; set TESTBUDDY_HISTORY=0 to stop recording
+HISTORY_ENABLED = os.environ.get("TESTBUDDY_HISTORY", "1").lower() not in ("0", "false", "no")
+plan_history = PlanHistory(os.environ.get("TESTBUDDY_HISTORY_PATH", "testbuddy_history.sqlite3"))
+# Seconds plans are kept, purged at startup; 0 keeps them forever
+HISTORY_RETENTION = float(os.environ.get("TESTBUDDY_HISTORY_RETENTION", "0"))
+
+# Identical test-plan generations already in flight are shared instead of repeated
+generations = SingleFlight()
+# Per run_test_plan call, how many generations it ran itself and how many it joined
+_generation_counts = contextvars.ContextVar("testbuddy_generation_counts", default=None)
+COALESCED_GENERATIONS = Counter(
+    "testbuddy_coalesced_generations_total",
+    "Generations served by joining an identical in-flight generation instead of calling Bedrock",
+)
+
+async def run_job(request):
+    content, _ = await run_test_plan(request, "job", use_cache=not request.get("no_cache"))
+    return content
+
+# Long generations run as background jobs whose state is kept in SQLite across restarts
+job_store = JobStore(os.environ.get("TESTBUDDY_JOB_STORE_PATH", "testbuddy_jobs.sqlite3"))
+jobs = JobQueue(
+    job_store,
+    run_job,
+    workers=int(os.environ.get("TESTBUDDY_JOB_WORKERS", "2")),
+    retries=int(os.environ.get("TESTBUDDY_JOB_RETRIES", "2")),
+    poll_interval=float(os.environ.get("TESTBUDDY_JOB_POLL_INTERVAL", "5")),
+    stale_after=float(os.environ.get("TESTBUDDY_JOB_STALE_AFTER", "60")),
+)
+JOB_RETENTION = float(os.environ.get("TESTBUDDY_JOB_RETENTION", str(7 * 24 * 3600)))
+JOBS = Gauge("testbuddy_jobs", "Background test plan jobs by status", ["status"], aggregate="latest")
+
+def collect_job_stats():
+    for status, count in job_store.counts().items():
+        JOBS.set(count, status=status)
+
+REGISTRY.add_collector(collect_job_stats)
+
+def overloaded_response(error):
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"error": str(error)},
+        headers={"Retry-After": str(error.retry_after)}
     )
-    
-    result = json.loads(response['body'].read())
-    return {"response": result['content'][0]['text']}
 
-@app.post("/test-plan")
-async def generate_test_plan(request: dict):
-    # Handle multiple input types
+def combine_inputs(request):
+    """Join feature_document, texts and documents from a request into one input string"""
     texts = request.get("texts", [])
     documents = request.get("documents", [])
     feature_document = request.get("feature_document", "")
     
-    # Combine all inputs
     combined_input = []
     
     if feature_document:
@@ -111,25 +178,829 @@ async def generate_test_plan(request: dict):
             combined_input.append(documents)
     
     if not combined_input:
-        return {"error": "At least one input (texts, documents, or feature_document) is required"}
+        return None
+    
+    return "\n\n".join(str(item) for item in combined_input)
+
+async def prepare_input(request):
+    """Combine a request's inputs and compact them unless it sets "compact": false.
+
+    Returns (final_input, compaction stats), with final_input None when nothing was sent.
+    """
+    final_input = combine_inputs(request)
+    if final_input is None or request.get("compact") is False:
+        return final_input, None
+    with span("compaction"):
+        final_input, stats = await run_in_threadpool(compact_input, final_input)
+    logger.info("compacted input: %s", json.dumps(stats))
+    return final_input, stats
+
+def read_int_param(request, name, default, minimum=1):
+    """Read a positive integer request parameter, raising ValueError with a client-facing message"""
+    value = request.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+def read_dedupe_params(request):
+    """(mode, threshold) from a request's `dedupe` and `dedupe_threshold`; mode is None when off.
+
+    Raises ValueError for an unknown mode or a threshold outside (0, 1].
+    """
+    mode = request.get("dedupe", DEFAULT_DEDUPE_MODE)
+    if mode in (None, False, "off"):
+        return None, None
+    if mode is True:
+        mode = "flag"
+    if mode not in DEDUPE_MODES:
+        raise ValueError(f"dedupe must be one of: off, {', '.join(DEDUPE_MODES)}")
+    try:
+        threshold = float(request.get("dedupe_threshold", DEFAULT_DEDUPE_THRESHOLD))
+    except (TypeError, ValueError):
+        raise ValueError("dedupe_threshold must be a number")
+    if not 0 < threshold <= 1:
+        raise ValueError("dedupe_threshold must be between 0 and 1")
+    return mode, threshold
+
+async def dedupe_content(content, mode, threshold):
+    """Flag or merge near-duplicate test cases in a response's plan, reporting counts under `duplicates`"""
+    try:
+        plan = json.loads(content["test_plan"])
+    except json.JSONDecodeError:
+        return content
+    if not isinstance(plan, dict):
+        return content
+    with span("dedupe"):
+        plan, stats = await run_in_threadpool(dedupe_plan, plan, mode, threshold)
+    content["test_plan"] = json.dumps(plan)
+    content["duplicates"] = stats
+    return content
+
+def build_test_plan_body(final_input):
+    return build_plan_body(QA_PROMPT, final_input)
+
+def cache_bypassed(request, raw_request):
+    """A request skips the cache lookup with `Cache-Control: no-cache` or `"no_cache": true`"""
+    cache_control = raw_request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control or bool(request.get("no_cache"))
+
+async def lookup_cached_plan(cache_key, use_cache=True):
+    """Return (cached_text, cache_status) for a test-plan request.
+
+    Off the event loop: a disk lookup may wait on another worker's write lock.
+    """
+    if not use_cache:
+        plan_cache.record_bypass()
+        return None, "BYPASS"
+    cached = await run_in_threadpool(plan_cache.get, cache_key)
+    return cached, "HIT" if cached is not None else "MISS"
+
+async def store_plan(cache_key, text, complete=True):
+    # Truncated generations are not worth serving again
+    if complete:
+        await run_in_threadpool(plan_cache.set, cache_key, text)
+
+async def record_history(content, final_input, cache_status, source):
+    """Keep a newly generated plan in the history store, adding its `history_id` to the content.
+
+    `source` is what asked for the plan: an endpoint such as "POST /test-plan", "job" or "batch".
+
+    Cache hits are skipped since their plan was recorded when it was generated. A failing
+    history store is logged rather than failing a request whose plan is already generated.
+    """
+    if not HISTORY_ENABLED or cache_status == "HIT" or "error" in content:
+        return content
+    plan = parse_plan_text(content["test_plan"])
+    if plan is None:
+        return content
+    trace = current_trace()
+    details = {"model": content.get("model"), "source": source, "cache_status": cache_status}
+    if trace is not None:
+        details.update(
+            model=details["model"] or ",".join(trace.models) or None,
+            duration=round(time.perf_counter() - trace.started, 4),
+            timings={stage: round(seconds, 4) for stage, seconds in trace.stages.items()},
+        )
+    try:
+        with span("history"):
+            content["history_id"] = await run_in_threadpool(plan_history.record, plan, hash_input(final_input), **details)
+    except Exception:
+        logger.exception("Recording the plan in the history store failed")
+    return content
+
+async def generate_once(cache_key, generate, *args):
+    """Run `await generate(*args)` unless an identical generation is already in flight.
+
+    Keyed by the plan cache key, so requests coalesce exactly when they would share a
+    cache entry. Every caller gets the same result or the same exception.
+    """
+    result, shared = await generations.run(cache_key, generate, *args)
+    counts = _generation_counts.get()
+    if counts is not None:
+        counts["shared" if shared else "executed"] += 1
+    if shared:
+        COALESCED_GENERATIONS.inc()
+        annotate(coalesced=True)
+    return result
+
+def pinned_model(request):
+    """The discovered model a request pins with `model`, or None if it pins none.
+
+    A base model ID also matches its inference profile (`us.anthropic...`). Raises
+    ValueError for a model that isn't available, rather than letting every call fail.
+    """
+    model = request.get("model")
+    if model is None:
+        return None
+    available = model_router.catalog.available()
+    if model in available:
+        return model
+    for model_id in available:
+        if model_id.endswith("." + model):
+            return model_id
+    raise ValueError(f"Unknown model: {model}. GET /models lists the available models")
+
+async def invalid_model_response(request):
+    """A 400 response if the request pins an unavailable model, else None"""
+    try:
+        await run_in_threadpool(pinned_model, request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return None
+
+async def route_request(request, input_tokens, max_tokens, test_type_keys=None):
+    """Route a request to its models using its optional `slo` and `model` fields.
+
+    Discovery may call Bedrock, so routing runs off the event loop. Raises ValueError
+    for an invalid `slo` or an unavailable `model`.
+    """
+    def route():
+        return model_router.route(
+            input_tokens, max_tokens, test_type_keys, slo=request.get("slo"), model=pinned_model(request)
+        )
+    
+    return await run_in_threadpool(route)
+
+async def invoke_routed(body, models):
+    """Invoke the first of `models` that isn't throttled or timing out; returns (result, model_id)"""
+    for attempt, model_id in enumerate(models):
+        started = time.perf_counter()
+        try:
+            result = await executor.invoke_model(bedrock, model_id, body)
+        except Exception as e:
+            logger.warning(record_call_failure(model_router, models, attempt, e))
+            continue
+        record_call_success(model_router, model_id, result, started)
+        return result, model_id
+
+async def open_routed_stream(body, models):
+    """Open a response stream on the first of `models` that accepts it; returns (stream, model_id)"""
+    for attempt, model_id in enumerate(models):
+        try:
+            return await executor.open_stream(bedrock, model_id, body), model_id
+        except Exception as e:
+            logger.warning(record_call_failure(model_router, models, attempt, e))
+
+async def invoke_with_continuation(body, models):
+    """Invoke the routed models, continuing output cut off at max_tokens instead of regenerating it.
+
+    Returns (text, stop_reason, continuations, model_id).
+    """
+    continuation = Continuation(body, models)
+    request = (body, models)
+    while request is not None:
+        result, model_id = await invoke_routed(*request)
+        request = continuation.feed(result, model_id)
+        if request is not None:
+            logger.info("continuing truncated response (%d/%d)", continuation.continuations, MAX_CONTINUATIONS)
+    return continuation.text, continuation.stop_reason, continuation.continuations, continuation.model_id
+
+async def stream_with_continuation(plan_stream, stream):
+    """Stream `plan_stream`'s generation from the already open `stream`, continuing output cut
+    off at max_tokens; the async counterpart of engine.stream_with_continuation.
+
+    Yields PlanStreamParser events as objects complete, and ("continuation", {"attempt"})
+    before each continuation.
+    """
+    while True:
+        try:
+            async for message in stream:
+                for event in plan_stream.feed(message):
+                    yield event
+        finally:
+            await stream.aclose()
+        request = plan_stream.end_call()
+        if request is None:
+            return
+        yield "continuation", {"attempt": plan_stream.continuations}
+        stream, model_id = await open_routed_stream(*request)
+        plan_stream.begin(model_id)
+
+def plan_content(text, stop_reason, continuations=0):
+    """Build the test_plan response content, salvaging what it can from malformed or truncated output"""
+    with span("parse"):
+        plan, complete = recover_plan(text)
+    if not isinstance(plan, dict):
+        return {"test_plan": text}, False
+    complete = complete and stop_reason != "max_tokens"
+    with span("render"):
+        content = {"test_plan": json.dumps(plan)}
+    if not complete:
+        content["truncated"] = True
+    if continuations:
+        content["continuations"] = continuations
+    return content, complete
+
+async def generate_compact_plan(final_input, models):
+    """Generate a plan with the compact tool-use output format, expanded to the standard schema.
+
+    Returns (plan, complete, model_id). `plan` is None if the response was cut off before
+    any test case could be recovered.
+    """
+    with span("prompt_build"):
+        body = build_compact_body(final_input, TEST_PLAN_MAX_TOKENS)
+    result, model_id = await invoke_routed(body, models)
+    with span("parse"):
+        plan, complete = compact_result_plan(result)
+    return plan, complete, model_id
+
+async def generate_compact_content(final_input, models):
+    """Response content for a compact-output generation; returns (content, complete).
+
+    Tool input can't be continued like text, so a compact response cut off before any test
+    case falls back to the standard format with its continuations.
+    """
+    plan, complete, model_id = await generate_compact_plan(final_input, models)
+    if plan is None:
+        logger.warning("compact output from %s was unusable, regenerating in the standard format", model_id)
+        text, stop_reason, continuations, model_id = await invoke_with_continuation(build_test_plan_body(final_input), models)
+        content, complete = plan_content(text, stop_reason, continuations)
+    else:
+        with span("render"):
+            content = {"test_plan": json.dumps(plan), "output_format": "compact"}
+        if not complete:
+            content["truncated"] = True
+    content["model"] = model_id
+    return content, complete
+
+async def generate_chunked_plan(chunks, parallelism, models, compact=False):
+    """Generate a partial plan per chunk concurrently and merge them into one plan.
+
+    Returns (plan, complete). `complete` is False when a chunk's plan could not be parsed
+    or was still cut off after its continuations.
+    """
+    semaphore = asyncio.Semaphore(parallelism)
+    
+    async def run_chunk(index, chunk):
+        plan = None
+        async with semaphore:
+            if compact:
+                plan, complete, _ = await generate_compact_plan(chunk, models)
+            if plan is None:
+                text, stop_reason, _, _ = await invoke_with_continuation(build_test_plan_body(chunk), models)
+                plan, complete = generated_plan(text, stop_reason)
+        report_partial(f"chunk_{index}", plan, total=len(chunks))
+        return plan, complete
+    
+    results = await asyncio.gather(*(run_chunk(index, chunk) for index, chunk in enumerate(annotate_chunks(chunks), 1)))
+    plans = [plan for plan, _ in results]
+    failed = sum(1 for plan in plans if plan is None)
+    if failed:
+        logger.warning("%d of %d chunk plans could not be parsed", failed, len(chunks))
+    with span("parse"):
+        return merge_plans(plans), all(complete for _, complete in results)
+
+async def generate_incremental_plan(document_id, final_input, section_tokens, parallelism, models, use_cache=True):
+    """Generate a plan section by section, reusing the plans of sections unchanged since the
+    document's last submission.
+
+    Returns (content, regenerated) where `regenerated` is the number of sections sent to Bedrock.
+    """
+    def section_key(text):
+        return make_cache_key(text, QA_PROMPT.version, models[0], TEST_PLAN_MAX_TOKENS, section=True)
+    
+    # Off the event loop: the section store may wait on another worker's write lock
+    sections, plans, diff = await run_in_threadpool(
+        prepare_update, section_store, document_id, final_input, section_tokens, section_key, use_cache
+    )
+    pending = [section for section in sections if section["key"] not in plans]
+    semaphore = asyncio.Semaphore(parallelism)
+    
+    async def run_section(section):
+        async def generate():
+            async with semaphore:
+                text, _, _, _ = await invoke_with_continuation(build_test_plan_body(annotate_section(section["text"])), models)
+            return parse_plan_text(text)
+        
+        plans[section["key"]] = await generate_once(section["key"], generate)
+        report_partial(section["heading"], plans[section["key"]], total=len(pending))
+    
+    await asyncio.gather(*(run_section(section) for section in pending))
+    with span("parse"):
+        plan = await run_in_threadpool(save_update, section_store, document_id, sections, plans)
+    logger.info("incremental plan for %s: %s", document_id, json.dumps(diff))
+    return {"test_plan": json.dumps(plan), "document_id": document_id, "sections": diff, "model": models[0]}, len(pending)
+
+async def generate_fan_out_plan(final_input, test_type_keys, use_cache, request):
+    """Generate each test type with its own focused request, all concurrently.
+
+    Each type is routed and cached separately, so simple types can use a faster model
+    and later requests for a different subset reuse cached types.
+    Returns (plan, all_cached).
+    """
+    input_tokens = estimate_tokens(final_input)
+    
+    async def run_type(key):
+        route = await route_request(request, input_tokens, FOCUSED_MAX_TOKENS, [key])
+        cache_key = make_cache_key(final_input, FOCUSED_PROMPT_VERSION, route["models"][0], FOCUSED_MAX_TOKENS, test_type=key)
+        cached = await run_in_threadpool(plan_cache.get, cache_key) if use_cache else None
+        if cached is not None:
+            parsed = json.loads(cached)
+            report_partial(key, parsed, total=len(test_type_keys))
+            return key, parsed, True
+        
+        async def generate():
+            with span("prompt_build"):
+                body = build_focused_body(key, final_input)
+            text, stop_reason, _, _ = await invoke_with_continuation(body, route["models"])
+            parsed, complete = generated_focused_result(key, text, stop_reason)
+            await store_plan(cache_key, json.dumps(parsed), complete)
+            return parsed
+        
+        parsed = await generate_once(cache_key, generate)
+        report_partial(key, parsed, total=len(test_type_keys))
+        return key, parsed, False
+    
+    outcomes = await asyncio.gather(*(run_type(key) for key in test_type_keys))
+    plan = assemble_plan({key: parsed for key, parsed, _ in outcomes})
+    return plan, all(hit for _, _, hit in outcomes)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def recover_stores():
+    """Startup housekeeping that must run once however many workers serve the API.
+
+    Purges expired jobs and history, and re-queues jobs left running by a previous run;
+    returns how many were re-queued.
+    """
+    job_store.purge(JOB_RETENTION)
+    if HISTORY_RETENTION > 0:
+        plan_history.purge(HISTORY_RETENTION)
+    return job_store.requeue_running()
+
+@app.on_event("startup")
+async def start_jobs():
+    # Several workers recover in serve.py, before they start, so none re-queues another's running jobs
+    if WORKERS == 1:
+        recover_stores()
+    jobs.start(recover=False)
+    if shared_metrics is not None:
+        shared_metrics.start()
+    # Off the startup path: the Bedrock client, model discovery and the document parsers
+    prewarm(bedrock.get, model_router.catalog.available, preload_parsers)
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    # Running jobs are re-queued and resume when the server starts again
+    await jobs.stop()
+    executor.shutdown()
+    if shared_metrics is not None:
+        shared_metrics.stop()
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Trace each request: in-flight gauge, duration and status metrics, optional JSON log line"""
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    
+    trace, token = start_trace(request.url.path)
+    HTTP_IN_FLIGHT.inc()
+    
+    def finish(status):
+        # Label by route template so path parameters don't create new series
+        route = request.scope.get("route")
+        trace.endpoint = f"{request.method} {getattr(route, 'path', request.url.path)}"
+        HTTP_IN_FLIGHT.dec()
+        finish_request(trace, status, log=REQUEST_LOG)
     
-    final_input = "\n\n".join(str(item) for item in combined_input)
-    prompt = QA_PROMPT_TEMPLATE.format(input_document=final_input)
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish(500)
+        raise
+    finally:
+        end_trace(token)
+    
+    if not hasattr(response, "body_iterator"):
+        finish(response.status_code)
+        return response
+    
+    # Bodies are sent after call_next returns (SSE and NDJSON stream for a long time), so time to the last chunk
+    body_iterator = response.body_iterator
+    
+    async def traced_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            finish(response.status_code)
+    
+    response.body_iterator = traced_body()
+    return response
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text-format metrics: stage timings, token counts, request and Bedrock gauges"""
+    # Off the event loop: collectors and, with several workers, the shared metrics read SQLite
+    return PlainTextResponse(await run_in_threadpool(REGISTRY.render), media_type="text/plain; version=0.0.4")
+
+@app.post("/chat")
+async def chat(message: dict):
+    prompt = message.get("prompt", "").strip()
+    
+    if not prompt:
+        return {"error": "Prompt cannot be empty"}
+    invalid = await invalid_model_response(message)
+    if invalid is not None:
+        return invalid
     
     body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4000,
+        "max_tokens": 1000,
         "messages": [{"role": "user", "content": prompt}]
     }
     
-    response = bedrock.invoke_model(
-        modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-        body=json.dumps(body)
-    )
+    try:
+        route = await route_request(message, estimate_tokens(prompt), body["max_tokens"])
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    try:
+        result, _ = await invoke_routed(body, route["models"])
+    except BedrockOverloadedError as e:
+        return overloaded_response(e)
+    
+    return {"response": result['content'][0]['text']}
+
+async def run_test_plan(request, source, use_cache=True):
+    """Generate a test plan for a request body; shared by the HTTP endpoints and batch runs.
+
+    `source` is recorded with the plan in the history store (see record_history). Returns (content, cache_status). Invalid requests come back as {"error": ...} content
+    and BedrockOverloadedError propagates to the caller.
+    """
+    try:
+        dedupe_mode, dedupe_threshold = read_dedupe_params(request)
+    except ValueError as e:
+        return {"error": str(e)}, None
+    final_input, compaction = await prepare_input(request)
+    if final_input is None:
+        return {"error": "At least one input (texts, documents, or feature_document) is required"}, None
+    
+    counts = {"executed": 0, "shared": 0}
+    token = _generation_counts.set(counts)
+    try:
+        content, cache_status = await generate_plan_content(request, final_input, use_cache)
+    finally:
+        _generation_counts.reset(token)
+    if compaction is not None and "error" not in content:
+        content["compaction"] = compaction
+    # Cached plans are stored as generated, so dedupe settings never change cache keys
+    if dedupe_mode and "error" not in content:
+        content = await dedupe_content(content, dedupe_mode, dedupe_threshold)
+    # A request that only joined others' generations leaves recording the plan to them
+    if counts["executed"] or not counts["shared"]:
+        content = await record_history(content, final_input, cache_status, source)
+    if cache_status:
+        annotate(cache=cache_status)
+    return content, cache_status
+
+async def generate_plan_content(request, final_input, use_cache):
+    try:
+        chunk_tokens = read_int_param(request, "chunk_tokens", DEFAULT_CHUNK_TOKENS, minimum=500)
+        parallelism = read_int_param(request, "parallelism", DEFAULT_CHUNK_PARALLELISM)
+    except ValueError as e:
+        return {"error": str(e)}, None
+    
+    if request.get("fan_out") and request.get("document_id") is not None:
+        return {"error": "document_id can't be combined with fan_out"}, None
+    
+    if request.get("fan_out"):
+        try:
+            test_type_keys = resolve_test_types(request.get("test_types"))
+        except ValueError as e:
+            return {"error": str(e)}, None
+        if not use_cache:
+            plan_cache.record_bypass()
+        try:
+            resolve_slo(request.get("slo"))
+        except ValueError as e:
+            return {"error": str(e)}, None
+        plan, all_cached = await generate_fan_out_plan(final_input, test_type_keys, use_cache, request)
+        cache_status = "BYPASS" if not use_cache else "HIT" if all_cached else "MISS"
+        return {"test_plan": json.dumps(plan), "test_types": test_type_keys}, cache_status
+    
+    input_tokens = estimate_tokens(final_input)
+    chunks = [final_input]
+    if input_tokens > chunk_tokens:
+        chunks = chunk_text(final_input, chunk_tokens)
     
-    result = json.loads(response['body'].read())
-    return {"test_plan": result['content'][0]['text']}
+    try:
+        # Each chunk is its own call, so chunked inputs are routed by chunk size
+        route = await route_request(request, min(input_tokens, chunk_tokens), TEST_PLAN_MAX_TOKENS)
+    except ValueError as e:
+        return {"error": str(e)}, None
+    models = route["models"]
+    
+    if request.get("document_id") is not None:
+        content, regenerated = await generate_incremental_plan(
+            str(request["document_id"]), final_input, chunk_tokens, parallelism, models, use_cache
+        )
+        return content, "BYPASS" if not use_cache else "MISS" if regenerated else "HIT"
+    
+    compact = bool(request.get("compact_output"))
+    prompt_version = COMPACT_PROMPT_VERSION if compact else QA_PROMPT.version
+    if len(chunks) > 1:
+        cache_key = make_cache_key(final_input, prompt_version, models[0], TEST_PLAN_MAX_TOKENS, chunk_tokens=chunk_tokens)
+    else:
+        cache_key = make_cache_key(final_input, prompt_version, models[0], TEST_PLAN_MAX_TOKENS)
+    cached, cache_status = await lookup_cached_plan(cache_key, use_cache)
+    if cached is not None:
+        return {"test_plan": cached}, cache_status
+    
+    if len(chunks) > 1:
+        async def generate():
+            merged_plan, complete = await generate_chunked_plan(chunks, parallelism, models, compact)
+            text = json.dumps(merged_plan)
+            await store_plan(cache_key, text, complete)
+            content = {"test_plan": text, "chunks": len(chunks), "model": models[0]}
+            if not complete:
+                content["truncated"] = True
+            return content
+    elif compact:
+        async def generate():
+            content, complete = await generate_compact_content(final_input, models)
+            await store_plan(cache_key, content["test_plan"], complete)
+            return content
+    else:
+        async def generate():
+            text, stop_reason, continuations, model_id = await invoke_with_continuation(build_test_plan_body(final_input), models)
+            content, complete = plan_content(text, stop_reason, continuations)
+            content["model"] = model_id
+            await store_plan(cache_key, content["test_plan"], complete)
+            return content
+    
+    # Coalesced callers share the result, so each gets its own copy to annotate
+    return dict(await generate_once(cache_key, generate)), cache_status
+
+def attach_usage(content):
+    """Add the Bedrock tokens this request used, prompt cache reads and writes included.
+
+    Left out when no call was made: cache hits, and requests that joined another's generation.
+    """
+    trace = current_trace()
+    if trace is not None and trace.models:
+        content["usage"] = trace.usage()
+    return content
+
+@app.post("/test-plan")
+async def generate_test_plan(request: dict, raw_request: Request):
+    invalid = await invalid_model_response(request)
+    if invalid is not None:
+        return invalid
+    try:
+        content, cache_status = await run_test_plan(request, "POST /test-plan", use_cache=not cache_bypassed(request, raw_request))
+    except BedrockOverloadedError as e:
+        return overloaded_response(e)
+    
+    if "error" in content:
+        return content
+    return JSONResponse(content=attach_usage(content), headers={"X-Cache": cache_status})
+
+async def extract_upload(upload):
+    """Parse one uploaded file from its disk-spooled temp file, page by page"""
+    mime_type = guess_mime_type(upload.filename, upload.content_type)
+    started = time.perf_counter()
+    try:
+        async with extraction_slots:
+            text, parts = await run_in_threadpool(extract_file, upload.file, mime_type)
+    finally:
+        await upload.close()
+    seconds = time.perf_counter() - started
+    observe_stage("extraction", seconds)
+    info = {
+        "name": upload.filename,
+        "type": mime_type,
+        "parts": parts,
+        "characters": len(text),
+        "seconds": round(seconds, 3),
+    }
+    return text, info
+
+@app.post("/test-plan/upload")
+async def upload_test_plan(
+    raw_request: Request,
+    files: List[UploadFile] = File(...),
+    feature_document: str = Form(""),
+    options: str = Form("{}")
+):
+    """Generate a test plan from uploaded PDF/DOCX/TXT files.
+
+    `options` is a JSON object with any other /test-plan parameters (fan_out, chunk_tokens, ...).
+    """
+    try:
+        request = json.loads(options)
+    except json.JSONDecodeError:
+        request = None
+    if not isinstance(request, dict):
+        return JSONResponse(status_code=400, content={"error": "options must be a JSON object"})
+    invalid = await invalid_model_response(request)
+    if invalid is not None:
+        return invalid
+    
+    try:
+        extracted = await asyncio.gather(*(extract_upload(upload) for upload in files))
+    except UnsupportedFormatError:
+        return JSONResponse(status_code=415, content={"error": "Unsupported file format, upload PDF, DOCX or TXT files"})
+    except Exception as e:
+        return JSONResponse(status_code=422, content={"error": f"Error reading file: {str(e)}"})
+    
+    request["feature_document"] = feature_document
+    request["documents"] = [text for text, _ in extracted]
+    
+    try:
+        content, cache_status = await run_test_plan(request, "POST /test-plan/upload", use_cache=not cache_bypassed(request, raw_request))
+    except BedrockOverloadedError as e:
+        return overloaded_response(e)
+    
+    if "error" in content:
+        return content
+    content["files"] = [info for _, info in extracted]
+    return JSONResponse(content=attach_usage(content), headers={"X-Cache": cache_status})
+
+@app.post("/test-plan/batch")
+async def batch_test_plans(
+    raw_request: Request,
+    concurrency: int = Query(4, ge=1, le=64),
+    retries: int = Query(2, ge=0, le=10)
+):
+    """Generate plans for an NDJSON body of requests, streaming NDJSON results in completion order"""
+    body = (await raw_request.body()).decode("utf-8")
+    try:
+        items = parse_jsonl(body.splitlines())
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    use_cache = not cache_bypassed({}, raw_request)
+    
+    async def handler(request):
+        content, _ = await run_test_plan(request, "POST /test-plan/batch", use_cache=use_cache)
+        return content
+    
+    async def results():
+        completed = []
+        started = time.perf_counter()
+        async for result in run_batch(items, handler, concurrency, retries):
+            completed.append(result)
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"summary": summarize(completed, time.perf_counter() - started)}) + "\n"
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/test-plan/jobs", status_code=202)
+async def submit_test_plan_job(request: dict, raw_request: Request):
+    """Queue a /test-plan request as a background job; poll GET /test-plan/jobs/{id} for the plan"""
+    if combine_inputs(request) is None:
+        return JSONResponse(status_code=400, content={"error": "At least one input (texts, documents, or feature_document) is required"})
+    invalid = await invalid_model_response(request)
+    if invalid is not None:
+        return invalid
+    # Jobs run after this request ends, so the cache header is folded into the stored body
+    request["no_cache"] = cache_bypassed(request, raw_request)
+    job_id = await jobs.submit(request)
+    return {"id": job_id, "status": "queued", "url": f"/test-plan/jobs/{job_id}"}
+
+@app.get("/test-plan/jobs/{job_id}")
+async def get_test_plan_job(job_id: str):
+    """Job status, partial results (`progress`) while running and the plan (`result`) once done"""
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job
+
+@app.post("/test-plan/jobs/{job_id}/cancel")
+async def cancel_test_plan_job(job_id: str):
+    job = await jobs.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job
+
+@app.post("/test-plan/stream")
+async def stream_test_plan(request: dict, raw_request: Request):
+    """Stream a test plan as Server-Sent Events, one event per completed test type/case"""
+    invalid = await invalid_model_response(request)
+    if invalid is not None:
+        return invalid
+    final_input, compaction = await prepare_input(request)
+    if final_input is None:
+        return {"error": "At least one input (texts, documents, or feature_document) is required"}
+    
+    try:
+        route = await route_request(request, estimate_tokens(final_input), TEST_PLAN_MAX_TOKENS)
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    started = time.perf_counter()
+    cache_key = make_cache_key(final_input, QA_PROMPT.version, route["models"][0], TEST_PLAN_MAX_TOKENS)
+    cached, cache_status = await lookup_cached_plan(cache_key, use_cache=not cache_bypassed(request, raw_request))
+    annotate(cache=cache_status)
+    headers = {"Cache-Control": "no-cache", "X-Cache": cache_status}
+    if cached is not None:
+        async def replay():
+            parser = PlanStreamParser()
+            for event, payload in parser.feed(cached):
+                yield sse_event(event, payload)
+            elapsed = round(time.perf_counter() - started, 3)
+            metrics = {"time_to_first_token": elapsed, "time_to_first_test_case": elapsed, "total_time": elapsed}
+            yield sse_event("done", {"test_plan": cached, "stop_reason": None, "metrics": metrics, "cached": True, "compaction": compaction})
+        
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=headers)
+    
+    body = build_test_plan_body(final_input)
+    
+    try:
+        stream, model_id = await open_routed_stream(body, route["models"])
+    except BedrockOverloadedError as e:
+        return overloaded_response(e)
+    
+    async def events():
+        plan_stream = PlanStream(body, route["models"], started)
+        plan_stream.begin(model_id)
+        try:
+            async for event, payload in stream_with_continuation(plan_stream, stream):
+                yield sse_event(event, payload)
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+            return
+        
+        timings = plan_stream.finish(model_router)
+        logger.info("test-plan stream finished: %s", json.dumps(timings))
+        content, complete = plan_content(plan_stream.text, plan_stream.stop_reason, plan_stream.continuations)
+        content["model"] = plan_stream.model_id
+        await store_plan(cache_key, content["test_plan"], complete)
+        content = await record_history(content, final_input, cache_status, "POST /test-plan/stream")
+        yield sse_event("done", {
+            **content, "stop_reason": plan_stream.stop_reason, "metrics": timings, "usage": plan_stream.usage,
+            "cached": False, "compaction": compaction
+        })
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**await run_in_threadpool(plan_cache.stats), "coalescing": generations.stats()}
+
+@app.get("/history/search")
+async def search_history(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=200),
+    test_type: str = Query(None),
+    model: str = Query(None)
+):
+    """Test cases from stored plans whose name, objective or steps match every word of `q`"""
+    started = time.perf_counter()
+    results = await run_in_threadpool(plan_history.search, q, limit, test_type, model)
+    return {"query": q, "results": results, "seconds": round(time.perf_counter() - started, 4)}
+
+@app.get("/history")
+async def list_history(limit: int = Query(20, ge=1, le=200), input_hash: str = Query(None)):
+    """The latest stored plans' metadata, optionally only those generated from one input"""
+    def read():
+        return {"plans": plan_history.recent(limit, input_hash), **plan_history.stats()}
+    
+    return await run_in_threadpool(read)
+
+@app.get("/history/{plan_id}")
+async def get_history_plan(plan_id: int):
+    plan = await run_in_threadpool(plan_history.get, plan_id)
+    if plan is None:
+        return JSONResponse(status_code=404, content={"error": "Plan not found"})
+    return plan
+
+@app.get("/models")
+async def model_stats():
+    """Models available for routing and the latency measured for each"""
+    available = await run_in_threadpool(model_router.catalog.available)
+    return {"available": available, "stats": model_router.stats()}
 
 if __name__ == "__main__":
+    if WORKERS > 1:
+        # Spawned workers re-run the launching script, so it must not be the module defining the app
+        raise SystemExit("TESTBUDDY_WORKERS is above 1: start the API with `python serve.py`")
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,487 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from storage import connect
+
+logger = logging.getLogger("testbuddy")
+request_logger = logging.getLogger("testbuddy.requests")
+
+# Upper bounds in seconds, from fast stages (parsing) up to long generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text exposition format.
+
+    When `shared` is set (see SharedMetrics) the rendered values are those of every worker
+    process together rather than this process's own.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self.shared = None
+
+    @property
+    def metrics(self):
+        return list(self._metrics)
+
+    def register(self, metric):
+        """Add a metric; a second metric with the same name would render as a duplicate family"""
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics.append(metric)
+
+    def add_collector(self, collect):
+        """Register a callable run before each render, e.g. to refresh gauges from live state"""
+        if collect not in self._collectors:
+            self._collectors.append(collect)
+
+    def collect(self):
+        for collect in self._collectors:
+            collect()
+
+    def render(self):
+        self.collect()
+        shared = self.shared
+        aggregated = shared.exchange() if shared is not None else None
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            samples = aggregated.get(metric.name, []) if aggregated is not None else metric.samples()
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        if not self.labelnames and self.kind != "histogram":
+            self._values[()] = 0
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _pairs(self, key):
+        return list(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._pairs(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down.
+
+    `aggregate` says how values from several worker processes combine: "sum" for
+    per-process quantities (requests in flight), "latest" for ones every process reports
+    from the same shared source (job counts read from the job store).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), aggregate="sum", registry=REGISTRY):
+        if aggregate not in ("sum", "latest"):
+            raise ValueError(f"unknown gauge aggregate {aggregate!r}")
+        super().__init__(name, documentation, labelnames, registry)
+        self.aggregate = aggregate
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._pairs(key), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                pairs = self._pairs(key)
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", pairs + [("le", _format_value(bound))], count))
+                samples.append((f"{self.name}_sum", pairs, total))
+                samples.append((f"{self.name}_count", pairs, counts[-1]))
+        return samples
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to someone else
+        return True
+    return True
+
+
+class SharedMetrics:
+    """Aggregates a registry's metrics over worker processes through a SQLite file.
+
+    Each process publishes a snapshot of its own samples every `interval` seconds and
+    whenever it renders, then renders the aggregate of every process's latest snapshot.
+    Counters and histograms are summed over every process that ever published, so totals
+    survive a worker restart; the snapshots of exited processes are folded into one
+    `retired` row on start. Gauges only combine processes that published in the last
+    three intervals, by their `aggregate`.
+    """
+
+    RETIRED = "retired"
+
+    def __init__(self, path, registry=REGISTRY, interval=5.0):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self.process_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._db = connect(path)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS metric_processes (
+                id TEXT PRIMARY KEY, pid INTEGER NOT NULL, published_at REAL NOT NULL,
+                retired INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS metric_samples (
+                process TEXT NOT NULL, metric TEXT NOT NULL, kind TEXT NOT NULL, sample TEXT NOT NULL,
+                labels TEXT NOT NULL, position INTEGER NOT NULL, value,
+                PRIMARY KEY (process, metric, sample, labels)
+            );
+            """
+        )
+        self._db.commit()
+
+    def publish(self, retire=False):
+        """Replace this process's snapshot with its current samples"""
+        rows = []
+        for metric in self.registry.metrics:
+            for position, (sample, labels, value) in enumerate(metric.samples()):
+                rows.append((self.process_id, metric.name, metric.kind, sample, json.dumps(labels), position, value))
+        # The connection's context manager commits, or rolls back on an error
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("DELETE FROM metric_samples WHERE process = ?", (self.process_id,))
+            self._db.executemany(
+                "INSERT INTO metric_samples (process, metric, kind, sample, labels, position, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO metric_processes (id, pid, published_at, retired) VALUES (?, ?, ?, ?)",
+                (self.process_id, os.getpid(), time.time(), int(retire))
+            )
+
+    def _fold_exited(self):
+        """Merge the counters and histograms of processes that have exited into the retired row"""
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            exited = [
+                process_id for process_id, pid, retired in self._db.execute(
+                    "SELECT id, pid, retired FROM metric_processes WHERE id != ?", (self.RETIRED,)
+                ).fetchall()
+                if retired or not _pid_alive(pid)
+            ]
+            if exited:
+                marks = ", ".join("?" * len(exited))
+                self._db.execute(
+                    "INSERT INTO metric_samples (process, metric, kind, sample, labels, position, value) "
+                    "SELECT ?, metric, kind, sample, labels, MIN(position), SUM(value) FROM metric_samples "
+                    f"WHERE kind != 'gauge' AND process IN ({marks}) GROUP BY metric, kind, sample, labels "
+                    "ON CONFLICT (process, metric, sample, labels) DO UPDATE SET value = value + excluded.value",
+                    (self.RETIRED, *exited)
+                )
+                self._db.execute(f"DELETE FROM metric_samples WHERE process IN ({marks})", exited)
+                self._db.execute(f"DELETE FROM metric_processes WHERE id IN ({marks})", exited)
+                self._db.execute(
+                    "INSERT OR IGNORE INTO metric_processes (id, pid, published_at, retired) VALUES (?, 0, 0, 1)",
+                    (self.RETIRED,)
+                )
+        return len(exited)
+
+    def aggregate(self):
+        """Samples of every process combined, as {metric name: [(sample, label pairs, value)]}"""
+        gauges = {metric.name: metric.aggregate for metric in self.registry.metrics if metric.kind == "gauge"}
+        live_after = time.time() - 3 * self.interval
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.metric, s.sample, s.labels, s.value, p.published_at, p.retired "
+                "FROM metric_samples s JOIN metric_processes p ON p.id = s.process ORDER BY s.position, p.published_at"
+            ).fetchall()
+        values = {}
+        latest = {}
+        for metric, sample, labels, value, published_at, retired in rows:
+            aggregate = gauges.get(metric)
+            if aggregate is not None and (retired or published_at < live_after):
+                continue
+            series = values.setdefault(metric, {})
+            key = (sample, labels)
+            if aggregate == "latest":
+                if published_at >= latest.get((metric, key), 0):
+                    latest[(metric, key)] = published_at
+                    series[key] = value
+            else:
+                series[key] = series.get(key, 0) + value
+        samples = {}
+        for metric, series in values.items():
+            # Keep each series' buckets together, in the order a single process renders them
+            groups = {}
+            for (sample, labels), value in series.items():
+                pairs = [tuple(pair) for pair in json.loads(labels)]
+                group = tuple(pair for pair in pairs if pair[0] != "le")
+                groups.setdefault(group, []).append((sample, pairs, value))
+            samples[metric] = [sample for group in groups.values() for sample in group]
+        return samples
+
+    def exchange(self):
+        """Publish this process's snapshot, then return every process's aggregate"""
+        self.publish()
+        return self.aggregate()
+
+    def start(self):
+        """Fold exited processes, then publish in the background and render shared values"""
+        self._fold_exited()
+        self.publish()
+        self.registry.shared = self
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="testbuddy-metrics", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.registry.collect()
+                self.publish()
+            except Exception as e:
+                logger.warning("publishing shared metrics failed: %s", e)
+
+    def stop(self):
+        """Publish a final snapshot marked retired, so this process's gauges drop out at once"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.registry.shared = None
+        self.publish(retire=True)
+
+
+HTTP_REQUESTS = Counter("testbuddy_http_requests_total", "HTTP requests handled", ["endpoint", "status"])
+HTTP_REQUEST_SECONDS = Histogram("testbuddy_http_request_seconds", "HTTP request duration, including streamed bodies", ["endpoint"])
+HTTP_IN_FLIGHT = Gauge("testbuddy_http_requests_in_flight", "HTTP requests currently being handled")
+STAGE_SECONDS = Histogram("testbuddy_stage_seconds", "Time spent in each request stage", ["stage"])
+BEDROCK_CALLS = Counter("testbuddy_bedrock_calls_total", "Bedrock calls by model and outcome", ["model", "outcome"])
+BEDROCK_TOKENS = Counter(
+    "testbuddy_bedrock_tokens_total",
+    "Tokens reported by Bedrock responses; direction is input, output, cache_read or cache_write",
+    ["model", "direction"],
+)
+
+
+class RequestTrace:
+    """Stage timings, token counts and other details collected while handling one request.
+
+    Fan-out and chunked generations update one trace from several threads, hence the lock.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.models = []
+        self.fields = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_call(self, model_id, input_tokens, output_tokens, cache_read_tokens=0, cache_write_tokens=0):
+        with self._lock:
+            self.input_tokens += input_tokens or 0
+            self.output_tokens += output_tokens or 0
+            self.cache_read_tokens += cache_read_tokens or 0
+            self.cache_write_tokens += cache_write_tokens or 0
+            if model_id not in self.models:
+                self.models.append(model_id)
+
+    def usage(self):
+        """Token counts of the calls made so far, named like Bedrock's `usage` fields"""
+        with self._lock:
+            return {
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cache_read_input_tokens": self.cache_read_tokens,
+                "cache_creation_input_tokens": self.cache_write_tokens,
+            }
+
+    def to_dict(self, status, duration):
+        return {
+            "endpoint": self.endpoint,
+            "status": status,
+            "duration": round(duration, 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "models": self.models,
+            **self.fields,
+        }
+
+
+_current_trace = contextvars.ContextVar("testbuddy_trace", default=None)
+
+
+def start_trace(endpoint):
+    """Start collecting a trace for the current context; returns (trace, reset token)"""
+    trace = RequestTrace(endpoint)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def record_bedrock_call(model_id, outcome, input_tokens=0, output_tokens=0, cache_read_tokens=0, cache_write_tokens=0):
+    """Count a call and its tokens.
+
+    With prompt caching, `input_tokens` leaves out the prefix read from the cache
+    (`cache_read_tokens`) or written to it (`cache_write_tokens`).
+    """
+    BEDROCK_CALLS.inc(model=model_id, outcome=outcome)
+    for direction, tokens in (
+        ("input", input_tokens), ("output", output_tokens),
+        ("cache_read", cache_read_tokens), ("cache_write", cache_write_tokens),
+    ):
+        if tokens:
+            BEDROCK_TOKENS.inc(tokens, model=model_id, direction=direction)
+    trace = _current_trace.get()
+    if trace is not None and outcome == "ok":
+        trace.add_call(model_id, input_tokens, output_tokens, cache_read_tokens, cache_write_tokens)
+
+
+def annotate(**fields):
+    """Attach extra fields (cache status, chunk count, ...) to the current request's log entry"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.fields.update(fields)
+
+
+def enable_request_log():
+    """Send per-request JSON lines to stderr, one bare JSON object per line"""
+    if not request_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        request_logger.addHandler(handler)
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+
+def log_trace(trace, status):
+    """Log a finished trace as one structured JSON line"""
+    request_logger.info(json.dumps(trace.to_dict(status, time.perf_counter() - trace.started)))
+
+
+def finish_request(trace, status, log=False):
+    """Record a finished request's metrics and optionally log it as one JSON line"""
+    duration = time.perf_counter() - trace.started
+    HTTP_REQUESTS.inc(endpoint=trace.endpoint, status=status)
+    HTTP_REQUEST_SECONDS.observe(duration, endpoint=trace.endpoint)
+    if log:
+        log_trace(trace, status)
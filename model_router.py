@@ -0,0 +1,320 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Models the router knows how to price and rank. `quality` orders capability (higher is
+# better), costs are USD per million input/output tokens and `seconds_per_token` is the
+# output speed assumed until real calls have been measured.
+MODEL_PROFILES = {
+    "anthropic.claude-3-haiku-20240307-v1:0": {
+        "quality": 1, "input_cost": 0.25, "output_cost": 1.25, "seconds_per_token": 0.008, "context_tokens": 200_000,
+    },
+    "anthropic.claude-3-5-haiku-20241022-v1:0": {
+        "quality": 2, "input_cost": 0.8, "output_cost": 4.0, "seconds_per_token": 0.01, "context_tokens": 200_000,
+    },
+    "anthropic.claude-3-sonnet-20240229-v1:0": {
+        "quality": 2, "input_cost": 3.0, "output_cost": 15.0, "seconds_per_token": 0.016, "context_tokens": 200_000,
+    },
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": {
+        "quality": 3, "input_cost": 3.0, "output_cost": 15.0, "seconds_per_token": 0.016, "context_tokens": 200_000,
+    },
+    "anthropic.claude-3-5-sonnet-20241022-v2:0": {
+        "quality": 3, "input_cost": 3.0, "output_cost": 15.0, "seconds_per_token": 0.016, "context_tokens": 200_000,
+    },
+    "anthropic.claude-3-opus-20240229-v1:0": {
+        "quality": 3, "input_cost": 15.0, "output_cost": 75.0, "seconds_per_token": 0.035, "context_tokens": 200_000,
+    },
+    "anthropic.claude-3-7-sonnet-20250219-v1:0": {
+        "quality": 3, "input_cost": 3.0, "output_cost": 15.0, "seconds_per_token": 0.014, "context_tokens": 200_000,
+    },
+    "anthropic.claude-haiku-4-5-20251001-v1:0": {
+        "quality": 3, "input_cost": 1.0, "output_cost": 5.0, "seconds_per_token": 0.007, "context_tokens": 200_000,
+    },
+    "anthropic.claude-sonnet-4-20250514-v1:0": {
+        "quality": 4, "input_cost": 3.0, "output_cost": 15.0, "seconds_per_token": 0.014, "context_tokens": 200_000,
+    },
+    "anthropic.claude-sonnet-4-5-20250929-v1:0": {
+        "quality": 4, "input_cost": 3.0, "output_cost": 15.0, "seconds_per_token": 0.014, "context_tokens": 200_000,
+    },
+    "anthropic.claude-opus-4-20250514-v1:0": {
+        "quality": 4, "input_cost": 15.0, "output_cost": 75.0, "seconds_per_token": 0.03, "context_tokens": 200_000,
+    },
+    "anthropic.claude-opus-4-1-20250805-v1:0": {
+        "quality": 4, "input_cost": 15.0, "output_cost": 75.0, "seconds_per_token": 0.03, "context_tokens": 200_000,
+    },
+}
+# Assumed for discovered models without a profile: the lowest quality and the highest
+# price and latency, so they are only chosen when no profiled model fits and otherwise
+# serve as the last fallbacks
+UNKNOWN_MODEL_PROFILE = {
+    "quality": 1, "input_cost": 15.0, "output_cost": 75.0, "seconds_per_token": 0.035, "context_tokens": 100_000,
+}
+
+# Model families Bedrock supports prompt caching on, with the fewest prompt tokens a cached
+# prefix needs on each; shorter prefixes are processed as if they weren't marked. Matched
+# anywhere in the model ID so cross-region inference profiles ("us.anthropic...") match too
+PROMPT_CACHE_FAMILIES = {
+    "claude-3-5-haiku": 2048,
+    "claude-3-7-sonnet": 1024,
+    "claude-sonnet-4": 1024,
+    "claude-opus-4": 1024,
+    "claude-haiku-4": 4096,
+}
+
+# Named SLOs a request can ask for. A min_quality of None means "whatever the input needs".
+SLO_PRESETS = {
+    "fast": {"max_latency": 45.0, "max_cost": None, "min_quality": 1, "prefer": "latency"},
+    "balanced": {"max_latency": 90.0, "max_cost": None, "min_quality": None, "prefer": "cost"},
+    "quality": {"max_latency": None, "max_cost": None, "min_quality": 3, "prefer": "quality"},
+}
+# Ranks the fallbacks of requests that send no slo; their primary is the router's default model
+DEFAULT_SLO = "balanced"
+
+# Test types that need more judgement than the smallest model reliably gives
+DEMANDING_TEST_TYPES = {"security", "performance", "e2e", "contract", "uat"}
+# Inputs up to this many tokens with only simple test types can go to the smallest model
+SMALL_INPUT_TOKENS = 3000
+# Inputs above this many tokens need the strongest model to keep the plan coherent
+LARGE_INPUT_TOKENS = 50_000
+
+# Error codes (and timeout exception names) that move a request on to the next model
+FALLBACK_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+}
+# RateLimitExceeded is the local limiter refusing a long wait for one model (bedrock_client.py)
+FALLBACK_EXCEPTION_NAMES = {"ReadTimeoutError", "ConnectTimeoutError", "EndpointConnectionError", "RateLimitExceeded"}
+
+# Models tried per request: the primary plus this many fallbacks at most
+MAX_FALLBACKS = 2
+
+
+def is_fallback_error(error):
+    """True for throttling and timeout errors worth retrying on a different model"""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code") in FALLBACK_ERROR_CODES:
+        return True
+    return type(error).__name__ in FALLBACK_EXCEPTION_NAMES
+
+
+def prompt_cache_min_tokens(model_id):
+    """Fewest prompt tokens `model_id` caches a prefix of, or None if it has no prompt caching"""
+    for family, min_tokens in PROMPT_CACHE_FAMILIES.items():
+        if family in model_id:
+            return min_tokens
+    return None
+
+
+def supports_prompt_cache(model_id):
+    """True if Bedrock accepts cache_control markers in requests to `model_id`"""
+    return prompt_cache_min_tokens(model_id) is not None
+
+
+def model_profile(model_id):
+    """The MODEL_PROFILES entry for a model ID or a cross-region inference profile of it
+    ("us.anthropic..."), else UNKNOWN_MODEL_PROFILE
+    """
+    base = model_id[model_id.find("anthropic."):] if "anthropic." in model_id else model_id
+    return MODEL_PROFILES.get(base, UNKNOWN_MODEL_PROFILE)
+
+
+def resolve_slo(slo=None):
+    """Turn a preset name or a dict of overrides into a full SLO dict; raises ValueError if invalid"""
+    if slo is None:
+        return dict(SLO_PRESETS[DEFAULT_SLO])
+    if isinstance(slo, str):
+        if slo not in SLO_PRESETS:
+            raise ValueError(f"Unknown slo: {slo}. Choose from: {', '.join(SLO_PRESETS)}")
+        return dict(SLO_PRESETS[slo])
+    if not isinstance(slo, dict):
+        raise ValueError("slo must be a preset name or an object")
+    resolved = resolve_slo(slo.get("preset"))
+    for name in ("max_latency", "max_cost", "min_quality"):
+        if slo.get(name) is not None:
+            try:
+                resolved[name] = float(slo[name])
+            except (TypeError, ValueError):
+                raise ValueError(f"slo.{name} must be a number")
+    if slo.get("prefer") is not None:
+        if slo["prefer"] not in ("latency", "cost", "quality"):
+            raise ValueError("slo.prefer must be latency, cost or quality")
+        resolved["prefer"] = slo["prefer"]
+    return resolved
+
+
+def required_quality(input_tokens, test_type_keys=None):
+    """Lowest model quality tier that handles an input of this size and these test types"""
+    if input_tokens > LARGE_INPUT_TOKENS:
+        return 3
+    if not test_type_keys:
+        # Full plans cover every test type, including the demanding ones
+        return 2
+    if input_tokens <= SMALL_INPUT_TOKENS and not DEMANDING_TEST_TYPES.intersection(test_type_keys):
+        return 1
+    return 2
+
+
+class ModelCatalog:
+    """Model IDs discovered from Bedrock, refreshed at most every `ttl` seconds.
+
+    `discover` returns the available model IDs (see `list_models.list_claude_models`).
+    If discovery fails the last good list is kept; with none, `fallback` is used.
+    """
+
+    def __init__(self, discover, fallback, ttl=3600.0):
+        self._discover = discover
+        self._fallback = list(fallback)
+        self.ttl = ttl
+        self._models = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        with self._lock:
+            if self._models is None or time.monotonic() - self._fetched_at > self.ttl:
+                try:
+                    self._models = list(self._discover())
+                except Exception as e:
+                    logger.warning("model discovery failed, using %s: %s", "cached list" if self._models else "fallback", e)
+                    if self._models is None:
+                        self._models = list(self._fallback)
+                self._fetched_at = time.monotonic()
+            return list(self._models)
+
+
+class ModelRouter:
+    """Picks a model per request and learns per-model latency from completed calls.
+
+    Latency is tracked as an exponentially weighted moving average of seconds per output
+    token, seeded from MODEL_PROFILES. A model that was throttled or timed out is moved
+    to the back of the fallback order for `cooldown` seconds.
+    """
+
+    def __init__(self, catalog, default_model, alpha=0.3, cooldown=30.0):
+        self.catalog = catalog
+        self.default_model = default_model
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _model_stats(self, model_id):
+        stats = self._stats.get(model_id)
+        if stats is None:
+            stats = {
+                "seconds_per_token": model_profile(model_id)["seconds_per_token"],
+                "calls": 0,
+                "failures": 0,
+                "unavailable_until": 0.0,
+            }
+            self._stats[model_id] = stats
+        return stats
+
+    def record_success(self, model_id, seconds, output_tokens):
+        with self._lock:
+            stats = self._model_stats(model_id)
+            stats["calls"] += 1
+            if output_tokens:
+                sample = seconds / output_tokens
+                stats["seconds_per_token"] += self.alpha * (sample - stats["seconds_per_token"])
+
+    def record_failure(self, model_id):
+        with self._lock:
+            stats = self._model_stats(model_id)
+            stats["failures"] += 1
+            stats["unavailable_until"] = time.monotonic() + self.cooldown
+
+    def estimate(self, model_id, input_tokens, max_tokens):
+        """(estimated worst-case seconds, estimated USD) for one call"""
+        profile = model_profile(model_id)
+        with self._lock:
+            seconds = self._model_stats(model_id)["seconds_per_token"] * max_tokens
+        cost = (input_tokens * profile["input_cost"] + max_tokens * profile["output_cost"]) / 1_000_000
+        return seconds, cost
+
+    def route(self, input_tokens, max_tokens, test_type_keys=None, slo=None, model=None):
+        """Choose the models to try for a request, best first.
+
+        Returns a dict with "models" (primary then fallbacks), the primary's estimated
+        latency and cost, and the quality tier that was required. `model` pins the
+        primary model. Without an `slo` the default model stays the primary, as it was
+        before routing, and the balanced ranking only orders its fallbacks. Raises
+        ValueError for an invalid `slo`.
+        """
+        routed = slo is not None
+        slo = resolve_slo(slo)
+        min_quality = slo["min_quality"] if slo["min_quality"] is not None else required_quality(input_tokens, test_type_keys)
+
+        candidates = []
+        for model_id in self.catalog.available():
+            profile = model_profile(model_id)
+            if profile["context_tokens"] < input_tokens + max_tokens:
+                continue
+            seconds, cost = self.estimate(model_id, input_tokens, max_tokens)
+            candidates.append((model_id, profile["quality"], seconds, cost))
+
+        def meets_slo(candidate):
+            _, quality, seconds, cost = candidate
+            return (
+                quality >= min_quality
+                and (slo["max_latency"] is None or seconds <= slo["max_latency"])
+                and (slo["max_cost"] is None or cost <= slo["max_cost"])
+            )
+
+        if slo["prefer"] == "quality":
+            rank = lambda c: (-c[1], c[2])
+        elif slo["prefer"] == "latency":
+            rank = lambda c: (c[2], c[3])
+        else:
+            rank = lambda c: (c[3], c[2])
+
+        eligible = sorted(filter(meets_slo, candidates), key=rank)
+        if not eligible:
+            # No model meets every target; the fastest adequate model comes closest
+            eligible = sorted((c for c in candidates if c[1] >= min_quality), key=lambda c: c[2])
+        # Remaining models serve as fallbacks, closest in quality first
+        primary_quality = eligible[0][1] if eligible else min_quality
+        others = sorted(
+            (c for c in candidates if c not in eligible),
+            key=lambda c: (abs(c[1] - primary_quality), c[2])
+        )
+        ordered = [c[0] for c in eligible + others]
+        if not routed:
+            ordered = [self.default_model] + [m for m in ordered if m != self.default_model]
+
+        now = time.monotonic()
+        with self._lock:
+            cooling = {m for m in ordered if self._model_stats(m)["unavailable_until"] > now}
+        ordered = [m for m in ordered if m not in cooling] + [m for m in ordered if m in cooling]
+
+        if model:
+            ordered = [model] + [m for m in ordered if m != model]
+        if not ordered:
+            ordered = [self.default_model]
+        models = ordered[:MAX_FALLBACKS + 1]
+
+        seconds, cost = self.estimate(models[0], input_tokens, max_tokens)
+        return {
+            "models": models,
+            "estimated_seconds": round(seconds, 2),
+            "estimated_cost": round(cost, 5),
+            "min_quality": min_quality,
+        }
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model_id: {
+                    "seconds_per_token": round(stats["seconds_per_token"], 5),
+                    "calls": stats["calls"],
+                    "failures": stats["failures"],
+                    "cooling_down": stats["unavailable_until"] > now,
+                }
+                for model_id, stats in self._stats.items()
+            }
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from storage import connect
+
+
+def normalize_input(final_input):
+    """Normalize input text so trivially different copies of a document share a cache key"""
+    text = unicodedata.normalize("NFC", final_input).replace("\r\n", "\n")
+    lines = [re.sub(r"[ \t]+", " ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def make_cache_key(final_input, prompt_version, model_id, max_tokens, **params):
+    """Content-addressed key for a generation request"""
+    payload = json.dumps({
+        "input": normalize_input(final_input),
+        "prompt_version": prompt_version,
+        "model_id": model_id,
+        "max_tokens": max_tokens,
+        "params": params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """Two-tier cache for generated test plans: an in-memory LRU in front of a SQLite file.
+
+    Disk entries expire after `ttl` seconds and the table is trimmed to `max_disk_entries`
+    by least-recent access. Values are the raw model response text.
+    """
+
+    def __init__(self, path, max_memory_entries=256, max_disk_entries=5000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plan_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS plan_cache_accessed ON plan_cache (accessed_at)")
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.counts["memory_hits"] += 1
+                return entry[0]
+
+            row = self._db.execute(
+                "SELECT value, created_at FROM plan_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self._memory.pop(key, None)
+                self.counts["misses"] += 1
+                return None
+
+            self._db.execute("UPDATE plan_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, row[0], row[1])
+            self.counts["disk_hits"] += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO plan_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._evict(now)
+            self._db.commit()
+            self.counts["stores"] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.counts["bypassed"] += 1
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM plan_cache WHERE created_at <= ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM plan_cache WHERE key IN ("
+            "SELECT key FROM plan_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def stats(self):
+        with self._lock:
+            disk_entries = self._db.execute("SELECT COUNT(*) FROM plan_cache").fetchone()[0]
+            hits = self.counts["memory_hits"] + self.counts["disk_hits"]
+            lookups = hits + self.counts["misses"]
+            return {
+                **self.counts,
+                "hits": hits,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
@@ -0,0 +1,175 @@
+import json
+
+# How many times a response cut off at max_tokens is continued before giving up
+MAX_CONTINUATIONS = 2
+
+
+class PlanStreamParser:
+    """Incrementally scans streamed model text and emits each test plan object once it is complete.
+
+    Feed text deltas with `feed()`; it returns a list of `(event, payload)` tuples:
+      - ("test_type", {"type", "description"}) when a test type's header has been generated
+      - ("test_case", {"test_type", "index", "test_case"}) when a technical test case closes
+      - ("uat_test_case", {"index", "test_case"}) when a UAT test case closes
+    `index` is 1-based within the enclosing test type (or the UAT list).
+    Text before the first "{" (prose, code fences) is ignored. `plan` holds every object
+    completed so far in the standard plan shape, so a truncated response still yields
+    its finished test cases.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.test_case_count = 0
+        self._type_case_count = 0
+        self._uat_case_count = 0
+        self._pos = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._stack = []
+        self.plan = {"test_types": [], "uat_test_cases": []}
+
+    def feed(self, delta):
+        self.text += delta
+        events = []
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    continue
+                self._pos += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = (self._string_start, self._pos + 1)
+                self._pos += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif ch == ":" and self._stack and self._stack[-1]["kind"] == "{":
+                self._on_key(self._stack[-1], events)
+            elif ch in "{[":
+                self._stack.append({"kind": ch, "start": self._pos, "key": self._child_key(), "pending_key": None})
+            elif ch in "}]":
+                if self._stack:
+                    frame = self._stack.pop()
+                    if ch == "}":
+                        self._on_object_closed(frame, events)
+                    if self._stack and self._stack[-1]["kind"] == "{":
+                        self._stack[-1]["pending_key"] = None
+            elif ch == "," and self._stack and self._stack[-1]["kind"] == "{":
+                self._stack[-1]["pending_key"] = None
+            self._pos += 1
+        return events
+
+    def _child_key(self):
+        if not self._stack:
+            return None
+        parent = self._stack[-1]
+        return parent["pending_key"] if parent["kind"] == "{" else parent["key"]
+
+    def _decode_last_string(self):
+        start, end = self._last_string
+        try:
+            return json.loads(self.text[start:end])
+        except ValueError:
+            return None
+
+    def _parent_array_key(self, depth_from_top=1):
+        if len(self._stack) < depth_from_top:
+            return None
+        frame = self._stack[-depth_from_top]
+        return frame["key"] if frame["kind"] == "[" else None
+
+    def _on_key(self, frame, events):
+        if self._last_string is None:
+            return
+        key = self._decode_last_string()
+        frame["pending_key"] = key
+        # A test type object reaching its "test_cases" key has its header fields complete
+        if key == "test_cases" and self._parent_array_key(2) == "test_types":
+            header_text = self.text[frame["start"]:self._last_string[0]].rstrip().rstrip(",") + "}"
+            try:
+                header = json.loads(header_text)
+            except ValueError:
+                header = {}
+            test_type = {"type": header.get("type", ""), "description": header.get("description", "")}
+            self.plan["test_types"].append({**test_type, "test_cases": []})
+            self._type_case_count = 0
+            events.append(("test_type", test_type))
+
+    def _on_object_closed(self, frame, events):
+        parent_key = self._parent_array_key()
+        if parent_key not in ("test_cases", "uat_test_cases"):
+            return
+        try:
+            test_case = json.loads(self.text[frame["start"]:self._pos + 1])
+        except ValueError:
+            return
+        self.test_case_count += 1
+        if parent_key == "uat_test_cases":
+            self._uat_case_count += 1
+            self.plan["uat_test_cases"].append(test_case)
+            events.append(("uat_test_case", {"index": self._uat_case_count, "test_case": test_case}))
+        else:
+            # A focused single-type response has test_cases without an enclosing test_types list
+            if not self.plan["test_types"]:
+                self.plan["test_types"].append({"type": "", "description": "", "test_cases": []})
+            self._type_case_count += 1
+            current_type = self.plan["test_types"][-1]
+            current_type["test_cases"].append(test_case)
+            events.append(("test_case", {"test_type": current_type["type"], "index": self._type_case_count, "test_case": test_case}))
+
+
+def recover_plan(text):
+    """Parse model output into a plan, tolerating surrounding prose, code fences and truncation.
+
+    Returns (plan, complete). `complete` is False when only the objects finished before the
+    output broke off could be recovered; `plan` is None when nothing usable was found.
+    """
+    try:
+        return json.loads(text), True
+    except json.JSONDecodeError:
+        pass
+
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1]), True
+        except json.JSONDecodeError:
+            pass
+
+    parser = PlanStreamParser()
+    parser.feed(text)
+    if parser.test_case_count == 0 and not parser.plan["test_types"]:
+        return None, False
+    return parser.plan, False
+
+
+def parse_plan_text(text):
+    """Parse model output into a plan dict (possibly partial), or None"""
+    plan, _ = recover_plan(text)
+    return plan if isinstance(plan, dict) else None
+
+
+def continuation_body(body, partial_text):
+    """Build a request that continues a response cut off at max_tokens.
+
+    The truncated output is sent back as a prefilled assistant turn, so the model only
+    generates the missing remainder instead of the whole plan again.
+    """
+    messages = list(body["messages"]) + [{"role": "assistant", "content": partial_text.rstrip()}]
+    return {**body, "messages": messages}
@@ -0,0 +1,84 @@
+from html import escape
+
+# Test cases shown per page inside a section
+PAGE_SIZE = 20
+
+
+class CompletionIndex:
+    """Completed test cases indexed by section, so per-section lookups don't scan every key"""
+
+    def __init__(self):
+        self._sections = {}
+
+    def set(self, section_key, index, completed):
+        completed_cases = self._sections.setdefault(section_key, set())
+        if completed:
+            completed_cases.add(index)
+        else:
+            completed_cases.discard(index)
+
+    def is_completed(self, section_key, index):
+        return index in self._sections.get(section_key, ())
+
+    def completed_count(self, section_key):
+        return len(self._sections.get(section_key, ()))
+
+    def has_completed(self, section_key):
+        return bool(self._sections.get(section_key))
+
+
+def is_uat_section(test_type):
+    return 'UAT' in test_type.get('type', '').upper()
+
+
+def page_count(test_type, page_size=PAGE_SIZE):
+    return max(1, -(-len(test_type.get('test_cases', [])) // page_size))
+
+
+def _list_html(title, items, bullet):
+    if not items:
+        return ""
+    rows = "".join(
+        f'<div class="test-list-item"><span class="test-bullet">{bullet}</span><span>{escape(str(item))}</span></div>'
+        for item in items
+    )
+    return f'<div class="test-section-title">{title}</div><div class="test-list">{rows}</div>'
+
+
+def render_test_case_html(index, test_case, card_class, completed=False):
+    """HTML for one test case card; kept on a single line so markdown treats it as one HTML block"""
+    status = ' <span class="test-bullet">✅ Completed</span>' if completed else ""
+    duplicate = test_case.get("duplicate_of")
+    duplicate_note = ""
+    if isinstance(duplicate, dict):
+        duplicate_note = (
+            f'<div class="objective-text"><strong>🧬 Similar to:</strong> '
+            f'{escape(str(duplicate.get("test_type", "")))}: {escape(str(duplicate.get("name", "")))}</div>'
+        )
+    return (
+        f'<div class="test-card {card_class}">'
+        f'<div class="test-header"><span class="test-title">Test Case {index}: {escape(str(test_case.get("name", "")))}</span>{status}</div>'
+        + duplicate_note
+        + f'<div class="objective-text"><strong>🎯 Objective:</strong> {escape(str(test_case.get("objective", "")))}</div>'
+        + _list_html("📋 Prerequisites", test_case.get("prerequisites"), "▶")
+        + _list_html("⚙️ Implementation Steps", test_case.get("implementation_steps"), "🔸")
+        + f'<div class="expected-result"><strong>✅ Expected Results:</strong> {escape(str(test_case.get("expected_results", "")))}</div>'
+        '</div>'
+    )
+
+
+def render_section_page_html(test_type, page=1, completion=None, page_size=PAGE_SIZE):
+    """HTML for one page of a section's test cases as a single block"""
+    section_key = test_type.get('type', '')
+    card_class = "uat-card" if is_uat_section(test_type) else "tech-card"
+    start = (page - 1) * page_size
+    cases = test_type.get('test_cases', [])[start:start + page_size]
+    return "".join(
+        render_test_case_html(
+            index,
+            test_case,
+            card_class,
+            completion.is_completed(section_key, index) if completion else False
+        )
+        for index, test_case in enumerate(cases, start + 1)
+    )
@@ -0,0 +1,228 @@
+import json
+import os
+import string
+
+from model_router import supports_prompt_cache
+
+# Set TESTBUDDY_PROMPT_CACHE=0 to send requests without prompt cache markers
+PROMPT_CACHE = os.environ.get("TESTBUDDY_PROMPT_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def _parse(text):
+    """(literal text, field name or None) pairs, with escaped braces already undone"""
+    parts = []
+    for literal, field, format_spec, conversion in string.Formatter().parse(text):
+        if format_spec or conversion:
+            raise ValueError(f"Prompt field {field!r} uses a format spec or conversion")
+        parts.append((literal, field))
+    return parts
+
+
+def _render(parts, values):
+    missing = {field for _, field in parts if field is not None} - set(values)
+    if missing:
+        raise KeyError(f"Missing prompt fields: {', '.join(sorted(missing))}")
+    pieces = []
+    for literal, field in parts:
+        pieces.append(literal)
+        if field is not None:
+            pieces.append(str(values[field]))
+    return "".join(pieces)
+
+
+def _partial(parts, values):
+    pieces = []
+    for literal, field in parts:
+        pieces.append(_escape(literal))
+        if field in values:
+            pieces.append(_escape(str(values[field])))
+        elif field is not None:
+            pieces.append("{" + field + "}")
+    return "".join(pieces)
+
+
+class PromptTemplate:
+    """A versioned prompt template, parsed once so rendering is plain string concatenation.
+
+    `version` is part of every cache key built from the prompt: bump it whenever the text
+    changes so plans generated from the old prompt are not reused. Uses str.format syntax
+    (`{{`/`}}` for literal braces), without format specs or conversions.
+
+    `system` holds the instructions that are the same for every input. They are sent as
+    the system prompt, ahead of the user turn rendered from `text`, so Bedrock can cache
+    them as a prefix (see `cached_system`).
+    """
+
+    def __init__(self, version, text, system=None):
+        self.version = version
+        self.text = text
+        self.system = system
+        self._parts = _parse(text)
+        self._system_parts = _parse(system) if system is not None else []
+        self.fields = frozenset(
+            field for _, field in self._parts + self._system_parts if field is not None
+        )
+
+    def render(self, **values):
+        """The user turn"""
+        return _render(self._parts, values)
+
+    def render_system(self, **values):
+        """The system prompt, or None for a template without one"""
+        if self.system is None:
+            return None
+        return _render(self._system_parts, values)
+
+    def partial(self, **values):
+        """A template with some fields filled in, e.g. everything but the input document"""
+        system = _partial(self._system_parts, values) if self.system is not None else None
+        return PromptTemplate(self.version, _partial(self._parts, values), system)
+
+
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def cached_system(text):
+    """A system prompt marked as a prompt cache breakpoint.
+
+    Bedrock caches the request prefix up to the marker (tool definitions, then the system
+    prompt) for five minutes after its last use, and calls starting with the same prefix
+    read it back instead of processing it again. Prefixes shorter than the model's minimum
+    (model_router.PROMPT_CACHE_FAMILIES) are processed as if there were no marker.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+def _without_cache_control(blocks):
+    if not isinstance(blocks, list):
+        return blocks
+    return [
+        {name: value for name, value in block.items() if name != "cache_control"} if isinstance(block, dict) else block
+        for block in blocks
+    ]
+
+
+def encode_body(body, model_id):
+    """The JSON invoke_model body for `model_id`, without cache markers if it can't use them.
+
+    Bodies are built before the router's fallbacks are known, and Bedrock rejects
+    cache_control for models without prompt caching, so markers are dropped per call.
+    """
+    if PROMPT_CACHE and supports_prompt_cache(model_id):
+        return json.dumps(body)
+    body = dict(body)
+    for field in ("system", "tools"):
+        if field in body:
+            body[field] = _without_cache_control(body[field])
+    return json.dumps(body)
+
+
+# Test plan prompt of the API, which asks for UAT cases as a separate list. The instructions
+# and schema are the system prompt and the document is the user turn, so they can be cached
+API_QA_PROMPT = PromptTemplate(
+    "api-v2",
+    "Feature Document:\n{input_document}\n",
+    system="""
+    You are a QA specialist and test automation expert responsible for comprehensive test planning.
+
+    A new feature/requirement or document has been provided as the Feature Document that needs thorough testing coverage across multiple technical test types and UAT test cases.
+
+    Instructions:
+    1. Analyze the provided feature document thoroughly
+    2. Generate a comprehensive test plan focusing on technical test types including:
+    - Unit Tests (individual component/function testing)
+    - Integration Tests (component interaction testing)
+    - UI Tests (user interface testing)
+    - API Tests (endpoint and service testing)
+    - End-to-End Tests (complete user workflow testing)
+    - Performance Tests (load, stress, scalability testing)
+    - Security Tests (vulnerability and penetration testing)
+    - Database Tests (data integrity and CRUD operations)
+    - Contract Tests (API contract validation)
+    - Smoke Tests (basic functionality verification)
+    3. Generate UAT (User Acceptance Test) cases that focus on business requirements validation
+    4. For each test type, provide specific test cases with technical implementation details
+    5. Include test frameworks, tools, and automation approaches
+    6. Consider edge cases, error scenarios, and boundary conditions
+
+    Return the response in this JSON format:
+    {{
+    "test_types": [
+    {{
+    "type": "string",
+    "description": "string", 
+    "test_cases": [
+    {{
+    "name": "string",
+    "objective": "string",
+    "prerequisites": ["string"],
+    "implementation_steps": ["string"],
+    "expected_results": "string"
+    }}
+    ]
+    }}
+    ],
+    "uat_test_cases": [
+    {{
+    "test_case_id": "string",
+    "test_case_name": "string",
+    "test_objective": "string",
+    "preconditions": "string",
+    "test_steps": ["string"],
+    "expected_result": "string",
+    "actual_result": "string",
+    "status": "string"
+    }}
+    ]
+    }}
+""",
+)
+
+# Test plan prompt of the Streamlit app, which asks for UAT cases as one more test type
+UI_QA_PROMPT = PromptTemplate(
+    "ui-v2",
+    "Feature Document:\n{input_document}\n",
+    system="""
+You are a QA specialist and test automation expert responsible for comprehensive test planning.
+
+A new feature/requirement or document has been provided as the Feature Document that needs thorough testing coverage across multiple technical test types and UAT test cases.
+
+Instructions:
+1. Analyze the provided feature document thoroughly
+2. Generate a comprehensive test plan focusing on technical test types including:
+   - Unit Tests (individual component/function testing)
+   - Integration Tests (component interaction testing)
+   - UI Tests (user interface testing)
+   - API Tests (endpoint and service testing)
+   - End-to-End Tests (complete user workflow testing)
+   - Performance Tests (load, stress, scalability testing)
+   - Security Tests (vulnerability and penetration testing)
+   - Database Tests (data integrity and CRUD operations)
+   - Contract Tests (API contract validation)
+   - Smoke Tests (basic functionality verification)
+   - UAT Tests (User Acceptance Test cases for business requirements validation)
+3. For each test type, provide specific test cases with technical implementation details
+4. Include test frameworks, tools, and automation approaches
+5. Consider edge cases, error scenarios, and boundary conditions
+
+Return the response in this JSON format:
+{{
+"test_types": [
+{{
+"type": "string",
+"description": "string", 
+"test_cases": [
+{{
+"name": "string",
+"objective": "string",
+"prerequisites": ["string"],
+"implementation_steps": ["string"],
+"expected_results": "string"
+}}
+]
+}}
+]
+}}
+""",
+)
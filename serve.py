@@ -0,0 +1,40 @@
+"""Serve the API with TESTBUDDY_WORKERS worker processes.
+
+    python serve.py --port 8000
+
+Kept out of main.py: uvicorn starts each worker with the spawn method, which re-runs the
+launching script as `__mp_main__` before importing `main:app`. Were that script main.py,
+every worker would build the app twice and register its metrics twice.
+"""
+import argparse
+import logging
+
+from storage import worker_count
+
+logger = logging.getLogger("testbuddy")
+
+
+def serve(host="0.0.0.0", port=8000):
+    import uvicorn
+    workers = worker_count()
+    if workers == 1:
+        from main import app
+        uvicorn.run(app, host=host, port=port)
+        return
+    from main import recover_stores
+    requeued = recover_stores()
+    logger.info("starting %d workers, %d interrupted jobs re-queued", workers, requeued)
+    # Workers import the app by name; each one builds its own client, executor and job queue
+    uvicorn.run("main:app", host=host, port=port, workers=workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the API with TESTBUDDY_WORKERS worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts the call; callers arriving while it is in flight
+    await the same task and get the same result or exception. The call runs as its own
+    task, so a caller going away (e.g. a client disconnect) doesn't cancel it for the
+    others; once every caller has gone, it is cancelled, so nobody pays for its result.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._waiters = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args, **kwargs):
+        """Run `await fn(*args, **kwargs)` once per in-flight key; returns (result, shared)"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(functools.partial(self._finished, key))
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            self._waiters[task] -= 1
+            if self._waiters[task] == 0:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller has gone away
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._tasks),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,34 @@
+import os
+import sqlite3
+
+# Seconds a connection waits for another process's write lock before raising "database is locked"
+BUSY_TIMEOUT = 30.0
+
+
+def connect(path):
+    """Open one of the app's SQLite files so several worker processes can use it at once.
+
+    WAL journaling lets readers carry on while another process writes, and the busy
+    timeout makes concurrent writers queue for the lock instead of failing. The
+    connection may be used from any thread; callers serialize access with their own lock.
+    """
+    db = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+    db.execute("PRAGMA journal_mode=WAL")
+    # Durable across process crashes; only an OS crash can lose the last commits
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def worker_count():
+    """Worker processes the API is served with (TESTBUDDY_WORKERS), at least 1"""
+    return max(1, int(os.environ.get("TESTBUDDY_WORKERS", "1")))
+
+
+def shared_state_path():
+    """SQLite file through which worker processes share their rate limits and metrics.
+
+    None when the API runs as a single process, which keeps that state in memory.
+    """
+    if worker_count() == 1:
+        return None
+    return os.environ.get("TESTBUDDY_SHARED_STATE_PATH", "testbuddy_shared.sqlite3")
@@ -1,9 +1,30 @@
 import streamlit as st
-import boto3
+import contextvars
+import functools
 import json
-from PyPDF2 import PdfReader
-from docx import Document
-import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from html import escape
+
+from bedrock_client import create_client
+from compaction import compact_input
+from chunking import annotate_chunks, chunk_text, estimate_tokens, merge_plans
+from dedupe import DEFAULT_THRESHOLD, dedupe_plan
+from document_extraction import ExtractionCache, extract_documents, preload_parsers
+import engine
+from engine import TEST_PLAN_MAX_TOKENS, LazyClient, PlanStream, build_test_plan_body, generated_focused_result, generated_plan, prewarm
+from list_models import list_claude_models
+from metrics import enable_request_log, log_trace, observe_stage, span, start_trace
+from model_router import SLO_PRESETS, ModelCatalog, ModelRouter
+from history import PlanHistory, input_hash
+from incremental import SectionPlanStore, annotate_section, prepare_update, save_update
+from fan_out import FOCUSED_MAX_TOKENS, FOCUSED_PROMPT_VERSION, TEST_TYPES, assemble_plan, build_focused_body
+from plan_cache import PlanCache, make_cache_key
+from plan_parser import PlanStreamParser, recover_plan
+from prompts import UI_QA_PROMPT
+from plan_renderer import PAGE_SIZE, CompletionIndex, is_uat_section, page_count, render_section_page_html
 
 st.set_page_config(
     page_title="TestBuddy AI - Test Plan Generator",
@@ -15,12 +36,11 @@ st.set_page_config(
 @st.cache_resource
 def get_bedrock_client():
     try:
-        return boto3.client(
-            'bedrock-runtime',
-            region_name=st.secrets["AWS_DEFAULT_REGION"],
-            aws_access_key_id=st.secrets["AWS_ACCESS_KEY_ID"],
-            aws_secret_access_key=st.secrets["AWS_SECRET_ACCESS_KEY"]
-        )
+        credentials = {
+            "region_name": st.secrets["AWS_DEFAULT_REGION"],
+            "aws_access_key_id": st.secrets["AWS_ACCESS_KEY_ID"],
+            "aws_secret_access_key": st.secrets["AWS_SECRET_ACCESS_KEY"],
+        }
     except Exception as e:
         st.error(f"AWS Credentials Error: {str(e)}")
         st.info("Please configure AWS credentials using one of these methods:")
@@ -32,90 +52,92 @@ def get_bedrock_client():
                 )
         st.stop()
         return None
+    # Created on a background thread while the first page renders, rather than before it
+    client = LazyClient(functools.partial(create_client, 'bedrock-runtime', **credentials))
+    prewarm(client.get, preload_parsers)
+    return client
 
 bedrock = get_bedrock_client()
 
-def extract_text_from_file(uploaded_file):
-    """Extract text from uploaded file based on file type"""
-    try:
-        if uploaded_file.type == "application/pdf":
-            pdf_reader = PdfReader(uploaded_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        
-        elif uploaded_file.type == "text/plain":
-            return str(uploaded_file.read(), "utf-8")
-        
-        elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            doc = Document(uploaded_file)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
-        
-        else:
-            return "Unsupported file format"
-    
-    except Exception as e:
-        return f"Error reading file: {str(e)}"
-
-QA_PROMPT_TEMPLATE = """
-You are a QA specialist and test automation expert responsible for comprehensive test planning.
-
-A new feature/requirement or document has been provided that needs thorough testing coverage across multiple technical test types and UAT test cases.
-
-Feature Document:
-{input_document}
-
-Instructions:
-1. Analyze the provided feature document thoroughly
-2. Generate a comprehensive test plan focusing on technical test types including:
-   - Unit Tests (individual component/function testing)
-   - Integration Tests (component interaction testing)
-   - UI Tests (user interface testing)
-   - API Tests (endpoint and service testing)
-   - End-to-End Tests (complete user workflow testing)
-   - Performance Tests (load, stress, scalability testing)
-   - Security Tests (vulnerability and penetration testing)
-   - Database Tests (data integrity and CRUD operations)
-   - Contract Tests (API contract validation)
-   - Smoke Tests (basic functionality verification)
-   - UAT Tests (User Acceptance Test cases for business requirements validation)
-3. For each test type, provide specific test cases with technical implementation details
-4. Include test frameworks, tools, and automation approaches
-5. Consider edge cases, error scenarios, and boundary conditions
-
-Return the response in this JSON format:
-{{
-"test_types": [
-{{
-"type": "string",
-"description": "string", 
-"test_cases": [
-{{
-"name": "string",
-"objective": "string",
-"prerequisites": ["string"],
-"implementation_steps": ["string"],
-"expected_results": "string"
-}}
-]
-}}
-]
-}}
-"""
+@st.cache_resource
+def get_extraction_pool():
+    # Spawned workers keep PDF/DOCX parsing off the Streamlit script thread
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 2, mp_context=multiprocessing.get_context("spawn"))
+
+@st.cache_resource
+def get_extraction_cache():
+    return ExtractionCache(max_chars=int(os.environ.get("TESTBUDDY_EXTRACTION_CACHE_CHARS", "50000000")))
+
+def extract_uploaded_files(uploaded_files):
+    """Extract text from uploaded files, reusing earlier results for unchanged file contents"""
+    files = [(uploaded_file.name, uploaded_file.type, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    return extract_documents(files, get_extraction_pool(), get_extraction_cache())
 
 def log_debug(message, debug_container=None):
     """Log debug message to sidebar if debug mode is enabled"""
     if debug_container:
         debug_container.write(message)
 
-def generate_test_plan(text_input="", document_texts=None, debug_container=None):
-    log_debug("🔍 Starting test plan generation", debug_container)
-    
-    # Combine all inputs
+# Primary model of requests without an slo, and the only one known when model discovery fails
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+# Versioned in prompts.py; the version is part of every cache key built from it
+QA_PROMPT = UI_QA_PROMPT
+# Inputs larger than this are split into chunks and generated map-reduce style
+CHUNK_TOKENS = int(os.environ.get("TESTBUDDY_CHUNK_TOKENS", "6000"))
+CHUNK_PARALLELISM = int(os.environ.get("TESTBUDDY_CHUNK_PARALLELISM", "4"))
+DEDUPE_THRESHOLD = float(os.environ.get("TESTBUDDY_DEDUPE_THRESHOLD", str(DEFAULT_THRESHOLD)))
+# Set TESTBUDDY_REQUEST_LOG=1 to log one structured JSON line per generation
+REQUEST_LOG = os.environ.get("TESTBUDDY_REQUEST_LOG", "").lower() in ("1", "true", "yes")
+if REQUEST_LOG:
+    enable_request_log()
+
+@st.cache_resource
+def get_plan_cache():
+    return PlanCache(os.environ.get("TESTBUDDY_CACHE_PATH", "testbuddy_cache.sqlite3"))
+
+plan_cache = get_plan_cache()
+
+@st.cache_resource
+def get_section_store():
+    return SectionPlanStore(os.environ.get("TESTBUDDY_SECTION_STORE_PATH", "testbuddy_sections.sqlite3"))
+
+@st.cache_resource
+def get_plan_history():
+    return PlanHistory(os.environ.get("TESTBUDDY_HISTORY_PATH", "testbuddy_history.sqlite3"))
+
+plan_history = get_plan_history()
+HISTORY_ENABLED = os.environ.get("TESTBUDDY_HISTORY", "1").lower() not in ("0", "false", "no")
+
+@st.cache_resource
+def get_model_router():
+    def discover():
+        return list_claude_models(create_client(
+            'bedrock',
+            region_name=st.secrets["AWS_DEFAULT_REGION"],
+            aws_access_key_id=st.secrets["AWS_ACCESS_KEY_ID"],
+            aws_secret_access_key=st.secrets["AWS_SECRET_ACCESS_KEY"]
+        ))
+    catalog = ModelCatalog(discover, fallback=[MODEL_ID], ttl=float(os.environ.get("TESTBUDDY_MODEL_LIST_TTL", "3600")))
+    return ModelRouter(catalog, default_model=MODEL_ID)
+
+model_router = get_model_router()
+
+def choose_models(final_input, slo=None, debug_container=None, test_type_keys=None, max_tokens=TEST_PLAN_MAX_TOKENS):
+    """Route a generation to its models (primary first, then fallbacks)"""
+    input_tokens = estimate_tokens(final_input)
+    if test_type_keys is None:
+        # Large full-plan inputs are chunked, so each call sees at most one chunk
+        input_tokens = min(input_tokens, CHUNK_TOKENS)
+    route = model_router.route(input_tokens, max_tokens, test_type_keys, slo=slo)
+    log_debug(
+        f"🔍 Routed to {route['models'][0]} (~{route['estimated_seconds']}s, ~${route['estimated_cost']}), "
+        f"fallbacks: {', '.join(route['models'][1:]) or 'none'}",
+        debug_container
+    )
+    return route["models"]
+
+def combine_inputs(text_input="", document_texts=None, debug_container=None):
+    """Join the text input and document texts into one input string, or None if empty"""
     combined_input = []
     
     if text_input:
@@ -128,35 +150,279 @@ def generate_test_plan(text_input="", document_texts=None, debug_container=None)
     
     if not combined_input:
         log_debug("🔍 No input provided", debug_container)
-        return {"error": "At least one input is required"}
+        return None
     
-    final_input = "\n\n".join(str(item) for item in combined_input)
+    with span("compaction"):
+        final_input, stats = compact_input("\n\n".join(str(item) for item in combined_input))
+    log_debug(
+        f"🔍 Compacted input: ~{stats['tokens_before']} → ~{stats['tokens_after']} tokens "
+        f"({stats['boilerplate_lines_removed']} boilerplate lines, "
+        f"{stats['duplicate_paragraphs_removed']} duplicate paragraphs removed)",
+        debug_container
+    )
     log_debug(f"🔍 Final input length: {len(final_input)} chars", debug_container)
+    return final_input
+
+def build_request_body(final_input, debug_container=None):
+    body = build_test_plan_body(QA_PROMPT, final_input)
+    log_debug(
+        f"🔍 Prompt prepared ({len(body['messages'][0]['content'])} chars after "
+        f"{len(body['system'][0]['text'])} chars of cacheable instructions)",
+        debug_container
+    )
+    return body
+
+def lookup_cached_plan(final_input, model_id, use_cache, debug_container=None, **params):
+    """Return (cache_key, cached_text); cached_text is None on a miss or when bypassing"""
+    cache_key = make_cache_key(final_input, QA_PROMPT.version, model_id, TEST_PLAN_MAX_TOKENS, **params)
+    if not use_cache:
+        plan_cache.record_bypass()
+        log_debug("🔍 Cache bypassed", debug_container)
+        return cache_key, None
+    cached = plan_cache.get(cache_key)
+    log_debug(f"🔍 Cache {'hit' if cached is not None else 'miss'} ({cache_key[:12]})", debug_container)
+    return cache_key, cached
+
+def debug_logger(debug_container):
+    return lambda message: log_debug(f"🔍 {message}", debug_container)
+
+def invoke_routed(body, models, debug_container=None):
+    """Invoke the first of `models` that isn't throttled or timing out; returns (result, model_id)"""
+    return engine.invoke_routed(bedrock, model_router, body, models, debug_logger(debug_container))
+
+def open_routed_stream(body, models, debug_container=None):
+    """Open a response stream on the first of `models` that accepts it; returns (response, model_id)"""
+    return engine.open_routed_stream(bedrock, model_router, body, models, debug_logger(debug_container))
+
+def invoke_with_continuation(body, models, debug_container=None):
+    """Invoke the routed models, continuing output cut off at max_tokens instead of regenerating it.
+
+    Returns (text, stop_reason).
+    """
+    text, stop_reason, _, _ = engine.invoke_with_continuation(bedrock, model_router, body, models, debug_logger(debug_container))
+    return text, stop_reason
+
+def invoke_chunk(chunk, models):
+    """Generate one chunk's plan; returns (plan, complete), with plan None if it couldn't be parsed"""
+    text, stop_reason = invoke_with_continuation(build_request_body(chunk), models)
+    return generated_plan(text, stop_reason)
+
+def generate_chunked_plan(final_input, models, use_cache=True, debug_container=None):
+    """Generate one partial plan per chunk in parallel and merge them into a single plan"""
+    cache_key, cached = lookup_cached_plan(final_input, models[0], use_cache, debug_container, chunk_tokens=CHUNK_TOKENS)
+    if cached is not None:
+        return cached
     
-    prompt = QA_PROMPT_TEMPLATE.format(input_document=final_input)
-    log_debug(f"🔍 Prompt prepared ({len(prompt)} chars)", debug_container)
+    chunks = chunk_text(final_input, CHUNK_TOKENS)
+    log_debug(f"🔍 Large input split into {len(chunks)} chunks of ≤{CHUNK_TOKENS} tokens", debug_container)
     
-    body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4000,
-        "messages": [{"role": "user", "content": prompt}]
-    }
+    with ThreadPoolExecutor(max_workers=CHUNK_PARALLELISM) as pool:
+        # Each worker runs in a copy of this context so its calls land in the current trace
+        futures = [
+            pool.submit(contextvars.copy_context().run, invoke_chunk, chunk, models)
+            for chunk in annotate_chunks(chunks)
+        ]
+        results = [future.result() for future in futures]
+    
+    plans = [plan for plan, _ in results]
+    failed = sum(1 for plan in plans if plan is None)
+    if failed:
+        log_debug(f"🔍 {failed} of {len(chunks)} chunk plans could not be parsed", debug_container)
+    with span("parse"):
+        text = json.dumps(merge_plans(plans))
+    # Truncated generations are not worth serving again
+    if all(complete for _, complete in results):
+        plan_cache.set(cache_key, text)
+    else:
+        log_debug("🔍 Some chunk plans were incomplete; the merged plan is not cached", debug_container)
+    return text
+
+def generate_incremental_plan(document_id, final_input, models, use_cache=True, debug_container=None):
+    """Generate a plan section by section, reusing the plans of sections unchanged since the
+    spec was last generated under `document_id`"""
+    def section_key(text):
+        return make_cache_key(text, QA_PROMPT.version, models[0], TEST_PLAN_MAX_TOKENS, section=True)
+    
+    store = get_section_store()
+    sections, plans, diff = prepare_update(store, document_id, final_input, CHUNK_TOKENS, section_key, use_cache)
+    log_debug(f"🔍 Spec '{document_id}': {json.dumps(diff)}", debug_container)
+    st.session_state.section_diff = diff
+    
+    pending = [section for section in sections if section["key"] not in plans]
+    with ThreadPoolExecutor(max_workers=CHUNK_PARALLELISM) as pool:
+        futures = {
+            section["key"]: pool.submit(contextvars.copy_context().run, invoke_chunk, annotate_section(section["text"]), models)
+            for section in pending
+        }
+        for key, future in futures.items():
+            plans[key], _ = future.result()
+    
+    with span("parse"):
+        return json.dumps(save_update(store, document_id, sections, plans))
+
+def generate_test_plan(text_input="", document_texts=None, debug_container=None, use_cache=True, slo=None, document_id=None):
+    log_debug("🔍 Starting test plan generation", debug_container)
+    
+    final_input = combine_inputs(text_input, document_texts, debug_container)
+    if final_input is None:
+        return {"error": "At least one input is required"}
+    models = choose_models(final_input, slo, debug_container)
+    
+    if document_id:
+        return generate_incremental_plan(document_id, final_input, models, use_cache, debug_container)
+    
+    if estimate_tokens(final_input) > CHUNK_TOKENS:
+        try:
+            return generate_chunked_plan(final_input, models, use_cache, debug_container)
+        except Exception as e:
+            log_debug(f"🔍 Bedrock API error: {str(e)}", debug_container)
+            raise e
+    
+    cache_key, cached = lookup_cached_plan(final_input, models[0], use_cache, debug_container)
+    if cached is not None:
+        return cached
+    
+    body = build_request_body(final_input, debug_container)
     log_debug("🔍 Calling Bedrock API...", debug_container)
     
     try:
-        response = bedrock.invoke_model(
-            modelId="anthropic.claude-3-5-sonnet-20240620-v1:0",
-            body=json.dumps(body)
-        )
-        log_debug("🔍 Bedrock API call successful", debug_container)
+        text, stop_reason = invoke_with_continuation(body, models, debug_container)
+        log_debug(f"🔍 Bedrock API call successful, content length: {len(text)}", debug_container)
         
-        result = json.loads(response['body'].read())
-        log_debug(f"🔍 Response parsed, content length: {len(result['content'][0]['text'])}", debug_container)
-        return result['content'][0]['text']
+        plan, complete = generated_plan(text, stop_reason)
+        if complete:
+            plan_cache.set(cache_key, json.dumps(plan))
+        return text
     except Exception as e:
         log_debug(f"🔍 Bedrock API error: {str(e)}", debug_container)
         raise e
 
+def stream_test_plan(text_input="", document_texts=None, debug_container=None, use_cache=True, slo=None):
+    """Generate a test plan with a streaming call, yielding parser events as objects complete.
+
+    Yields `(event, payload)` tuples from `PlanStreamParser` followed by a final
+    `("done", {"text", "metrics"})` with the full response text and latency timings.
+    Cached and chunked (map-reduce) plans are replayed through the same events.
+    """
+    log_debug("🔍 Starting streaming test plan generation", debug_container)
+    
+    final_input = combine_inputs(text_input, document_texts, debug_container)
+    if final_input is None:
+        yield "error", {"error": "At least one input is required"}
+        return
+    models = choose_models(final_input, slo, debug_container)
+    
+    started = time.perf_counter()
+    
+    # Chunked plans are generated in parallel and can't be streamed, so replay the merged result
+    if estimate_tokens(final_input) > CHUNK_TOKENS:
+        cache_key, cached = None, generate_chunked_plan(final_input, models, use_cache, debug_container)
+    else:
+        cache_key, cached = lookup_cached_plan(final_input, models[0], use_cache, debug_container)
+    if cached is not None:
+        yield from PlanStreamParser().feed(cached)
+        elapsed = round(time.perf_counter() - started, 3)
+        metrics = {"time_to_first_token": elapsed, "time_to_first_test_case": elapsed, "total_time": elapsed}
+        yield "done", {"text": cached, "metrics": metrics}
+        return
+    
+    body = build_request_body(final_input, debug_container)
+    log_debug("🔍 Calling Bedrock streaming API...", debug_container)
+    plan_stream = PlanStream(body, models, started, debug_logger(debug_container))
+    
+    try:
+        for event, payload in engine.stream_with_continuation(bedrock, model_router, plan_stream, debug_logger(debug_container)):
+            # Continuations are only logged here; the parser events carry on where they stopped
+            if event != "continuation":
+                yield event, payload
+    except Exception as e:
+        log_debug(f"🔍 Bedrock API error: {str(e)}", debug_container)
+        raise e
+    
+    metrics = plan_stream.finish(model_router)
+    log_debug(f"🔍 Stream finished in {metrics['total_time']}s ({plan_stream.parser.test_case_count} test cases)", debug_container)
+    plan, complete = generated_plan(plan_stream.text, plan_stream.stop_reason)
+    if complete:
+        plan_cache.set(cache_key, json.dumps(plan))
+    yield "done", {"text": plan_stream.text, "metrics": metrics}
+
+def invoke_focused(test_type_key, final_input, use_cache, slo=None):
+    models = choose_models(final_input, slo, test_type_keys=[test_type_key], max_tokens=FOCUSED_MAX_TOKENS)
+    cache_key = make_cache_key(final_input, FOCUSED_PROMPT_VERSION, models[0], FOCUSED_MAX_TOKENS, test_type=test_type_key)
+    cached = plan_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        return json.loads(cached)
+    
+    with span("prompt_build"):
+        body = build_focused_body(test_type_key, final_input)
+    text, stop_reason = invoke_with_continuation(body, models)
+    parsed, complete = generated_focused_result(test_type_key, text, stop_reason)
+    if complete:
+        plan_cache.set(cache_key, json.dumps(parsed))
+    return parsed
+
+def fan_out_test_plan(text_input="", document_texts=None, test_type_keys=None, debug_container=None, use_cache=True, slo=None):
+    """Generate each selected test type with its own concurrent request.
+
+    Yields the same events as `stream_test_plan`, emitting each test type as soon as
+    its request finishes, then a final "done" event with the assembled plan text.
+    """
+    log_debug(f"🔍 Starting fan-out generation for {len(test_type_keys)} test types", debug_container)
+    
+    final_input = combine_inputs(text_input, document_texts, debug_container)
+    if final_input is None:
+        yield "error", {"error": "At least one input is required"}
+        return
+    if not use_cache:
+        plan_cache.record_bypass()
+    
+    started = time.perf_counter()
+    metrics = {"time_to_first_token": None, "time_to_first_test_case": None}
+    results = {}
+    
+    with ThreadPoolExecutor(max_workers=len(test_type_keys)) as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, invoke_focused, key, final_input, use_cache, slo): key
+            for key in test_type_keys
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            results[key] = future.result()
+            elapsed = round(time.perf_counter() - started, 3)
+            log_debug(f"🔍 {TEST_TYPES[key][0]} finished after {elapsed}s", debug_container)
+            if metrics["time_to_first_token"] is None:
+                metrics["time_to_first_token"] = metrics["time_to_first_test_case"] = elapsed
+            
+            partial = assemble_plan({key: results[key]}, uat_as_test_type=True)
+            for test_type in partial["test_types"]:
+                yield "test_type", {"type": test_type.get("type", ""), "description": test_type.get("description", "")}
+                for i, test_case in enumerate(test_type.get("test_cases", []), 1):
+                    yield "test_case", {"test_type": test_type.get("type", ""), "index": i, "test_case": test_case}
+    
+    metrics["total_time"] = round(time.perf_counter() - started, 3)
+    yield "done", {"text": json.dumps(assemble_plan(results, uat_as_test_type=True)), "metrics": metrics}
+
+def render_streamed_event(container, event, payload):
+    """Render one streamed test type header or test case as soon as it is complete"""
+    if event == "test_type":
+        container.markdown(f"#### 🔧 {payload['type']}")
+        container.caption(payload['description'])
+    elif event == "test_case":
+        test_case = payload['test_case']
+        container.markdown(f"""
+        <div class="test-card tech-card">
+            <span class="test-title">Test Case {payload['index']}: {escape(str(test_case.get('name', '')))}</span>
+            <div class="objective-text"><strong>🎯 Objective:</strong> {escape(str(test_case.get('objective', '')))}</div>
+        </div>
+        """, unsafe_allow_html=True)
+    elif event == "uat_test_case":
+        test_case = payload['test_case']
+        container.markdown(f"""
+        <div class="test-card uat-card">
+            <span class="test-title">UAT {payload['index']}: {escape(str(test_case.get('test_case_name', '')))}</span>
+        </div>
+        """, unsafe_allow_html=True)
+
 # Enhanced CSS
 st.markdown("""
 <style>
@@ -253,10 +519,31 @@ st.markdown('<p style="text-align: center; color: #666;">Generate comprehensive
 # Sidebar for debug mode and logs
 debug_mode = st.sidebar.checkbox("🐛 Debug Mode", help="Show detailed execution logs")
 debug_container = None
+bypass_cache = st.sidebar.checkbox("♻️ Bypass Cache", help="Always call Bedrock instead of reusing a cached plan")
+model_slo = st.sidebar.selectbox(
+    "🚦 Model Routing",
+    [None] + list(SLO_PRESETS),
+    format_func=lambda slo: "Default" if slo is None else slo.title(),
+    help=f"default: {MODEL_ID}, other models only as fallbacks · fast: lowest latency · "
+         "balanced: cheapest model that suits the input · quality: most capable model"
+)
+dedupe_mode = st.sidebar.selectbox(
+    "🧬 Near-duplicate Test Cases",
+    [None, "flag", "merge"],
+    format_func=lambda mode: "Keep all" if mode is None else mode.title(),
+    help="Flag: mark test cases that repeat another one · Merge: keep only the first of each group"
+)
+spec_id = st.sidebar.text_input(
+    "📄 Spec ID",
+    help="Name the spec to regenerate only its changed sections next time (not used with fan-out)"
+).strip()
 if debug_mode:
     st.sidebar.markdown("### Debug Logs")
     debug_container = st.sidebar.container()
 
+# Stage timings and token counts for this run of the script
+run_trace, _ = start_trace("streamlit")
+
 # Main input section
 st.header("📝 Input Requirements")
 
@@ -282,11 +569,11 @@ uploaded_files = st.file_uploader(
 document_texts = []
 if uploaded_files:
     st.write(f"📄 {len(uploaded_files)} file(s) uploaded:")
-    for uploaded_file in uploaded_files:
-        with st.expander(f"📄 {uploaded_file.name}"):
-            extracted_text = extract_text_from_file(uploaded_file)
-            if extracted_text.startswith("Error") or extracted_text == "Unsupported file format":
-                st.error(extracted_text)
+    for extraction in extract_uploaded_files(uploaded_files):
+        with st.expander(f"📄 {extraction['name']}"):
+            extracted_text = extraction["text"]
+            if extraction["error"]:
+                st.error(extraction["error"])
             else:
                 document_texts.append(extracted_text)
                 st.text_area(
@@ -295,136 +582,255 @@ if uploaded_files:
                     height=100,
                     disabled=True
                 )
-                st.success(f"✅ Text extracted successfully ({len(extracted_text)} characters)")
+                if not extraction["cached"]:
+                    observe_stage("extraction", extraction["seconds"])
+                timing = "cached" if extraction["cached"] else f"{extraction['seconds']}s"
+                st.success(f"✅ Text extracted successfully ({len(extracted_text)} characters, {timing})")
+                log_debug(f"🔍 Extracted {extraction['name']} in {timing}", debug_container)
 
 # Initialize session state
 if 'test_plan' not in st.session_state:
     st.session_state.test_plan = None
 if 'expanded_sections' not in st.session_state:
     st.session_state.expanded_sections = set()
-if 'completed_tests' not in st.session_state:
-    st.session_state.completed_tests = set()
+if 'completion_index' not in st.session_state:
+    st.session_state.completion_index = CompletionIndex()
+if 'stream_metrics' not in st.session_state:
+    st.session_state.stream_metrics = None
+if 'section_diff' not in st.session_state:
+    st.session_state.section_diff = None
+
+def load_test_plan(test_plan_text, dedupe_mode=None):
+    """Parse generated text into a plan, keeping whatever is recoverable from malformed output.
+
+    With `dedupe_mode` ("flag" or "merge") near-duplicate test cases are flagged or merged.
+    """
+    with span("parse"):
+        plan, complete = recover_plan(test_plan_text)
+    if not isinstance(plan, dict):
+        return {"raw_text": test_plan_text}
+    if not complete:
+        st.warning("⚠️ The response was incomplete - showing the test cases that were fully generated.")
+    if dedupe_mode:
+        with span("dedupe"):
+            plan, stats = dedupe_plan(plan, dedupe_mode, DEDUPE_THRESHOLD)
+        if stats["duplicates"]:
+            verb = "merged" if dedupe_mode == "merge" else "flagged"
+            st.info(f"🧬 {stats['duplicates']} near-duplicate test cases {verb} ({stats['groups']} groups)")
+    return plan
 
-# Callback function for checkbox changes
-def on_checkbox_change(section_key, test_name, checkbox_key):
+def remember_plan(plan, text_input="", document_texts=None):
+    """Keep a newly generated plan in the history store; plans served from the cache were kept already"""
+    inputs = ([text_input] if text_input else []) + list(document_texts or [])
+    if not HISTORY_ENABLED or "raw_text" in plan or not inputs or not run_trace.models:
+        return
+    with span("history"):
+        # Hashed as compacted, like combine_inputs, so the hash matches the API's for the same input
+        final_input, _ = compact_input("\n\n".join(str(item) for item in inputs))
+        plan_history.record(
+            plan,
+            input_hash(final_input),
+            model=",".join(run_trace.models),
+            source="streamlit",
+            duration=round(time.perf_counter() - run_trace.started, 4),
+            timings={stage: round(seconds, 4) for stage, seconds in run_trace.stages.items()},
+        )
+
+# Callback functions for section and checkbox changes
+def expand_section(section_key):
+    st.session_state.expanded_sections.add(section_key)
+
+def on_checkbox_change(section_key, index, test_name, checkbox_key):
+    completed = st.session_state[checkbox_key]
+    st.session_state.completion_index.set(section_key, index, completed)
     st.session_state.expanded_sections.add(section_key)
-    st.toast(f"✅ Test completed: {test_name}")
+    if completed:
+        st.toast(f"✅ Test completed: {test_name}")
+
+stream_results = st.checkbox("⚡ Stream results", value=True, help="Show test cases as soon as they are generated")
+fan_out_mode = st.checkbox(
+    "🧩 Generate test types in parallel",
+    help="Send one focused request per test type concurrently - faster, and only the selected types are generated"
+)
+selected_test_types = list(TEST_TYPES)
+if fan_out_mode:
+    selected_test_types = st.multiselect(
+        "Test types",
+        options=list(TEST_TYPES),
+        default=list(TEST_TYPES),
+        format_func=lambda key: TEST_TYPES[key][0]
+    )
 
 # Generate button
-if st.button("🚀 Generate Test Plan", type="primary", use_container_width=True):
+generate_clicked = st.button("🚀 Generate Test Plan", type="primary", use_container_width=True)
+if generate_clicked:
     # Prepare inputs
     text_input_clean = text_input.strip() if text_input.strip() else None
     
     if not text_input_clean and not document_texts:
         st.error("Please provide at least one input (text requirements or upload documents)")
+    elif fan_out_mode and not selected_test_types:
+        st.error("Please select at least one test type")
     else:
-        with st.spinner("Generating comprehensive test plan..."):
-            try:
-                test_plan_text = generate_test_plan(
+        st.session_state.section_diff = None
+        # Incremental regeneration works section by section, so it replaces streaming
+        if fan_out_mode or (stream_results and not spec_id):
+            live_view = st.empty()
+            if fan_out_mode:
+                plan_events = fan_out_test_plan(
                     text_input=text_input_clean or "",
                     document_texts=document_texts if document_texts else None,
-                    debug_container=debug_container
+                    test_type_keys=selected_test_types,
+                    debug_container=debug_container,
+                    use_cache=not bypass_cache,
+                    slo=model_slo
                 )
+            else:
+                plan_events = stream_test_plan(
+                    text_input=text_input_clean or "",
+                    document_texts=document_texts if document_texts else None,
+                    debug_container=debug_container,
+                    use_cache=not bypass_cache,
+                    slo=model_slo
+                )
+            try:
+                test_plan_text = None
+                with live_view.container():
+                    st.info("⚡ Streaming test plan — test cases appear as they are generated...")
+                    for event, payload in plan_events:
+                        if event == "error":
+                            st.error(payload["error"])
+                        elif event == "done":
+                            test_plan_text = payload["text"]
+                            st.session_state.stream_metrics = payload["metrics"]
+                        else:
+                            render_streamed_event(st, event, payload)
                 
-                if isinstance(test_plan_text, dict) and "error" in test_plan_text:
-                    st.error(test_plan_text["error"])
-                else:
-                    try:
-                        st.session_state.test_plan = json.loads(test_plan_text)
-                    except json.JSONDecodeError:
-                        st.session_state.test_plan = {"raw_text": test_plan_text}
+                if test_plan_text is not None:
+                    live_view.empty()
+                    st.session_state.test_plan = load_test_plan(test_plan_text, dedupe_mode)
+                    remember_plan(st.session_state.test_plan, text_input_clean, document_texts)
                         
             except Exception as e:
                 st.error(f"❌ An error occurred: {str(e)}")
+        else:
+            st.session_state.stream_metrics = None
+            with st.spinner("Generating comprehensive test plan..."):
+                try:
+                    test_plan_text = generate_test_plan(
+                        text_input=text_input_clean or "",
+                        document_texts=document_texts if document_texts else None,
+                        debug_container=debug_container,
+                        use_cache=not bypass_cache,
+                        slo=model_slo,
+                        document_id=spec_id or None
+                    )
+                    
+                    if isinstance(test_plan_text, dict) and "error" in test_plan_text:
+                        st.error(test_plan_text["error"])
+                    else:
+                        st.session_state.test_plan = load_test_plan(test_plan_text, dedupe_mode)
+                        remember_plan(st.session_state.test_plan, text_input_clean, document_texts)
+                            
+                except Exception as e:
+                    st.error(f"❌ An error occurred: {str(e)}")
 
 # Display test plan if available
+render_started = time.perf_counter()
 if st.session_state.test_plan:
     if "raw_text" in st.session_state.test_plan:
         st.header("📋 Generated Test Plan")
         st.text_area("Test Plan Output", st.session_state.test_plan["raw_text"], height=400)
     else:
         st.header("🎯 Test Plan Results")
+        if st.session_state.stream_metrics:
+            metrics = st.session_state.stream_metrics
+            st.caption(
+                f"⏱️ First token: {metrics['time_to_first_token']}s · "
+                f"First test case: {metrics['time_to_first_test_case']}s · "
+                f"Total: {metrics['total_time']}s"
+            )
+        if st.session_state.section_diff:
+            diff = st.session_state.section_diff
+            st.caption(
+                f"📄 {diff['sections']} sections · {diff['regenerated']} regenerated "
+                f"({diff['changed']} changed, {diff['added']} added) · {diff['removed']} removed · "
+                f"{diff['sections'] - diff['regenerated']} reused"
+            )
         
+        completion = st.session_state.completion_index
         for test_type in st.session_state.test_plan.get("test_types", []):
-            is_uat = test_type['type'].upper() == 'UAT TESTS' or 'UAT' in test_type['type'].upper()
-            icon = "✅" if is_uat else "🔧"
-            card_class = "uat-card" if is_uat else "tech-card"
-            
+            icon = "✅" if is_uat_section(test_type) else "🔧"
             section_key = test_type['type']
+            test_cases = test_type.get('test_cases', [])
             # Always expand if any test in this section is completed
-            has_completed_tests = any(f"{section_key}_{j}" in st.session_state.completed_tests 
-                                    for j in range(1, len(test_type.get('test_cases', [])) + 1))
-            is_expanded = section_key in st.session_state.expanded_sections or has_completed_tests
+            is_expanded = section_key in st.session_state.expanded_sections or completion.has_completed(section_key)
             
             with st.expander(f"{icon} {test_type['type']}", expanded=is_expanded):
                 st.markdown(f"**📋 Description:** {test_type['description']}")
-                st.markdown("---")
+                if not is_expanded:
+                    # Collapsed sections are rendered lazily: the cards are only built once opened
+                    st.button(
+                        f"Show {len(test_cases)} test cases",
+                        key=f"show_{section_key}",
+                        on_click=expand_section,
+                        args=(section_key,)
+                    )
+                    continue
                 
-                for i, test_case in enumerate(test_type.get('test_cases', []), 1):
-                    col1, col2 = st.columns([0.05, 0.95])
-                    
-                    with col1:
-                        checkbox_key = f"{test_type['type']}_{i}"
-                        checkbox_value = st.checkbox(
-                            "Complete", 
-                            key=checkbox_key, 
-                            label_visibility="collapsed",
-                            on_change=on_checkbox_change,
-                            args=(section_key, test_case['name'], checkbox_key)
-                        )
-                        
-                        # Track completed tests
-                        if checkbox_value:
-                            st.session_state.completed_tests.add(checkbox_key)
-                        elif checkbox_key in st.session_state.completed_tests:
-                            st.session_state.completed_tests.remove(checkbox_key)
-                    
-                    with col2:
-                        st.markdown(f"""
-                        <div class="test-card {card_class}">
-                            <div class="test-header">
-                                <span class="test-title">Test Case {i}: {test_case['name']}</span>
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        st.markdown(f"""
-                        <div class="objective-text">
-                            <strong>🎯 Objective:</strong> {test_case['objective']}
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        if test_case.get('prerequisites'):
-                            st.markdown('<div class="test-section-title">📋 Prerequisites</div>', unsafe_allow_html=True)
-                            st.markdown('<div class="test-list">', unsafe_allow_html=True)
-                            for prereq in test_case['prerequisites']:
-                                st.markdown(f"""
-                                <div class="test-list-item">
-                                    <span class="test-bullet">▶</span>
-                                    <span>{prereq}</span>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            st.markdown('</div>', unsafe_allow_html=True)
-                        
-                        if test_case.get('implementation_steps'):
-                            st.markdown('<div class="test-section-title">⚙️ Implementation Steps</div>', unsafe_allow_html=True)
-                            st.markdown('<div class="test-list">', unsafe_allow_html=True)
-                            for step in test_case['implementation_steps']:
-                                st.markdown(f"""
-                                <div class="test-list-item">
-                                    <span class="test-bullet">🔸</span>
-                                    <span>{step}</span>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            st.markdown('</div>', unsafe_allow_html=True)
-                        
-                        st.markdown(f"""
-                        <div class="expected-result">
-                            <strong>✅ Expected Results:</strong> {test_case['expected_results']}
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        st.markdown("<br>", unsafe_allow_html=True)
+                st.markdown(f"---\n**{completion.completed_count(section_key)} of {len(test_cases)} completed**")
+                pages = page_count(test_type)
+                page = 1
+                if pages > 1:
+                    page = st.selectbox(
+                        "Page",
+                        options=range(1, pages + 1),
+                        key=f"page_{section_key}",
+                        format_func=lambda number: f"Page {number} of {pages}"
+                    )
+                
+                start = (page - 1) * PAGE_SIZE
+                columns = st.columns(5)
+                for offset, test_case in enumerate(test_cases[start:start + PAGE_SIZE]):
+                    index = start + offset + 1
+                    checkbox_key = f"{section_key}_{index}"
+                    columns[offset % 5].checkbox(
+                        f"Test Case {index}",
+                        key=checkbox_key,
+                        value=completion.is_completed(section_key, index),
+                        on_change=on_checkbox_change,
+                        args=(section_key, index, test_case.get('name', ''), checkbox_key)
+                    )
+                
+                st.markdown(render_section_page_html(test_type, page, completion), unsafe_allow_html=True)
+
+observe_stage("render", time.perf_counter() - render_started)
+if run_trace.stages:
+    log_debug(f"🔍 Stage timings: {json.dumps(run_trace.to_dict('ok', time.perf_counter() - run_trace.started))}", debug_container)
+if REQUEST_LOG and generate_clicked:
+    log_trace(run_trace, "ok")
+
+# Search across every plan generated so far, by test case name, objective and steps
+with st.expander("🔎 Search Plan History"):
+    history_query = st.text_input("Search test cases", placeholder="e.g. password reset expired link", key="history_query")
+    if history_query.strip():
+        search_started = time.perf_counter()
+        history_results = plan_history.search(history_query, limit=50)
+        search_ms = (time.perf_counter() - search_started) * 1000
+        history_stats = plan_history.stats()
+        st.caption(
+            f"{len(history_results)} matching test cases in {search_ms:.1f} ms · "
+            f"{history_stats['plans']} plans, {history_stats['test_cases']} test cases stored"
+        )
+        for result in history_results:
+            test_case = result["test_case"]
+            name = test_case.get("name") or test_case.get("test_case_name") or "Unnamed test case"
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(result["created_at"]))
+            st.markdown(f"**{name}** · {result['test_type']} · plan #{result['plan_id']} · {created}")
+            st.caption(result["snippet"])
+
+cache_stats = plan_cache.stats()
+st.sidebar.caption(f"♻️ Plan cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · {cache_stats['disk_entries']} stored")
 
 # Footer
 st.markdown("---")